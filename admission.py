@@ -0,0 +1,179 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, NamedTuple, Optional
+
+# turnos gerando ao mesmo tempo em um backend
+MAX_CONCURRENT = 2
+# pedidos esperando na fila; acima disso o pedido é recusado (429)
+MAX_QUEUE = 32
+# quem espera recebe a posição de novo a cada HEARTBEAT segundos, mesmo sem mudança
+HEARTBEAT = 15.0
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class Overloaded(RuntimeError):
+    """Fila cheia: o pedido deve ser recusado, sugerindo tentar em ``retry_after`` segundos."""
+
+    def __init__(self, backend: str, retry_after: int):
+        super().__init__(f"backend {backend} sobrecarregado; tente em {retry_after}s")
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+class AdmissionStats(NamedTuple):
+    running: int
+    waiting: int
+    max_concurrent: int
+    max_queue: int
+
+
+class Ticket:
+    """Lugar de um pedido na fila; ``admitted`` fica pronto quando ele pode rodar."""
+
+    def __init__(self, client: str):
+        self.client = client
+        self.admitted = asyncio.get_running_loop().create_future()
+        self.started: Optional[float] = None
+
+
+class AdmissionController:
+    """Limita os turnos simultâneos de um backend, com fila justa entre clientes.
+
+    Até ``max_concurrent`` pedidos rodam ao mesmo tempo; os demais esperam numa
+    fila de até ``max_queue`` lugares e, com ela cheia, ``enqueue`` levanta
+    :class:`Overloaded`. A fila é por cliente e as vagas são dadas em rodízio
+    entre os clientes, então quem manda muitos pedidos não atrasa os outros.
+    Um objeto por backend; todo o uso é no mesmo event loop.
+    """
+
+    def __init__(
+        self,
+        backend: str,
+        *,
+        max_concurrent: int = MAX_CONCURRENT,
+        max_queue: int = MAX_QUEUE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.backend = backend
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._clock = clock
+        # cliente → pedidos esperando; a ordem das chaves é a vez de cada cliente
+        self._queues: "OrderedDict[str, Deque[Ticket]]" = OrderedDict()
+        self._waiting = 0
+        self._running = 0
+        self._changed = asyncio.Event()
+        # média móvel de quanto tempo um pedido ocupa a vaga, para o Retry-After
+        self._hold_time: Optional[float] = None
+
+    @property
+    def stats(self) -> AdmissionStats:
+        return AdmissionStats(self._running, self._waiting, self.max_concurrent, self.max_queue)
+
+    def retry_after(self) -> int:
+        """Segundos sugeridos no Retry-After, pela fila atual e a duração média dos turnos."""
+        hold = self._hold_time or 5.0
+        rounds = (self._waiting + 1) / max(self.max_concurrent, 1)
+        return max(1, min(60, math.ceil(hold * rounds)))
+
+    def enqueue(self, client: str) -> Ticket:
+        ticket = Ticket(client)
+        if self._running < self.max_concurrent and not self._waiting:
+            self._admit(ticket)
+            return ticket
+        if self._waiting >= self.max_queue:
+            raise Overloaded(self.backend, self.retry_after())
+        self._queues.setdefault(client, deque()).append(ticket)
+        self._waiting += 1
+        self._notify()
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """Posição na fila (1 = o próximo a rodar); 0 se já foi admitido ou saiu."""
+        queue = self._queues.get(ticket.client)
+        if ticket.admitted.done() or not queue or ticket not in queue:
+            return 0
+        index = queue.index(ticket)
+        position = 1
+        for client, other in self._queues.items():
+            if client == ticket.client:
+                # antes dele, cada cliente ainda serve até `index` pedidos na sua vez
+                position += sum(min(len(q), index) for c, q in self._queues.items() if c != client)
+                break
+            # clientes na frente do rodízio atendem um pedido a mais nesta rodada
+            position += 1 if len(other) > index else 0
+        return position + index
+
+    async def wait(self, ticket: Ticket, on_position: Optional[PositionCallback] = None, *, heartbeat: float = HEARTBEAT) -> None:
+        """Espera a vez do pedido, chamando ``on_position`` quando a posição muda."""
+        last = None
+        while not ticket.admitted.done():
+            changed = self._changed
+            position = self.position(ticket)
+            if on_position is not None and position and position != last:
+                await on_position(position)
+                last = position
+            # asyncio.wait e não wait_for: no 3.11 o wait_for pode engolir um cancelamento
+            signal = asyncio.ensure_future(changed.wait())
+            try:
+                done, _ = await asyncio.wait({signal}, timeout=heartbeat)
+            finally:
+                signal.cancel()
+            if not done:
+                last = None  # repete a posição: mantém a conexão viva e detecta quem saiu
+        await ticket.admitted
+
+    def release(self, ticket: Ticket) -> None:
+        """Libera a vaga de um pedido admitido ou tira da fila um que ainda espera."""
+        if ticket.admitted.done():
+            if ticket.started is None:
+                return
+            held = self._clock() - ticket.started
+            self._hold_time = held if self._hold_time is None else 0.8 * self._hold_time + 0.2 * held
+            ticket.started = None
+            self._running -= 1
+        else:
+            queue = self._queues.get(ticket.client)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                self._waiting -= 1
+                if not queue:
+                    del self._queues[ticket.client]
+            ticket.admitted.cancel()
+        self._dispatch()
+        self._notify()
+
+    @asynccontextmanager
+    async def admit(self, client: str, on_position: Optional[PositionCallback] = None) -> AsyncIterator[Ticket]:
+        """Ocupa uma vaga durante o bloco; levanta :class:`Overloaded` com a fila cheia."""
+        ticket = self.enqueue(client)
+        try:
+            await self.wait(ticket, on_position)
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def _admit(self, ticket: Ticket) -> None:
+        self._running += 1
+        ticket.started = self._clock()
+        ticket.admitted.set_result(None)
+
+    def _dispatch(self) -> None:
+        while self._running < self.max_concurrent and self._queues:
+            client, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            self._waiting -= 1
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            self._admit(ticket)
+
+    def _notify(self) -> None:
+        # acorda todos os que esperam; cada um recalcula a própria posição
+        self._changed.set()
+        self._changed = asyncio.Event()
@@ -1,22 +1,32 @@
+import asyncio
+import logging
+import threading
 import uuid
 import os
 import re
+from contextlib import aclosing
 from datetime import datetime
 from dotenv import load_dotenv
 
-from langchain.tools import Tool
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.prebuilt import create_react_agent
-from langchain_core.messages import HumanMessage
-from langchain_ollama import ChatOllama
-from langchain_openai import ChatOpenAI
-from mail import get_emails, delete_email_by_id
-import tiktoken
+from langchain_core.tools import Tool
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from mail import get_emails, get_email_bodies, delete_email_by_id, mark_unread_as_read
+from checkpoint_storage import SQLiteCheckpointSaver, ensure_thread_state
+from async_bridge import with_deadline
+from conversation_storage import load_conversation
+from llm_cache import ENABLED as LLM_CACHE_ENABLED, UNCACHEABLE_TOOLS, LLMCache, make_key
+from history_policy import POLICIES, RollingSummaryPolicy, context_tokens_for
+from token_accounting import StreamTokenCounter, count_tokens
+from tool_output import ToolOutputShaper
+from metrics import TurnTimer, timed
 
 from pydantic import BaseModel
 from typing import List
 
 
+logger = logging.getLogger(__name__)
+
 # ====== CARREGAR VARIÁVEIS DE AMBIENTE (.env) ======
 load_dotenv()
 OPENROUTER_API_KEY = os.getenv("API_KEY")
@@ -25,41 +35,141 @@ OPENROUTER_MODEL = os.getenv("MODEL", "openchat/openchat-3.5")
 # ====== SELETOR DE PROVEDOR ======
 # "local" → usa Ollama localmente
 # "openrouter" → usa serviço online
+# "router" → usa os provedores de ROUTER_BACKENDS, escolhendo o mais rápido a cada turno
 MODE = os.getenv("MODE", "local")  # Altere aqui para "openrouter" se quiser mudar o provedor
 
 # ====== MODELOS LOCAIS DISPONÍVEIS ======
 LOCAL_MODEL = os.getenv("LOCAL_MODEL", "mistral")  # Ex: mistral, openchat, llama3
 
+# ====== ROTEADOR DE PROVEDORES ======
+# provedores do modo "router", na ordem de preferência enquanto não há medições
+ROUTER_BACKENDS = [name.strip() for name in os.getenv("ROUTER_BACKENDS", "local,openrouter").split(",") if name.strip()]
+# sem o primeiro token nesse tempo, o turno passa para o próximo provedor (segundos)
+ROUTER_FIRST_TOKEN_TIMEOUT = float(os.getenv("ROUTER_FIRST_TOKEN_TIMEOUT", "30"))
+# se definido, inicia também o próximo provedor quando o primeiro token demora mais que isso
+ROUTER_HEDGE_AFTER = float(os.getenv("ROUTER_HEDGE_AFTER")) if os.getenv("ROUTER_HEDGE_AFTER") else None
+
+# nome do modelo em uso, também usado para escolher o tokenizer na contagem de tokens
+# (no modo "router", o do primeiro provedor da lista)
+_PRIMARY = ROUTER_BACKENDS[0] if MODE == "router" and ROUTER_BACKENDS else MODE
+MODEL_NAME = OPENROUTER_MODEL if _PRIMARY == "openrouter" else LOCAL_MODEL
+
+# tempo máximo de um turno no modo assíncrono (segundos)
+TURN_TIMEOUT = float(os.getenv("TURN_TIMEOUT", "300"))
+# quantos caracteres de cada resultado de ferramenta vão para as fontes da resposta
+SOURCE_PREVIEW_CHARS = 300
+
+# ====== POLÍTICA DE HISTÓRICO ======
+# "window" (janela deslizante), "middle_out" ou "summary" (resumo dos turnos antigos)
+HISTORY_POLICY = os.getenv("HISTORY_POLICY", "window")
+
+# ====== SAÍDA DAS FERRAMENTAS ======
+# orçamento de tokens de cada resultado de ferramenta (padrão: 1/4 da janela de contexto)
+TOOL_OUTPUT_TOKENS = int(os.getenv("TOOL_OUTPUT_TOKENS", "0")) or context_tokens_for(MODEL_NAME) // 4
+
+# ====== OLLAMA ======
+OLLAMA_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# por quanto tempo o Ollama mantém o modelo carregado depois do último uso
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# OLLAMA_WARMUP=0 desliga o pré-carregamento do modelo na inicialização
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "1") != "0"
+
 # ====== INSTÂNCIA DO MODELO ======
-if MODE == "openrouter":
-    print(f"🌐 Usando modelo remoto via OpenRouter: {OPENROUTER_MODEL}")
-    chat = ChatOpenAI(
-        model_name=OPENROUTER_MODEL,
-        openai_api_key=OPENROUTER_API_KEY,
-        base_url="https://openrouter.ai/api/v1",
-        temperature=0.1,
-        #max_tokens=200,
-    )
-else:
-    print(f"🖥️ Usando modelo local via Ollama: {LOCAL_MODEL}")
-    chat = ChatOllama(
+# o modelo e o agente só são criados no primeiro uso, uma vez por processo; só
+# o pacote do provedor escolhido em MODE chega a ser importado
+_chat = None
+_agent = None
+_build_lock = threading.Lock()
+
+
+def _build_backend(kind):
+    if kind == "openrouter":
+        from langchain_openai import ChatOpenAI
+
+        logger.info(f"🌐 Usando modelo remoto via OpenRouter: {OPENROUTER_MODEL}")
+        return ChatOpenAI(
+            model_name=OPENROUTER_MODEL,
+            openai_api_key=OPENROUTER_API_KEY,
+            base_url="https://openrouter.ai/api/v1",
+            temperature=0.1,
+            #max_tokens=200,
+        )
+
+    from langchain_ollama import ChatOllama
+
+    logger.info(f"🖥️ Usando modelo local via Ollama: {LOCAL_MODEL}")
+    return ChatOllama(
         model=LOCAL_MODEL,
-        base_url="http://localhost:11434",
+        base_url=OLLAMA_URL,
         temperature=0.1,
         max_tokens=200,
+        keep_alive=OLLAMA_KEEP_ALIVE,
     )
 
-# ====== CONTAGEM DE TOKENS ======
-def print_token_usage(label, message, model_name="gpt-4"):
-    num_tokens = count_tokens(message, model_name=model_name)
-    print(f"🧮 {label} – Tokens: {num_tokens}")
 
-def count_tokens(message, model_name="gpt-4"):
-    """
-    Conta tokens usando a biblioteca tiktoken.
+def _build_chat():
+    if MODE != "router":
+        return _build_backend(MODE)
+
+    from router_chat_model import RouterChatModel
+
+    logger.info(f"🔀 Roteando entre os provedores: {', '.join(ROUTER_BACKENDS)}")
+    return RouterChatModel.from_backends(
+        {name: _build_backend(name) for name in ROUTER_BACKENDS},
+        first_token_timeout=ROUTER_FIRST_TOKEN_TIMEOUT,
+        hedge_after=ROUTER_HEDGE_AFTER,
+    )
+
+
+def get_chat():
+    global _chat
+    if _chat is None:
+        with _build_lock:
+            if _chat is None:
+                _chat = _build_chat()
+    return _chat
+
+
+def warm_up():
+    """Prepara o processo em segundo plano, antes da primeira pergunta.
+
+    Compila o agente e, no modo local, carrega o modelo na memória do Ollama
+    (com keep_alive), para que o primeiro turno não pague esse custo.
+    Retorna a thread iniciada.
     """
-    encoding = tiktoken.encoding_for_model(model_name)
-    return len(encoding.encode(message))
+
+    def load():
+        get_agent()
+        uses_ollama = MODE == "local" or (MODE == "router" and "local" in ROUTER_BACKENDS)
+        if not uses_ollama or not OLLAMA_WARMUP:
+            return
+        import requests
+
+        try:
+            # um generate sem prompt só carrega o modelo
+            requests.post(
+                f"{OLLAMA_URL}/api/generate",
+                json={"model": LOCAL_MODEL, "keep_alive": OLLAMA_KEEP_ALIVE},
+                timeout=300,
+            ).raise_for_status()
+            logger.info(f"🔥 Modelo {LOCAL_MODEL} carregado no Ollama")
+        except Exception as exc:
+            logger.warning(f"⚠️ Não foi possível pré-carregar o modelo {LOCAL_MODEL}: {exc}")
+
+    thread = threading.Thread(target=load, name="agent-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+# ====== CACHE DE RESPOSTAS ======
+# opcional (LLM_CACHE=1): títulos, resumos e primeiros turnos sem ferramentas de hora/e-mail
+llm_cache = LLMCache(enabled=LLM_CACHE_ENABLED)
+
+# ====== CONTAGEM DE TOKENS ======
+# count_tokens (token_accounting) mantém um encoder por modelo em cache no processo
+def print_token_usage(label, message, model_name=MODEL_NAME):
+    num_tokens = count_tokens(message, model_name=model_name)
+    logger.debug(f"🧮 {label} – Tokens: {num_tokens}")
 
 
 
@@ -76,20 +186,68 @@ def generate_conversation_title(messages):
         "Resuma a conversa abaixo em um titulo curto (maximo 5 palavras).\n\n"
     )
     text = "\n".join(m["content"] for m in messages[-2:])
-    resp = chat.invoke([HumanMessage(content=prompt + text)])
-    return resp.content.strip()
+    request = [HumanMessage(content=prompt + text)]
+    return llm_cache.cached(
+        make_key(MODEL_NAME, request, "title"),
+        lambda: get_chat().invoke(request).content.strip(),
+        MODEL_NAME,
+    )
 
 def get_current_datetime(args=None) -> datetime:
     current_date = datetime.now()
-    print(f"📅 Data e hora atual: {current_date}")
+    logger.debug(f"📅 Data e hora atual: {current_date}")
     return current_date
 
 
 # ====== FERRAMENTAS ======
+# as saídas de e-mail passam pelo shaper: JSON compacto, textos cortados no
+# começo e um handle ("mais") para a ferramenta ReadMore buscar o resto
+tool_output = ToolOutputShaper(TOOL_OUTPUT_TOKENS, model_name=MODEL_NAME)
+
+
+def report_tool_output(report):
+    if report.tokens_dropped:
+        logger.info(
+            f"✂️ Saída de {report.tool_name}: {report.tokens_before} → {report.tokens_after} tokens "
+            f"({report.tokens_dropped} omitidos, {report.handles} handle(s))"
+        )
+
+
+def _tool_owner(config):
+    # os handles de ReadMore pertencem à conversa que recebeu a saída cortada
+    return (config or {}).get("configurable", {}).get("thread_id", "")
+
+
+def get_emails_tool(status: str = "unread", config: RunnableConfig = None) -> str:
+    """GetEmails ajustado ao orçamento; só os e-mails que chegam ao modelo são marcados como lidos."""
+    emails = get_emails(status, mark_as_read=False)
+    output, report = tool_output.shape_with_report(emails, "GetEmails", owner=_tool_owner(config))
+    report_tool_output(report)
+    if isinstance(emails, list):
+        # os itens omitidos (itens_omitidos) continuam não lidos
+        mark_unread_as_read(emails[: report.items_after])
+    return output
+
+
+def get_email_bodies_tool(message_ids: List[str], config: RunnableConfig = None) -> str:
+    output, report = tool_output.shape_with_report(
+        get_email_bodies(message_ids), "GetEmailBodies", owner=_tool_owner(config)
+    )
+    report_tool_output(report)
+    return output
+
+
+def read_more_tool(handle: str, config: RunnableConfig = None) -> str:
+    return tool_output.read_more(handle, owner=_tool_owner(config))
+
+
 #Definição do Schema para a ferramenta de deletar e-mails
 class DeleteEmailsInput(BaseModel):
     message_ids: List[str]
 
+class EmailBodiesInput(BaseModel):
+    message_ids: List[str]
+
 tools = [
     Tool(
         name="GetCurrentDateTime",
@@ -98,7 +256,7 @@ tools = [
     ),
     Tool(
         name="GetEmails",
-        func=get_emails,
+        func=get_emails_tool,
         description=(
             "Busca e-mails da caixa de entrada. "
             "Pode filtrar por status ('unread', 'read' ou 'all'), por assunto, (exemplo: get_emails(\"unread\", limit=10, mark_as_read=False, subject_keyword=None))"
@@ -108,8 +266,26 @@ tools = [
             "'Listar os e-mails lidos com assunto projeto', "
             "'Buscar todos os e-mails recentes e marcar como lidos'."
             "Quando responder, retorne o assunto e a data de recebimento dos e-mails em horário local. "
+            "Retorna só cabeçalhos e o início do texto (preview); para ler o conteúdo completo use GetEmailBodies. "
         )
     ),
+    Tool(
+        name="GetEmailBodies",
+        func=get_email_bodies_tool,
+        description=(
+            "Busca o conteúdo completo de e-mails pelo ID. Use com IDs retornados pela função GetEmails, "
+            "apenas quando o preview não for suficiente para responder. Mande os IDs como uma lista."
+        ),
+        args_schema=EmailBodiesInput,
+    ),
+    Tool(
+        name="ReadMore",
+        func=read_more_tool,
+        description=(
+            "Continua um texto que veio cortado (terminado em '…') na saída de outra ferramenta. "
+            "Passe o valor do campo 'mais' (ex: hX7k2pQ9a). Só use se o trecho recebido não bastar."
+        ),
+    ),
     Tool(
     name="DeleteEmailById",
     func=delete_email_by_id,
@@ -121,49 +297,226 @@ tools = [
 )
 ]
 
+# cada chamada de ferramenta é medida (histograma tool_call_seconds, por ferramenta)
+for _tool in tools:
+    _tool.func = timed("tool_call", tool=_tool.name)(_tool.func)
+
 # ====== AGENTE REACT COM MEMÓRIA ======
-memory = MemorySaver()
-
-agent_executor = create_react_agent(
-    model=chat,
-    tools=tools,
-    #reasoning="zero-shot-react-description",
-    checkpointer=memory,
-    prompt=("Você é um assistente Pessoal. Responda às perguntas do usuário com clareza e precisão. Não retorne o Thinking Processing para o usuário."
-            "Se for de manhã entre 8:00 e 12:00, pergunte ao usuário se ele quer saber sobre os e-mails não lidos. "
-            ),
-    #response_format="text",
+# checkpoints persistidos no conversations.db (só os últimos de cada conversa)
+memory = SQLiteCheckpointSaver()
+
+SYSTEM_PROMPT = (
+    "Você é um assistente Pessoal. Responda às perguntas do usuário com clareza e precisão. Não retorne o Thinking Processing para o usuário."
+    "Se for de manhã entre 8:00 e 12:00, pergunte ao usuário se ele quer saber sobre os e-mails não lidos. "
 )
 
+
+def summarize_history(previous_summary, messages):
+    """Resume mensagens antigas (partindo do resumo anterior) para a política "summary"."""
+    text = "\n".join(f"{m.type}: {m.text()}" for m in messages if m.text())
+    prompt = (
+        "Atualize o resumo da conversa com as novas mensagens, em poucas frases, "
+        "mantendo nomes, datas e pedidos do usuário.\n\n"
+        f"Resumo atual: {previous_summary or '(vazio)'}\n\nNovas mensagens:\n{text}"
+    )
+    request = [HumanMessage(content=prompt)]
+    return llm_cache.cached(
+        make_key(MODEL_NAME, request, "summary"),
+        lambda: get_chat().invoke(request).content.strip(),
+        MODEL_NAME,
+    )
+
+
+def report_history(report):
+    if report.tokens_saved:
+        logger.info(
+            f"✂️ Histórico: {report.tokens_before} → {report.tokens_after} tokens "
+            f"({report.messages_before} → {report.messages_after} mensagens)"
+        )
+
+
+# o histórico completo continua no checkpoint; a política só escolhe o que vai para o modelo
+policy_cls = POLICIES[HISTORY_POLICY]
+if policy_cls is RollingSummaryPolicy:
+    history_policy = policy_cls.for_model(MODEL_NAME, summarize=summarize_history)
+else:
+    history_policy = policy_cls.for_model(MODEL_NAME)
+
+def get_agent():
+    """Agente ReAct compilado (criado uma vez por processo, no primeiro uso)."""
+    global _agent
+    if _agent is None:
+        chat = get_chat()
+        with _build_lock:
+            if _agent is None:
+                from langgraph.prebuilt import create_react_agent
+
+                _agent = create_react_agent(
+                    model=chat,
+                    tools=tools,
+                    #reasoning="zero-shot-react-description",
+                    checkpointer=memory,
+                    prompt=history_policy.as_prompt(SYSTEM_PROMPT, on_report=report_history),
+                    #response_format="text",
+                )
+    return _agent
+
+
+def __getattr__(name):
+    # mantém agente_graph.chat e agente_graph.agent_executor, agora criados sob demanda
+    if name == "chat":
+        return get_chat()
+    if name == "agent_executor":
+        return get_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # ====== CHATBOT STREAMING ======
 
-def chatbot(user_input, thread_id):
-    config = {"configurable": {"thread_id": thread_id, "session_timeout": 3600}}
+def _turn_config(thread_id):
+    return {"configurable": {"thread_id": thread_id, "session_timeout": 3600}}
+
+
+def _turn_input(user_input):
     content = user_input["content"]
 
     # Compressão do prompt (usando middle-out)
     compressed_content = content  # compress_middle_out(content, max_length=200)
 
-    # Extraindo o nome do modelo para contagem de tokens
-    model_name = OPENROUTER_MODEL if MODE == "openrouter" else LOCAL_MODEL
-    model_name = model_name.split("/")[1]  # Pegando a parte após a barra
-
     # Log de tokens do input
     print_token_usage("🔹 Input do usuário", compressed_content)
+    return {"messages": [HumanMessage(content=compressed_content)]}
+
+
+def _report_output_tokens(output_tokens, turn):
+    # o total de tokens da saída é contado em segundo plano; com ele saem as métricas do turno
+    def report(total):
+        logger.debug(f"🔸 Total de tokens da saída: {total.result()}")
+        turn.report(total.result())
+
+    output_tokens.total_async().add_done_callback(report)
+
+
+def _report_cached_turn(turn, response):
+    turn.labels["cache"] = "hit"
+    turn.first_token()
+    turn.report(count_tokens(response, model_name=MODEL_NAME))
+
+
+def _turn_cache_key(user_input, state):
+    # só o primeiro turno é cacheável: depois dele a resposta depende do histórico
+    if not llm_cache.enabled or state.values.get("messages"):
+        return None
+    return make_key(
+        MODEL_NAME,
+        [{"role": "system", "content": SYSTEM_PROMPT}, user_input],
+        {"tools": sorted(t.name for t in tools)},
+    )
+
+
+def _cached_turn_update(user_input, response):
+    """Atualização de estado que registra no agente um turno respondido pelo cache."""
+    stats = llm_cache.stats()
+    logger.info(f"♻️ Resposta do cache ({stats.hits} acertos, {stats.misses} faltas)")
+    return {"messages": [HumanMessage(content=user_input["content"]), AIMessage(content=response)]}
+
+
+def _store_turn(cache_key, output_tokens, used_tools):
+    if cache_key and not used_tools & UNCACHEABLE_TOOLS:
+        llm_cache.put(cache_key, output_tokens.text, MODEL_NAME)
+
+
+def chatbot(user_input, thread_id):
+    config = _turn_config(thread_id)
+    turn = TurnTimer(model=MODEL_NAME, mode="sync", cache="miss")
+    agent_executor = get_agent()
+
+    # conversa antiga sem checkpoint: recarrega o histórico salvo no agente
+    ensure_thread_state(agent_executor, config, load_conversation)
+
+    cache_key = _turn_cache_key(user_input, agent_executor.get_state(config))
+    if cache_key and (cached := llm_cache.get(cache_key)) is not None:
+        agent_executor.update_state(config, _cached_turn_update(user_input, cached), as_node="agent")
+        _report_cached_turn(turn, cached)
+        yield cached
+        return
+
+    # os pedaços só são guardados aqui; a contagem roda depois, fora do streaming
+    output_tokens = StreamTokenCounter(MODEL_NAME)
+    used_tools = set()
+
+    try:
+        for step, metadata in agent_executor.stream(
+            _turn_input(user_input),
+            config,
+            stream_mode="messages",
+        ):
+            if metadata["langgraph_node"] == "agent" and (text := step.text()):
+                turn.first_token()
+                output_tokens.add(text)
+                yield text
+            elif metadata["langgraph_node"] == "tools":
+                used_tools.add(step.name)
+    except GeneratorExit:
+        turn.finish("cancelled")
+        raise
+    except BaseException:
+        turn.finish("error")
+        raise
+    finally:
+        turn.finish()
+        _report_output_tokens(output_tokens, turn)
+    _store_turn(cache_key, output_tokens, used_tools)
+
+
+async def achatbot(user_input, thread_id, *, timeout=TURN_TIMEOUT):
+    """Versão assíncrona de ``chatbot``.
+
+    Produz pedaços de texto (``str``) e, a cada resultado de ferramenta, a
+    lista de fontes acumulada (``list``). Fechar o gerador ou cancelar a
+    tarefa interrompe a geração e libera a conexão com o modelo; passado
+    ``timeout`` segundos o turno termina com ``asyncio.TimeoutError``.
+    """
+    config = _turn_config(thread_id)
+    turn = TurnTimer(model=MODEL_NAME, mode="async", cache="miss")
+    agent_executor = await asyncio.to_thread(get_agent)
+    await asyncio.to_thread(ensure_thread_state, agent_executor, config, load_conversation)
+
+    cache_key = _turn_cache_key(user_input, await agent_executor.aget_state(config))
+    if cache_key and (cached := await asyncio.to_thread(llm_cache.get, cache_key)) is not None:
+        await agent_executor.aupdate_state(config, _cached_turn_update(user_input, cached), as_node="agent")
+        _report_cached_turn(turn, cached)
+        yield cached
+        return
 
-    total_output_tokens = 0  # Variável para acumular os tokens da saída
-
-    for step, metadata in agent_executor.stream(
-        {"messages": [HumanMessage(content=compressed_content)]},
-        config,
-        stream_mode="messages",
-    ):
-        if metadata["langgraph_node"] == "agent" and (text := step.text()):
-            # Log de tokens da resposta
-            num_tokens = count_tokens(text)
-            total_output_tokens += num_tokens
-            #print_token_usage("🔸 Resposta do agente (parcial)", text)
-            yield text
-
-    # Exibir o total de tokens da saída
-    print(f"🔸 Total de tokens da saída: {total_output_tokens}")
+    output_tokens = StreamTokenCounter(MODEL_NAME)
+    sources = []
+    try:
+        stream = agent_executor.astream(_turn_input(user_input), config, stream_mode="messages")
+        async with aclosing(with_deadline(stream, timeout)) as steps:
+            async for step, metadata in steps:
+                node = metadata["langgraph_node"]
+                if node == "agent" and (text := step.text()):
+                    turn.first_token()
+                    output_tokens.add(text)
+                    yield text
+                elif node == "tools" and step.type == "tool":
+                    sources.append(
+                        {"ferramenta": step.name, "resultado": step.text()[:SOURCE_PREVIEW_CHARS]}
+                    )
+                    yield list(sources)
+    except (asyncio.CancelledError, GeneratorExit):
+        turn.finish("cancelled")
+        logger.info(f"⏹️ Geração cancelada na conversa {thread_id}")
+        raise
+    except asyncio.TimeoutError:
+        turn.finish("timeout")
+        raise
+    except BaseException:
+        turn.finish("error")
+        raise
+    finally:
+        turn.finish()
+        _report_output_tokens(output_tokens, turn)
+    # só chega aqui o turno que terminou; interrompido não vai para o cache
+    used_tools = {source["ferramenta"] for source in sources}
+    await asyncio.to_thread(_store_turn, cache_key, output_tokens, used_tools)
@@ -1,23 +1,42 @@
+import logging
 import streamlit as st
+from contextlib import closing
 from agente_graph import (
     generate_thread_id,
-    chatbot,
+    achatbot,
     generate_conversation_title,
+    warm_up,
 )
+from async_bridge import background_loop
+from background_tasks import heuristic_title, post_turn_worker, title_worker
+from stream_renderer import StreamRenderer
+from metrics import configure_logging
 from conversation_storage import (
     save_conversation,
-    load_conversation,
-    list_conversations,
+    load_conversation_window,
+    LazySources,
+    list_conversations_page,
     delete_conversation,
     rename_conversation,
     search_conversations,
 )
-import asyncio
 
+# LOG_LEVEL e LOG_FORMAT controlam o que aparece no terminal
+configure_logging()
+logger = logging.getLogger(__name__)
 
 st.title("Assistente Virtual - Chatbot")
 
 
+@st.cache_resource
+def start_agent():
+    # uma vez por processo: compila o agente e carrega o modelo enquanto a página abre
+    return warm_up()
+
+
+start_agent()
+
+
 # desloca o container do User um pouco pra direita, similar ao ChatGPT
 st.markdown(
     "<style>.st-emotion-cache-janbn0 {margin-left: 100px;}</style>",
@@ -26,6 +45,9 @@ st.markdown(
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
+# seq da primeira mensagem carregada; as anteriores ficam no banco até serem pedidas
+if "start_seq" not in st.session_state:
+    st.session_state.start_seq = 0
 
 # verifica se existe um uid de sessão
 if "uid" not in st.session_state:
@@ -33,13 +55,35 @@ if "uid" not in st.session_state:
 if "title" not in st.session_state:
     st.session_state.title = None
 
+
+def reset_older_convs():
+    """Descarta as páginas extras da lista; elas voltam a ser pedidas com o cursor novo."""
+    # após excluir, renomear ou salvar, os títulos e a ordem por updated_at mudam e o cursor guardado fica velho
+    st.session_state.older_convs = []
+    st.session_state.older_cursor = None
+
+
 with st.sidebar:
     st.header("Conversas")
     search = st.text_input("Buscar")
+
+    # conversas mais antigas são carregadas sob demanda, página a página
+    if "older_convs" not in st.session_state:
+        reset_older_convs()
+
+    next_cursor = None
     if search:
         convs = search_conversations(search)
     else:
-        convs = list_conversations()
+        page = list_conversations_page()
+        seen = {conv.thread_id for conv in page.items}
+        convs = page.items + [
+            conv for conv in st.session_state.older_convs if conv.thread_id not in seen
+        ]
+        if st.session_state.older_convs:
+            next_cursor = st.session_state.older_cursor
+        else:
+            next_cursor = page.next_cursor
     st.markdown(
         """
         <style>
@@ -57,13 +101,21 @@ with st.sidebar:
     if "menu_action" not in st.session_state:
         st.session_state.menu_action = None
 
-    for tid, title in convs:
+    for tid, title, *meta in convs:
         st.markdown("<div class='conv-row'>", unsafe_allow_html=True)
         # use a small gap since Streamlit only accepts "small", "medium" or "large"
         row = st.columns([0.88, 0.12], gap="small")
         label = title if title else tid[:8]
-        if row[0].button(label, key=f"conv-{tid}", use_container_width=True):
-            st.session_state.messages = load_conversation(tid)
+        hint = None
+        if meta:
+            _, count, last_message = meta
+            hint = f"{count} mensagens" + (f" · {last_message}" if last_message else "")
+        if row[0].button(label, key=f"conv-{tid}", help=hint, use_container_width=True):
+            # o último turno dessa conversa pode ainda estar sendo salvo
+            post_turn_worker.wait(tid, timeout=10)
+            window = load_conversation_window(tid)
+            st.session_state.messages = window.messages
+            st.session_state.start_seq = window.start_seq
             st.session_state.uid = tid
             st.session_state.title = title
             st.session_state.open_menu = None
@@ -93,6 +145,7 @@ with st.sidebar:
                 col_save, col_cancel = st.columns(2)
                 if col_save.button("Salvar", key=f"btn-save-{tid}") and new_title:
                     rename_conversation(tid, new_title)
+                    reset_older_convs()
                     if st.session_state.uid == tid:
                         st.session_state.title = new_title
                     st.session_state.open_menu = None
@@ -104,9 +157,12 @@ with st.sidebar:
                 st.warning("Confirmar exclusão?")
                 col_yes, col_no = st.columns(2)
                 if col_yes.button("Confirmar", key=f"btn-conf-{tid}"):
+                    post_turn_worker.wait(tid, timeout=10)
                     delete_conversation(tid)
+                    reset_older_convs()
                     if st.session_state.uid == tid:
                         st.session_state.messages = []
+                        st.session_state.start_seq = 0
                         st.session_state.uid = generate_thread_id()
                         st.session_state.title = None
                     st.session_state.open_menu = None
@@ -116,29 +172,58 @@ with st.sidebar:
                     st.session_state.menu_action = None
         st.markdown("</div>", unsafe_allow_html=True)
 
+    if next_cursor and st.button("Carregar mais"):
+        older = list_conversations_page(cursor=next_cursor)
+        st.session_state.older_convs += older.items
+        st.session_state.older_cursor = older.next_cursor
+        st.rerun()
+
     st.divider()
     if st.button("Nova conversa"):
+        reset_older_convs()
         st.session_state.messages = []
+        st.session_state.start_seq = 0
         st.session_state.uid = generate_thread_id()
         st.session_state.title = None
         st.rerun()
 
 
-def print_sources(sources):
-    if sources:
-        with st.expander(
-            "_**FONTES** e respectivas relevâncias (range % não limitado):_",
-            expanded=False,
-        ):
-            st.json(sources, expanded=True)
+def print_sources(sources, key):
+    # o conteúdo de um expander é montado a cada rerun mesmo fechado; com o
+    # toggle as fontes só são decodificadas e renderizadas quando abertas
+    if sources and st.toggle(
+        "_**FONTES** e respectivas relevâncias (range % não limitado):_",
+        key=f"sources-{key}",
+    ):
+        if isinstance(sources, LazySources):
+            sources = sources.value
+        st.json(sources, expanded=True)
 
 
-for message in st.session_state.messages:
+def refine_title(thread_id, messages, provisional_title):
+    """Troca o título provisório pelo gerado pelo LLM, se o usuário não renomeou."""
+    title = generate_conversation_title(messages)
+    if title:
+        # só a troca volta para a fila da conversa, depois do save que criou a linha
+        post_turn_worker.submit(
+            thread_id, rename_conversation, thread_id, title, expected_title=provisional_title
+        )
+
+
+if st.session_state.start_seq > 0 and st.button("Carregar mensagens anteriores"):
+    older = load_conversation_window(
+        st.session_state.uid, before_seq=st.session_state.start_seq
+    )
+    st.session_state.messages = older.messages + st.session_state.messages
+    st.session_state.start_seq = older.start_seq
+    st.rerun()
+
+for seq, message in enumerate(st.session_state.messages, st.session_state.start_seq):
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
         sources = message.get("sources")
-        print_sources(sources)
+        print_sources(sources, key=seq)
 
 if prompt := st.chat_input("De que você precisa?"):
     # user_details = get_authenticated_user_details()
@@ -160,33 +245,58 @@ if prompt := st.chat_input("De que você precisa?"):
 
         # print("messages")
         # print(messages)
-        message_stream = chatbot(messages[-1], thread_id=st.session_state.uid)
+        # a geração roda no loop assíncrono compartilhado; se a sessão for
+        # interrompida (usuário saiu ou mandou outra mensagem), closing()
+        # cancela a tarefa e o modelo para de gerar
+        message_stream = background_loop.iterate(
+            achatbot(messages[-1], thread_id=st.session_state.uid)
+        )
 
         # print("message_stream")
         # print(message_stream)
 
         sources = []
-        text_response = ""
         response_container = st.empty()
+        # a tela é atualizada em intervalos, não a cada token; o fim do bloco
+        # garante que o texto completo seja mostrado
+        renderer = StreamRenderer(response_container.markdown)
 
-        for chunk in message_stream:
-            if isinstance(chunk, list):
-                sources = chunk
-            else:
-                text_response += chunk
-                response_container.write(text_response)
+        with closing(message_stream), renderer:
+            for chunk in message_stream:
+                if isinstance(chunk, list):
+                    sources = chunk
+                else:
+                    renderer.add(chunk)
+        text_response = renderer.text
+        stats = renderer.stats
+        logger.debug(
+            f"🖼️ Renderização: {stats.chunks} pedaços, {stats.flushes} atualizações, "
+            f"{stats.bytes_sent} bytes enviados"
+        )
 
     #    print_sources(sources)
 
     st.session_state.messages.append(
         {"role": "assistant", "content": text_response, "sources": sources}
     )
+
+    # salvar e gerar o título ficam para depois da resposta, em segundo plano;
+    # o título provisório aparece na hora e é trocado quando o do LLM chegar
+    uid = st.session_state.uid
+    new_title = None
     if st.session_state.title is None and len(st.session_state.messages) >= 2:
-        st.session_state.title = generate_conversation_title(
-            st.session_state.messages
-        )
-    save_conversation(
-        st.session_state.uid,
-        st.session_state.messages,
-        title=st.session_state.title,
+        new_title = st.session_state.title = heuristic_title(st.session_state.messages)
+    post_turn_worker.submit(
+        uid,
+        save_conversation,
+        uid,
+        list(st.session_state.messages),
+        title=new_title,
+        start_seq=st.session_state.start_seq,
     )
+    # a conversa salva sobe para o topo da lista
+    reset_older_convs()
+    if new_title:
+        title_worker.submit(
+            uid, refine_title, uid, st.session_state.messages[-2:], new_title
+        )
@@ -0,0 +1,116 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+from typing import AsyncIterator, Awaitable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+_ITEM, _DONE, _ERROR = range(3)
+# de quanto em quanto tempo (segundos) quem consome confere se a tarefa e o loop ainda estão vivos
+POLL_SECONDS = 0.5
+
+
+class BackgroundLoop:
+    """Um event loop asyncio numa thread própria, compartilhado pelo processo.
+
+    Cada sessão do Streamlit roda numa thread; em vez de cada uma ficar presa
+    esperando o LLM, as gerações rodam como tarefas neste loop e as threads só
+    consomem os pedaços já prontos.
+    """
+
+    def __init__(self, name: str = "assistente-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name=self.name, daemon=True).start()
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, coro: Awaitable[T]) -> "Future[T]":
+        """Agenda ``coro`` no loop; o resultado chega num ``concurrent.futures.Future``."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def iterate(self, agen: AsyncIterator[T]) -> Iterator[T]:
+        """Consome um gerador assíncrono a partir de código síncrono.
+
+        Se quem consome parar antes do fim (``close()``, exceção, sessão do
+        Streamlit encerrada), a tarefa no loop é cancelada e o gerador
+        assíncrono é fechado, liberando a conexão com o modelo. Se a tarefa
+        terminar sem avisar (cancelada no loop) ou o loop parar, quem consome
+        recebe um erro em vez de esperar para sempre.
+        """
+        items: "queue.Queue[tuple]" = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put((_ITEM, item))
+            except asyncio.CancelledError:
+                raise
+            except BaseException as exc:
+                items.put((_ERROR, exc))
+            else:
+                items.put((_DONE, None))
+            finally:
+                await agen.aclose()
+
+        loop = self.loop
+        future = self.submit(pump())
+        try:
+            while True:
+                try:
+                    kind, value = items.get(timeout=POLL_SECONDS)
+                except queue.Empty:
+                    if not future.done() and loop.is_running():
+                        continue
+                    if not items.empty():
+                        # terminou entre o get e a conferência: o fim já está na fila
+                        continue
+                    if future.done() and not future.cancelled() and future.exception() is not None:
+                        raise future.exception()
+                    raise RuntimeError("a geração em segundo plano terminou sem concluir")
+                if kind == _ITEM:
+                    yield value
+                elif kind == _ERROR:
+                    raise value
+                else:
+                    return
+        finally:
+            future.cancel()
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+
+async def with_deadline(agen: AsyncIterator[T], timeout: float) -> AsyncIterator[T]:
+    """Repassa os itens de ``agen`` por até ``timeout`` segundos no total.
+
+    Passado o prazo levanta ``asyncio.TimeoutError`` e fecha ``agen``. Faz o
+    papel do ``asyncio.timeout``, que só existe a partir do Python 3.11, e só
+    conta o tempo de espera pelo próximo item, não o de quem consome.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(agen.__anext__(), max(deadline - loop.time(), 0))
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        await agen.aclose()
+
+
+# loop compartilhado por todas as sessões do processo
+background_loop = BackgroundLoop()
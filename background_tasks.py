@@ -0,0 +1,118 @@
+import atexit
+import logging
+import queue
+import re
+import threading
+import zlib
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 2
+MAX_PENDING = 100
+TITLE_MAX_WORDS = 5
+
+_STOP = object()
+
+
+class PostTurnWorker:
+    """Executa tarefas de pós-turno (salvar, gerar título) fora da resposta.
+
+    São ``workers`` threads, cada uma com uma fila limitada a ``max_pending``
+    tarefas; quem enfileira espera quando a fila está cheia. Tarefas com a
+    mesma chave (o ``thread_id`` da conversa) vão sempre para a mesma thread,
+    então rodam na ordem em que foram enviadas.
+    """
+
+    def __init__(self, workers: int = WORKERS, max_pending: int = MAX_PENDING):
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=max_pending) for _ in range(workers)]
+        self._last: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, args=(q,), name=f"post-turn-{i}", daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+        self._closed = False
+        for t in self._threads:
+            t.start()
+
+    @staticmethod
+    def _run(tasks: queue.Queue) -> None:
+        while True:
+            item = tasks.get()
+            if item is _STOP:
+                return
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as exc:
+                logger.warning(f"⚠️ Erro em tarefa de pós-turno ({getattr(fn, '__name__', fn)}): {exc}")
+                future.set_exception(exc)
+
+    def submit(self, key: str, fn: Callable, *args, **kwargs) -> Future:
+        if self._closed:
+            raise RuntimeError("PostTurnWorker já foi encerrado")
+        future: Future = Future()
+        # crc32 é estável entre execuções, diferente de hash() para str
+        tasks = self._queues[zlib.crc32(key.encode()) % len(self._queues)]
+        with self._lock:
+            self._last[key] = future
+        tasks.put((future, fn, args, kwargs))
+        future.add_done_callback(lambda f, key=key: self._forget(key, f))
+        return future
+
+    def _forget(self, key: str, future: Future) -> None:
+        with self._lock:
+            if self._last.get(key) is future:
+                del self._last[key]
+
+    def wait(self, key: str, timeout: Optional[float] = None) -> None:
+        """Espera as tarefas já enviadas para ``key`` terminarem."""
+        with self._lock:
+            future = self._last.get(key)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+
+    @property
+    def pending(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def shutdown(self, wait: bool = True, timeout: Optional[float] = None) -> None:
+        """Para de aceitar tarefas e, com ``wait``, termina as que já estão na fila."""
+        if self._closed:
+            return
+        self._closed = True
+        for q in self._queues:
+            q.put(_STOP)
+        if wait:
+            for t in self._threads:
+                t.join(timeout)
+
+
+def heuristic_title(messages: List[dict], max_words: int = TITLE_MAX_WORDS) -> str:
+    """Título provisório a partir da primeira mensagem do usuário, sem chamar o LLM."""
+    first = next((m["content"] for m in messages if m.get("role") == "user" and m.get("content")), "")
+    words = re.sub(r"\s+", " ", first).strip().split(" ")[:max_words]
+    title = " ".join(words).rstrip(".,;:!?")
+    if not title:
+        return "Nova conversa"
+    if len(words) == max_words and len(first.split()) > max_words:
+        title += "…"
+    return title[0].upper() + title[1:]
+
+
+post_turn_worker = PostTurnWorker()
+# chamadas ao LLM para o título ficam fora das filas de salvamento: um título
+# lento não atrasa o save de outras conversas nem o wait() da barra lateral
+title_worker = PostTurnWorker(workers=1)
+# ao encerrar o processo, termina de salvar o que ainda está na fila; os
+# títulos pendentes são abandonados (o provisório já está salvo). atexit roda
+# em ordem inversa, então os títulos param antes do salvamento
+atexit.register(post_turn_worker.shutdown)
+atexit.register(title_worker.shutdown, wait=False)
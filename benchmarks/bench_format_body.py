@@ -0,0 +1,135 @@
+"""Compara o format_body antigo (regex) com o conversor de html_text.
+
+Uso:
+    python benchmarks/bench_format_body.py [pasta com .html/.htm/.eml]
+
+Sem pasta, usa um corpus sintético com newsletters grandes numa linha só
+(tabelas aninhadas, muitos links, CSS inline e âncoras sem fechamento) e
+e-mails indentados em várias linhas, como os do Outlook (divs MsoNormal,
+&nbsp;, citações). Para medir com e-mails reais, exporte alguns corpos HTML
+para uma pasta e passe o caminho.
+"""
+import email
+import pathlib
+import random
+import re
+import statistics
+import sys
+import time
+from email import policy
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from html_text import html_to_text  # noqa: E402
+
+REPEAT = 5
+
+
+def legacy_format_body(html):
+    """format_body como era antes do html_text (seis re.sub sobre o documento inteiro)."""
+    def replace_link(match):
+        return f"[{match.group(2).strip()}]({match.group(1).strip()})"
+
+    html = re.sub(r'<a\s+[^>]*href=["\'](.*?)["\'][^>]*>(.*?)</a>', replace_link, html, flags=re.DOTALL | re.IGNORECASE)
+    html = re.sub(r'<style.*?>.*?</style>', '', html, flags=re.DOTALL | re.IGNORECASE)
+    html = re.sub(r'<[^>]+>', '', html)
+    html = re.sub(r'&nbsp;|&#160;', ' ', html)
+    html = re.sub(r'\s+', ' ', html)
+    html = re.sub(r'(\n\s*){2,}', '\n', html)
+    return html.strip()
+
+
+def synthetic_newsletter(rng, blocks):
+    parts = ["<html><head><style>" + "td{padding:0}" * 200 + "</style></head><body><table>"]
+    for i in range(blocks):
+        parts.append(
+            f"<tr><td style='font-family:Arial;color:#333'><table><tr><td>"
+            f"<h2>Oferta {i}</h2><p>{'Texto da promoção &amp; detalhes. ' * rng.randint(5, 30)}</p>"
+            f"<a href='https://example.com/c?id={i}&amp;utm=news' class='btn'>Ver oferta {i}</a>"
+            f"</td></tr></table></td></tr>"
+        )
+        if i % 25 == 0:
+            # âncora sem fechamento: pior caso para o padrão não guloso
+            parts.append("<a href='https://example.com/broken' style='x'>")
+    parts.append("</table></body></html>")
+    return "".join(parts)
+
+
+def indented_email(rng, paragraphs):
+    """E-mail com a cara dos reais: marcação indentada em várias linhas e uma resposta citada."""
+    words = "reunião projeto relatório cliente proposta prazo equipe revisão agenda".split()
+    lines = [
+        "<html>",
+        "  <head>",
+        "    <style>",
+        "      p.MsoNormal { margin: 0cm; font-family: Calibri, sans-serif; }",
+        "    </style>",
+        "  </head>",
+        "  <body lang=\"PT-BR\">",
+        "    <div class=\"WordSection1\">",
+    ]
+    for i in range(paragraphs):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(10, 40)))
+        lines += [
+            "      <p class=\"MsoNormal\">",
+            f"        <span style=\"font-size:11.0pt\">{text}</span>",
+            "        <o:p>&nbsp;</o:p>",
+            "      </p>",
+        ]
+        if i % 10 == 9:
+            lines += [
+                "      <ul>",
+                *(f"        <li>item {n}: <a href=\"https://example.com/{i}/{n}\">ver</a></li>" for n in range(3)),
+                "      </ul>",
+                "      <blockquote style=\"border-left:solid #E1E1E1 1.0pt\">",
+                f"        <div><b>De:</b> pessoa{i}@example.com<br>",
+                "          <b>Enviado:</b> segunda-feira</div>",
+                "      </blockquote>",
+            ]
+    lines += ["    </div>", "  </body>", "</html>"]
+    return "\n".join(lines)
+
+
+def load_corpus(folder):
+    corpus = []
+    for path in sorted(pathlib.Path(folder).iterdir()):
+        if path.suffix in (".html", ".htm"):
+            corpus.append((path.name, path.read_text(errors="replace")))
+        elif path.suffix == ".eml":
+            msg = email.message_from_bytes(path.read_bytes(), policy=policy.default)
+            part = msg.get_body(preferencelist=("html",))
+            if part is not None:
+                corpus.append((path.name, part.get_content()))
+    return corpus
+
+
+def measure(fn, html):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(html)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    if len(sys.argv) > 1:
+        corpus = load_corpus(sys.argv[1])
+    else:
+        rng = random.Random(42)
+        corpus = [(f"newsletter-{n}", synthetic_newsletter(rng, n)) for n in (50, 200, 800)]
+        corpus += [(f"indentado-{n}", indented_email(rng, n)) for n in (20, 200, 2000)]
+
+    print(f"{'documento':<24}{'KB':>8}{'regex ms':>12}{'parser ms':>12}{'parser+cap ms':>15}")
+    for name, html in corpus:
+        legacy = measure(legacy_format_body, html)
+        parser = measure(html_to_text, html)
+        capped = measure(lambda h: html_to_text(h, max_chars=8000), html)
+        print(
+            f"{name[:23]:<24}{len(html) / 1024:>8.0f}{legacy * 1000:>12.1f}"
+            f"{parser * 1000:>12.1f}{capped * 1000:>15.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Mede o custo de inicialização do agente_graph.
+
+Uso:
+    python benchmarks/bench_startup.py [repetições]
+
+Cada repetição roda num processo novo (como um processo do Streamlit) e mede:
+  - import: tempo de ``import agente_graph``;
+  - agente: tempo de ``get_agent()`` (cria o modelo e compila o grafo).
+Nenhuma chamada ao modelo é feita. Mostra também os módulos mais caros do
+import, segundo ``python -X importtime``.
+"""
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+_PROBE = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import agente_graph
+imported = time.perf_counter()
+agente_graph.get_agent()
+built = time.perf_counter()
+print(json.dumps({{"import": imported - start, "agent": built - imported,
+                   "openai": "langchain_openai" in sys.modules,
+                   "ollama": "langchain_ollama" in sys.modules}}))
+"""
+
+
+def run_probe(env):
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(root=str(ROOT))],
+        capture_output=True, text=True, env=env, cwd=ROOT, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def slowest_imports(env, top=10):
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {str(ROOT)!r}); import agente_graph"],
+        capture_output=True, text=True, env=env, cwd=ROOT,
+    ).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:  self [us] | cumulative | imported package"
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    env = dict(os.environ, OLLAMA_WARMUP="0")
+    runs = [run_probe(env) for _ in range(repeat)]
+
+    for key in ("import", "agent"):
+        values = [r[key] * 1000 for r in runs]
+        print(f"{key:<8} mediana {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms")
+    print(f"provedores importados: openai={runs[0]['openai']} ollama={runs[0]['ollama']} (MODE={env.get('MODE', 'local')})")
+
+    print("\nmódulos mais caros no import (acumulado):")
+    for cumulative_us, name in slowest_imports(env):
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
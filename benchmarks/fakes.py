@@ -0,0 +1,211 @@
+"""Backends falsos para os benchmarks: um Microsoft Graph local e um modelo de chat determinístico.
+
+O ``FakeGraphServer`` responde em HTTP de verdade (127.0.0.1, porta livre),
+então o mail.py é medido com a sessão, o JSON e a paginação reais; só a rede
+e o Graph ficam de fora. Implementa o necessário para o mail.py:
+
+- GET /me/messages (``$filter`` de isRead, ``$top``, ``$skip`` e nextLink);
+- GET /me/mailFolders/inbox/messages/delta (rodada completa e mudanças);
+- POST /$batch com GET (corpo), PATCH (isRead) e DELETE.
+"""
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+WORDS = (
+    "reunião projeto relatório cliente proposta contrato fatura entrega prazo equipe "
+    "orçamento revisão agenda pedido suporte acesso sistema atualização versão teste"
+).split()
+
+
+def message_id(i):
+    # ids do Graph são longos (base64); o tamanho pesa no JSON e no SQLite
+    return f"AAMkAGI2TG93AAA{i:08d}" + "A" * 120
+
+
+def html_body(rng, paragraphs):
+    parts = ["<html><head><style>p{margin:0}</style></head><body>"]
+    for _ in range(paragraphs):
+        words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 60)))
+        parts.append(f"<p>{words} <a href='https://example.com/{rng.randint(0, 999)}'>link</a></p>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+class FakeGraphServer:
+    """Graph local com ``count`` mensagens; ``latency`` simula o tempo de rede (segundos)."""
+
+    def __init__(self, count=500, *, latency=0.0, seed=42):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._seed = seed
+        self.reset(count)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # cabeçalho e corpo saem em writes separados; com Nagle, o ACK atrasado soma ~40 ms
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload=None):
+                body = b"" if payload is None else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                time.sleep(server.latency)
+                self._reply(*server.handle_get(self.path, self.headers))
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                time.sleep(server.latency)
+                self._reply(200, {"responses": [server.handle_batch_item(req) for req in payload["requests"]]})
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def reset(self, count):
+        rng = random.Random(self._seed)
+        with self._lock:
+            self.messages = {
+                message_id(i): {
+                    "id": message_id(i),
+                    "subject": f"{rng.choice(WORDS)} {rng.choice(WORDS)} #{i}",
+                    "from": {"emailAddress": {"address": f"pessoa{i % 37}@example.com"}},
+                    "receivedDateTime": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}T{i % 24:02d}:00:00Z",
+                    "bodyPreview": " ".join(rng.choice(WORDS) for _ in range(40)),
+                    "isRead": i % 3 == 0,
+                    "body": {"contentType": "html", "content": html_body(rng, 30)},
+                }
+                for i in range(count)
+            }
+            self.removed = []
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    # ====== GET ======
+
+    @staticmethod
+    def _summary(msg):
+        return {key: value for key, value in msg.items() if key != "body"}
+
+    def handle_get(self, path, headers):
+        url = urlsplit(path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        with self._lock:
+            if url.path.endswith("/delta"):
+                return 200, self._delta(url.path, query, headers)
+            if url.path == "/me/messages":
+                return 200, self._listing(url.path, query)
+        return 404, {"error": {"code": "NotFound"}}
+
+    def _listing(self, path, query):
+        items = sorted(self.messages.values(), key=lambda m: m["receivedDateTime"], reverse=True)
+        flt = query.get("$filter", "")
+        if "isRead eq false" in flt:
+            items = [m for m in items if not m["isRead"]]
+        elif "isRead eq true" in flt:
+            items = [m for m in items if m["isRead"]]
+        top, skip = int(query.get("$top", 10)), int(query.get("$skip", 0))
+        page = {"value": [self._summary(m) for m in items[skip:skip + top]]}
+        if skip + top < len(items):
+            rest = "&".join(f"{k}={v}" for k, v in query.items() if k != "$skip")
+            page["@odata.nextLink"] = f"{self.url}{path}?{rest}&$skip={skip + top}"
+        return page
+
+    def _delta(self, path, query, headers):
+        if "deltatoken" in query:
+            # só o que foi apagado desde a última rodada
+            changes, self.removed = [{"id": i, "@removed": {"reason": "deleted"}} for i in self.removed], []
+            return {"value": changes, "@odata.deltaLink": f"{self.url}{path}?deltatoken=1"}
+        prefer = headers.get("Prefer", "")
+        size = int(prefer.split("odata.maxpagesize=")[1]) if "odata.maxpagesize=" in prefer else 100
+        skip = int(query.get("skiptoken", 0))
+        items = list(self.messages.values())
+        page = {"value": [self._summary(m) for m in items[skip:skip + size]]}
+        if skip + size < len(items):
+            page["@odata.nextLink"] = f"{self.url}{path}?skiptoken={skip + size}"
+        else:
+            self.removed = []
+            page["@odata.deltaLink"] = f"{self.url}{path}?deltatoken=1"
+        return page
+
+    # ====== $batch ======
+
+    def handle_batch_item(self, req):
+        msg_id = req["url"].split("?")[0].rsplit("/", 1)[-1]
+        with self._lock:
+            msg = self.messages.get(msg_id)
+            if msg is None:
+                return {"id": req["id"], "status": 404, "body": {"error": {"code": "ErrorItemNotFound"}}}
+            if req["method"] == "GET":
+                return {"id": req["id"], "status": 200, "body": {"id": msg_id, "body": msg["body"]}}
+            if req["method"] == "DELETE":
+                del self.messages[msg_id]
+                self.removed.append(msg_id)
+                return {"id": req["id"], "status": 204}
+            msg.update(req.get("body") or {})
+            return {"id": req["id"], "status": 200, "body": self._summary(msg)}
+
+
+def fake_chat_model(reply, tool_calls_every=0):
+    """Modelo de chat determinístico (precisa do langchain_core).
+
+    Responde sempre ``reply`` em streaming, palavra a palavra. Com
+    ``tool_calls_every=n``, a cada n turnos pede antes a ferramenta
+    GetCurrentDateTime, para medir também o caminho com ferramentas.
+    """
+    from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_core.outputs import ChatGenerationChunk
+
+    class FakeChat(GenericFakeChatModel):
+        def bind_tools(self, tools, **kwargs):
+            return self
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            # o GenericFakeChatModel perde os tool_calls no streaming; aqui eles vão num pedaço só
+            message = self._generate(messages, stop=stop, run_manager=run_manager, **kwargs).generations[0].message
+            if message.tool_calls:
+                call_chunks = [
+                    {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                    for i, call in enumerate(message.tool_calls)
+                ]
+                yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=call_chunks))
+                return
+            for token in re.split(r"(\s)", message.content):
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+                if run_manager:
+                    run_manager.on_llm_new_token(token, chunk=chunk)
+                yield chunk
+
+    def script():
+        for turn in itertools.count(1):
+            if tool_calls_every and turn % tool_calls_every == 0:
+                yield AIMessage(
+                    content="",
+                    tool_calls=[{"name": "GetCurrentDateTime", "args": {"__arg1": ""}, "id": f"call-{turn}"}],
+                )
+            yield AIMessage(content=reply)
+
+    return FakeChat(messages=script())
@@ -0,0 +1,304 @@
+"""Suíte de benchmarks com relatório JSON e comparação com baselines.
+
+Uso:
+    python benchmarks/run_suite.py [--scale quick|full] [--only storage,mail]
+                                   [--report relatorio.json] [--threshold 0.25]
+                                   [--update-baseline]
+
+Grupos:
+  storage    save/append/load/search/listagem do conversation_storage
+             (quick: 500 conversas × 50 mensagens; full: 10.000 × 200);
+  format     conversão de HTML grande em texto (format_body / html_text);
+  chatbot    turnos completos do chatbot (streaming) com um modelo falso
+             determinístico; mede o tempo até o primeiro pedaço e o turno;
+  mail       get_emails / get_email_bodies / delete_email_by_id contra um
+             Graph local (benchmarks/fakes.py), com e sem o espelho local.
+
+Cada medida é a mediana (em segundos) de várias repetições. Com uma baseline
+para a mesma escala em benchmarks/baselines.json, uma medida é regressão
+quando passa da baseline em mais que o limite (o de ``thresholds`` no arquivo
+para a medida ou para o grupo, ou então ``--threshold``) e em mais de MIN_DELTA segundos,
+para que medidas de microssegundos não acusem ruído. Sai com código 1 se
+houver regressão. Grupos cujas dependências não estão instaladas (langchain,
+msal...) aparecem como ignorados no relatório.
+"""
+import argparse
+import json
+import os
+import pathlib
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+BASELINE_PATH = ROOT / "benchmarks" / "baselines.json"
+DEFAULT_THRESHOLD = 0.25
+# diferenças absolutas menores que isso (segundos) nunca contam como regressão
+MIN_DELTA = 0.002
+
+SCALES = {
+    "quick": {"threads": 500, "messages": 50, "repeat": 5, "turns": 10, "mailbox": 500},
+    "full": {"threads": 10_000, "messages": 200, "repeat": 7, "turns": 30, "mailbox": 5_000},
+}
+
+
+def measure(fn, repeat):
+    """Mediana do tempo de ``fn()`` em ``repeat`` execuções."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+# ====== conversation_storage ======
+
+def _conversation(rng, words, n):
+    messages = []
+    for i in range(n):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(8, 60)))
+        msg = {"role": "user" if i % 2 == 0 else "assistant", "content": text}
+        if i % 10 == 9:
+            msg["sources"] = [{"ferramenta": "GetEmails", "resultado": text[:300]}]
+        messages.append(msg)
+    return messages
+
+
+def bench_storage(scale, workdir):
+    from conversation_storage import ConversationStorage
+
+    from fakes import WORDS
+
+    rng = random.Random(7)
+    words = WORDS + [f"termo{i}" for i in range(2000)]
+    storage = ConversationStorage(str(workdir / "bench_storage.db"))
+    threads, size, repeat = scale["threads"], scale["messages"], scale["repeat"]
+
+    save_times = []
+    for t in range(threads):
+        messages = _conversation(rng, words, size)
+        start = time.perf_counter()
+        storage.save_conversation(f"thread-{t}", messages, title=f"conversa {t}")
+        save_times.append(time.perf_counter() - start)
+
+    sample = [f"thread-{rng.randrange(threads)}" for _ in range(repeat)]
+    loaded = {tid: storage.load_conversation(tid) for tid in set(sample)}
+    turn = [{"role": "user", "content": "nova pergunta"}, {"role": "assistant", "content": "nova resposta"}]
+    picks = iter(sample * 2)
+
+    def append_turn():
+        tid = next(picks)
+        loaded[tid] = loaded[tid] + turn
+        storage.save_conversation(tid, loaded[tid])
+
+    results = {
+        "storage.save_conversation": statistics.median(save_times),
+        "storage.save_conversation_new_turn": measure(append_turn, repeat),
+        "storage.load_conversation": measure(lambda: storage.load_conversation(rng.choice(sample)), repeat),
+        "storage.load_conversation_window": measure(
+            lambda: storage.load_conversation_window(rng.choice(sample)), repeat
+        ),
+        "storage.list_conversations_page": measure(lambda: storage.list_conversations_page(), repeat),
+        "storage.search_conversations": measure(
+            lambda: storage.search_conversations(rng.choice(words[len(WORDS):]), snippets=True, limit=20), repeat
+        ),
+        "storage.search_conversations_common": measure(
+            lambda: storage.search_conversations("reunião projeto", limit=20), repeat
+        ),
+    }
+    storage.close()
+    return results
+
+
+# ====== format_body ======
+
+def bench_format(scale, workdir):
+    from bench_format_body import synthetic_newsletter
+    from html_text import html_to_text
+
+    html = synthetic_newsletter(random.Random(42), 800)
+    return {
+        "format_body.large_html": measure(lambda: html_to_text(html), scale["repeat"]),
+        "format_body.large_html_capped": measure(lambda: html_to_text(html, max_chars=8000), scale["repeat"]),
+    }
+
+
+# ====== chatbot ======
+
+def bench_chatbot(scale, workdir):
+    # o agente grava os checkpoints no conversations.db do diretório atual
+    os.chdir(workdir)
+    os.environ.setdefault("OLLAMA_WARMUP", "0")
+    os.environ["LLM_CACHE"] = "0"
+    import agente_graph
+
+    from fakes import fake_chat_model
+
+    reply = " ".join(["Aqui está o resumo dos seus e-mails de hoje."] * 20)
+    agente_graph._chat = fake_chat_model(reply, tool_calls_every=3)
+    agente_graph._agent = None
+
+    ttfts, turns = [], []
+    for i in range(scale["turns"]):
+        start = time.perf_counter()
+        first = None
+        for _ in agente_graph.chatbot({"role": "user", "content": f"pergunta {i}"}, thread_id="bench"):
+            if first is None:
+                first = time.perf_counter()
+        ttfts.append(first - start)
+        turns.append(time.perf_counter() - start)
+    return {
+        "chatbot.first_chunk": statistics.median(ttfts),
+        "chatbot.turn": statistics.median(turns),
+    }
+
+
+# ====== mail ======
+
+def bench_mail(scale, workdir):
+    import mail
+    from mailbox_mirror import MailboxMirror
+
+    from fakes import FakeGraphServer, message_id
+
+    graph = FakeGraphServer(scale["mailbox"])
+    repeat = scale["repeat"]
+    mail.GRAPH_URL = graph.url
+    mail._access_token = lambda: "bench"
+    try:
+        mail.MAIL_MIRROR = False
+        results = {
+            "mail.get_emails_live": measure(
+                lambda: mail.get_emails("unread", limit=25, mark_as_read=False), repeat
+            ),
+            "mail.get_email_bodies": measure(
+                lambda: mail.get_email_bodies([message_id(i) for i in range(20)]), repeat
+            ),
+        }
+
+        # espelho com max_age=0: toda consulta faz uma rodada delta (sem mudanças)
+        mail.MAIL_MIRROR = True
+        mail._mailbox = MailboxMirror(str(workdir / "bench_mail.db"), max_age=0)
+        start = time.perf_counter()
+        # get_emails faria a primeira rodada em segundo plano; aqui ela é medida direto
+        mail._mailbox.sync(mail._delta_fetcher(mail.get_session()), mail._delta_url())
+        results["mail.mirror_initial_sync"] = time.perf_counter() - start
+        results["mail.get_emails_mirror"] = measure(
+            lambda: mail.get_emails("unread", limit=25, mark_as_read=False), repeat
+        )
+
+        batches = iter(range(0, scale["mailbox"], 20))
+
+        def delete_batch():
+            first = next(batches)
+            mail.delete_email_by_id([message_id(i) for i in range(first, first + 20)])
+
+        results["mail.delete_email_by_id"] = measure(delete_batch, repeat)
+        return results
+    finally:
+        graph.close()
+
+
+GROUPS = {
+    "storage": bench_storage,
+    "format": bench_format,
+    "chatbot": bench_chatbot,
+    "mail": bench_mail,
+}
+
+
+# ====== relatório e baselines ======
+
+def compare(results, baseline, thresholds, default_threshold):
+    """Linhas de comparação com a baseline: (nome, atual, baseline, razão, regressão)."""
+    rows = []
+    for name, value in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            rows.append((name, value, None, None, False))
+            continue
+        # limite da medida, do grupo ("chatbot") ou o padrão
+        limit = thresholds.get(name, thresholds.get(name.split(".")[0], default_threshold))
+        ratio = value / base if base else float("inf")
+        rows.append((name, value, base, ratio, ratio > 1 + limit and value - base > MIN_DELTA))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="quick")
+    parser.add_argument("--only", help="grupos separados por vírgula (padrão: todos)")
+    parser.add_argument("--report", help="onde gravar o relatório JSON")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--threshold", type=float, help=f"regressão tolerada (padrão: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--update-baseline", action="store_true", help="grava os resultados como nova baseline")
+    args = parser.parse_args(argv)
+
+    from metrics import configure_logging
+
+    # só avisos e erros no meio da tabela; LOG_LEVEL=INFO mostra tudo
+    configure_logging(level=os.getenv("LOG_LEVEL", "WARNING"))
+    scale = SCALES[args.scale]
+    groups = args.only.split(",") if args.only else list(GROUPS)
+    results, skipped = {}, {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+        for group in groups:
+            print(f"▶ {group}...", flush=True)
+            try:
+                results.update(GROUPS[group](scale, pathlib.Path(tmp)))
+            except ImportError as exc:
+                skipped[group] = f"dependência ausente: {exc.name or exc}"
+                print(f"  ignorado ({skipped[group]})")
+            finally:
+                os.chdir(cwd)
+
+    baseline_file = pathlib.Path(args.baseline)
+    stored = json.loads(baseline_file.read_text()) if baseline_file.exists() else {}
+    thresholds = stored.get("thresholds", {})
+    default_threshold = args.threshold if args.threshold is not None else thresholds.get("default", DEFAULT_THRESHOLD)
+    thresholds = {name: limit for name, limit in thresholds.items() if name != "default"}
+    rows = compare(results, stored.get(args.scale, {}), thresholds, default_threshold)
+
+    print(f"\n{'medida':<40}{'atual ms':>12}{'baseline ms':>14}{'razão':>9}")
+    for name, value, base, ratio, regressed in rows:
+        base_text = f"{base * 1000:14.2f}" if base is not None else f"{'-':>14}"
+        ratio_text = f"{ratio:9.2f}" if ratio is not None else f"{'-':>9}"
+        print(f"{name:<40}{value * 1000:12.2f}{base_text}{ratio_text}{'  ⚠️ regressão' if regressed else ''}")
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "scale": args.scale,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "threshold": default_threshold,
+        "results": results,
+        "skipped": skipped,
+        "comparison": [
+            {"name": name, "value": value, "baseline": base, "ratio": ratio, "regression": regressed}
+            for name, value, base, ratio, regressed in rows
+        ],
+    }
+    if args.report:
+        pathlib.Path(args.report).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+
+    if args.update_baseline:
+        stored.setdefault("thresholds", {"default": DEFAULT_THRESHOLD})
+        stored[args.scale] = {**stored.get(args.scale, {}), **results}
+        baseline_file.write_text(json.dumps(stored, indent=2, sort_keys=True) + "\n")
+        print(f"\nbaseline {args.scale} atualizada em {baseline_file}")
+        return 0
+
+    return 1 if any(row[4] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
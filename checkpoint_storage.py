@@ -0,0 +1,478 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    SerializerProtocol,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.serde.types import TASKS, ChannelProtocol
+
+from conversation_storage import DB_PATH, get_storage
+
+# checkpoints mantidos por conversa; os mais antigos (e os blobs que só eles usavam) são apagados
+KEEP_LAST = 5
+# conversas cujo estado não é lido há esse tempo saem do cache em memória
+IDLE_SECONDS = 15 * 60
+MAX_HOT_THREADS = 64
+# valores maiores que isso são gravados comprimidos com zlib
+COMPRESS_MIN_BYTES = 512
+_ZLIB_SUFFIX = "+zlib"
+
+
+def _pack(typed: Tuple[str, bytes]) -> Tuple[str, bytes]:
+    type_, data = typed
+    if data is not None and len(data) >= COMPRESS_MIN_BYTES:
+        return type_ + _ZLIB_SUFFIX, zlib.compress(data)
+    return type_, data
+
+
+def _unpack(type_: str, data: bytes) -> Tuple[str, bytes]:
+    if type_.endswith(_ZLIB_SUFFIX):
+        return type_[: -len(_ZLIB_SUFFIX)], zlib.decompress(data)
+    return type_, data
+
+
+class SQLiteCheckpointSaver(BaseCheckpointSaver[str]):
+    """LangGraph checkpointer stored in the conversations database.
+
+    Each checkpoint row holds only the bookkeeping (versions, metadata); the
+    channel values are written to ``checkpoint_blobs`` once per version, so a
+    new checkpoint only stores the channels that changed. Only the last
+    ``keep_last`` checkpoints of a thread are kept. Recently used threads are
+    cached in memory (still serialized) and dropped after ``idle_seconds``
+    without access.
+    """
+
+    def __init__(
+        self,
+        db_path: str = DB_PATH,
+        *,
+        keep_last: int = KEEP_LAST,
+        idle_seconds: float = IDLE_SECONDS,
+        max_hot_threads: int = MAX_HOT_THREADS,
+        serde: Optional[SerializerProtocol] = None,
+    ):
+        super().__init__(serde=serde)
+        self.storage = get_storage(db_path)
+        self.keep_last = keep_last
+        self.idle_seconds = idle_seconds
+        self.max_hot_threads = max_hot_threads
+        # (thread_id, checkpoint_ns) -> (último acesso, linhas cruas do checkpoint mais recente)
+        self._hot: "OrderedDict[Tuple[str, str], Tuple[float, tuple]]" = OrderedDict()
+        self._hot_lock = threading.Lock()
+
+    # ====== cache em memória ======
+
+    def _hot_get(self, key: Tuple[str, str]) -> Optional[tuple]:
+        now = time.monotonic()
+        with self._hot_lock:
+            self._evict_idle(now)
+            entry = self._hot.get(key)
+            if entry is None:
+                return None
+            self._hot[key] = (now, entry[1])
+            self._hot.move_to_end(key)
+            return entry[1]
+
+    def _hot_put(self, key: Tuple[str, str], raw: tuple) -> None:
+        with self._hot_lock:
+            self._hot[key] = (time.monotonic(), raw)
+            self._hot.move_to_end(key)
+            while len(self._hot) > self.max_hot_threads:
+                self._hot.popitem(last=False)
+
+    def _hot_drop(self, thread_id: str, checkpoint_ns: str) -> None:
+        with self._hot_lock:
+            self._hot.pop((thread_id, checkpoint_ns), None)
+
+    def _evict_idle(self, now: float) -> None:
+        # as entradas estão em ordem de último acesso, então as paradas ficam no começo
+        while self._hot:
+            key, (last_used, _) = next(iter(self._hot.items()))
+            if now - last_used < self.idle_seconds:
+                break
+            del self._hot[key]
+
+    def evict_idle(self) -> None:
+        """Drop cached state of threads idle for longer than ``idle_seconds``."""
+        with self._hot_lock:
+            self._evict_idle(time.monotonic())
+
+    # ====== leitura ======
+
+    def _read_raw(
+        self, thread_id: str, checkpoint_ns: str, checkpoint_id: Optional[str]
+    ) -> Optional[tuple]:
+        with self.storage.connection() as conn:
+            if checkpoint_id:
+                row = conn.execute(
+                    "SELECT * FROM checkpoints WHERE thread_id=? AND checkpoint_ns=? AND checkpoint_id=?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT * FROM checkpoints WHERE thread_id=? AND checkpoint_ns=? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            if row is None:
+                return None
+            return self._read_related(conn, row)
+
+    @staticmethod
+    def _read_related(conn, row) -> tuple:
+        thread_id, checkpoint_ns = row["thread_id"], row["checkpoint_ns"]
+        versions = json.loads(row["channel_versions"])
+        blobs = conn.execute(
+            "SELECT b.channel, b.type, b.blob FROM checkpoint_blobs b "
+            "JOIN json_each(?) v ON v.key = b.channel AND v.value = b.version "
+            "WHERE b.thread_id=? AND b.checkpoint_ns=?",
+            (json.dumps(versions), thread_id, checkpoint_ns),
+        ).fetchall()
+        writes = conn.execute(
+            "SELECT task_id, channel, type, blob FROM checkpoint_writes "
+            "WHERE thread_id=? AND checkpoint_ns=? AND checkpoint_id=? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, row["checkpoint_id"]),
+        ).fetchall()
+        sends = []
+        if row["parent_checkpoint_id"]:
+            sends = conn.execute(
+                "SELECT type, blob FROM checkpoint_writes "
+                "WHERE thread_id=? AND checkpoint_ns=? AND checkpoint_id=? AND channel=? "
+                "ORDER BY task_path, task_id, idx",
+                (thread_id, checkpoint_ns, row["parent_checkpoint_id"], TASKS),
+            ).fetchall()
+        return (
+            tuple(row),
+            [tuple(b) for b in blobs],
+            [tuple(w) for w in writes],
+            [tuple(s) for s in sends],
+        )
+
+    def _to_tuple(self, raw: tuple) -> CheckpointTuple:
+        row, blobs, writes, sends = raw
+        (
+            thread_id,
+            checkpoint_ns,
+            checkpoint_id,
+            parent_checkpoint_id,
+            type_,
+            checkpoint,
+            _versions,
+            metadata_type,
+            metadata,
+        ) = row
+        channel_values = {}
+        for channel, blob_type, blob in blobs:
+            if blob_type != "empty":
+                channel_values[channel] = self.serde.loads_typed(_unpack(blob_type, blob))
+        checkpoint_: Checkpoint = self.serde.loads_typed(_unpack(type_, checkpoint))
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint={
+                **checkpoint_,
+                "channel_values": channel_values,
+                "pending_sends": [self.serde.loads_typed(_unpack(t, b)) for t, b in sends],
+            },
+            metadata=self.serde.loads_typed(_unpack(metadata_type, metadata)),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_checkpoint_id,
+                    }
+                }
+                if parent_checkpoint_id
+                else None
+            ),
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed(_unpack(t, b)))
+                for task_id, channel, t, b in writes
+            ],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id: str = config["configurable"]["thread_id"]
+        checkpoint_ns: str = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        if checkpoint_id:
+            raw = self._read_raw(thread_id, checkpoint_ns, checkpoint_id)
+        else:
+            key = (thread_id, checkpoint_ns)
+            raw = self._hot_get(key)
+            if raw is None:
+                raw = self._read_raw(thread_id, checkpoint_ns, None)
+                if raw is not None:
+                    self._hot_put(key, raw)
+        return self._to_tuple(raw) if raw is not None else None
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        where, params = [], []
+        if config:
+            where.append("thread_id=?")
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                where.append("checkpoint_ns=?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id=?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id<?")
+            params.append(before_id)
+        sql = "SELECT * FROM checkpoints"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY checkpoint_id DESC"
+        with self.storage.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+            raws = []
+            for row in rows:
+                if filter:
+                    metadata = self.serde.loads_typed(_unpack(row["metadata_type"], row["metadata"]))
+                    if not all(metadata.get(k) == v for k, v in filter.items()):
+                        continue
+                if limit is not None and len(raws) >= limit:
+                    break
+                raws.append(self._read_related(conn, row))
+        for raw in raws:
+            yield self._to_tuple(raw)
+
+    # ====== escrita ======
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        c = checkpoint.copy()
+        c.pop("pending_sends", None)  # type: ignore[misc]
+        values: dict[str, Any] = c.pop("channel_values")  # type: ignore[misc]
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        blobs = []
+        for channel, version in new_versions.items():
+            if channel in values:
+                type_, blob = _pack(self.serde.dumps_typed(values[channel]))
+            else:
+                type_, blob = "empty", None
+            blobs.append((thread_id, checkpoint_ns, channel, str(version), type_, blob))
+        type_, data = _pack(self.serde.dumps_typed(c))
+        metadata_type, metadata_data = _pack(
+            self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        )
+        self._hot_drop(thread_id, checkpoint_ns)
+        with self.storage.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO checkpoint_blobs"
+                "(thread_id, checkpoint_ns, channel, version, type, blob) VALUES (?, ?, ?, ?, ?, ?)",
+                blobs,
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint["id"],
+                    config["configurable"].get("checkpoint_id"),
+                    type_,
+                    data,
+                    json.dumps({k: str(v) for k, v in checkpoint["channel_versions"].items()}),
+                    metadata_type,
+                    metadata_data,
+                ),
+            )
+            self._prune(conn, thread_id, checkpoint_ns)
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def _prune(self, conn, thread_id: str, checkpoint_ns: str) -> None:
+        count = conn.execute(
+            "SELECT COUNT(*) FROM checkpoints WHERE thread_id=? AND checkpoint_ns=?",
+            (thread_id, checkpoint_ns),
+        ).fetchone()[0]
+        if count <= self.keep_last:
+            return
+        conn.execute(
+            "DELETE FROM checkpoints WHERE thread_id=? AND checkpoint_ns=? AND checkpoint_id NOT IN ("
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id=? AND checkpoint_ns=? "
+            "ORDER BY checkpoint_id DESC LIMIT ?)",
+            (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.keep_last),
+        )
+        # as escritas do pai do checkpoint mais antigo mantido também saem; isso só
+        # importa para os pending sends, que o checkpoint seguinte já consumiu
+        conn.execute(
+            "DELETE FROM checkpoint_writes WHERE thread_id=? AND checkpoint_ns=? "
+            "AND checkpoint_id NOT IN (SELECT checkpoint_id FROM checkpoints "
+            "WHERE thread_id=? AND checkpoint_ns=?)",
+            (thread_id, checkpoint_ns, thread_id, checkpoint_ns),
+        )
+        conn.execute(
+            "DELETE FROM checkpoint_blobs WHERE thread_id=? AND checkpoint_ns=? AND NOT EXISTS ("
+            "SELECT 1 FROM checkpoints c, json_each(c.channel_versions) v "
+            "WHERE c.thread_id = checkpoint_blobs.thread_id "
+            "AND c.checkpoint_ns = checkpoint_blobs.checkpoint_ns "
+            "AND v.key = checkpoint_blobs.channel AND v.value = checkpoint_blobs.version)",
+            (thread_id, checkpoint_ns),
+        )
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, blob = _pack(self.serde.dumps_typed(value))
+            rows.append(
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint_id,
+                    task_id,
+                    WRITES_IDX_MAP.get(channel, idx),
+                    channel,
+                    type_,
+                    blob,
+                    task_path,
+                )
+            )
+        # escritas especiais (erros, interrupções) podem ser substituídas; as normais são mantidas
+        replace = all(channel in WRITES_IDX_MAP for channel, _ in writes)
+        self._hot_drop(thread_id, checkpoint_ns)
+        with self.storage.transaction() as conn:
+            conn.executemany(
+                f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO checkpoint_writes "
+                "(thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, blob, task_path) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Remove every checkpoint of a thread."""
+        with self._hot_lock:
+            for key in [k for k in self._hot if k[0] == thread_id]:
+                del self._hot[key]
+        with self.storage.transaction() as conn:
+            for table in ("checkpoints", "checkpoint_blobs", "checkpoint_writes"):
+                conn.execute(f"DELETE FROM {table} WHERE thread_id=?", (thread_id,))
+
+    def get_next_version(self, current: Optional[str], channel: ChannelProtocol) -> str:
+        # mesmo esquema do InMemorySaver: o sufixo aleatório evita que versões de
+        # históricos bifurcados colidam em checkpoint_blobs
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # ====== versões assíncronas (SQLite é local; roda numa thread do executor) ======
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+
+def to_langchain_messages(messages: List[dict]) -> List[BaseMessage]:
+    """Convert stored ``{"role", "content"}`` dicts into LangChain messages."""
+    converted: List[BaseMessage] = []
+    for msg in messages:
+        if msg.get("role") == "user":
+            converted.append(HumanMessage(content=msg.get("content") or ""))
+        elif msg.get("role") == "assistant":
+            converted.append(AIMessage(content=msg.get("content") or ""))
+    return converted
+
+
+def ensure_thread_state(
+    graph,
+    config: RunnableConfig,
+    load_messages: Callable[[str], List[dict]],
+) -> bool:
+    """Seed the agent state of a thread from stored messages.
+
+    Conversations saved before the checkpointer existed (or whose checkpoints
+    were deleted) have messages in ``conversation_storage`` but no agent
+    state. Returns True when the state was rehydrated.
+    """
+    if graph.get_state(config).values.get("messages"):
+        return False
+    messages = to_langchain_messages(load_messages(config["configurable"]["thread_id"]))
+    if not messages:
+        return False
+    graph.update_state(config, {"messages": messages}, as_node="agent")
+    return True
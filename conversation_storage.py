@@ -1,45 +1,1024 @@
+import re
+import queue
 import sqlite3
+import threading
 import json
-from datetime import datetime
-from contextlib import closing
-from typing import List, Tuple, Optional
+import unicodedata
+import zlib
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, NamedTuple, Tuple, Optional
+
+from metrics import timed
+
+try:
+    import zstandard
+except ImportError:  # archives fall back to zlib
+    zstandard = None
 
 DB_PATH = "conversations.db"
+POOL_SIZE = 4
+PAGE_SIZE = 20
+WINDOW_SIZE = 50
+PREVIEW_CHARS = 80
 
 
-def _get_conn(db_path: str = DB_PATH):
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    _init_db(conn)
-    return conn
+def _has_column(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
 
 
-def _init_db(conn: sqlite3.Connection):
-    with conn:
+def _migrate_base(conn: sqlite3.Connection):
+    """Conversations and messages, including databases from older versions."""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS conversations (
+        thread_id TEXT PRIMARY KEY,
+        updated_at TEXT,
+        title TEXT
+    )"""
+    )
+    # the table may predate the title column
+    if not _has_column(conn, "conversations", "title"):
+        conn.execute("ALTER TABLE conversations ADD COLUMN title TEXT")
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        thread_id TEXT,
+        role TEXT,
+        content TEXT,
+        sources TEXT,
+        seq INTEGER,
+        FOREIGN KEY(thread_id) REFERENCES conversations(thread_id)
+    )"""
+    )
+    # databases created before per-thread sequence numbers existed need the
+    # column and a backfill that follows the original insertion order
+    if not _has_column(conn, "messages", "seq"):
+        conn.execute("ALTER TABLE messages ADD COLUMN seq INTEGER")
         conn.execute(
-            """CREATE TABLE IF NOT EXISTS conversations (
-            thread_id TEXT PRIMARY KEY,
-            updated_at TEXT,
-            title TEXT
-        )"""
+            """UPDATE messages SET seq = (
+                SELECT COUNT(*) FROM messages m2
+                WHERE m2.thread_id = messages.thread_id AND m2.id < messages.id
+            )"""
         )
-        # if the table already existed without the title column, try to add it
-        try:
-            conn.execute("ALTER TABLE conversations ADD COLUMN title TEXT")
-        except sqlite3.OperationalError:
-            pass
-        conn.execute(
-            """CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            thread_id TEXT,
-            role TEXT,
-            content TEXT,
-            sources TEXT,
-            FOREIGN KEY(thread_id) REFERENCES conversations(thread_id)
-        )"""
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_thread_seq ON messages(thread_id, seq)"
+    )
+
+
+# accent-insensitive tokenizer, so "sessao" finds "sessão"
+FTS_TOKENIZE = "unicode61 remove_diacritics 2"
+
+_FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE messages_fts USING fts5(
+        content, content='messages', content_rowid='id', tokenize='{FTS_TOKENIZE}'
+    )""",
+    f"""CREATE VIRTUAL TABLE conversations_fts USING fts5(
+        title, content='conversations', content_rowid='rowid', tokenize='{FTS_TOKENIZE}'
+    )""",
+    """CREATE TRIGGER messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER conversations_fts_ai AFTER INSERT ON conversations BEGIN
+        INSERT INTO conversations_fts(rowid, title) VALUES (new.rowid, new.title);
+    END""",
+    """CREATE TRIGGER conversations_fts_ad AFTER DELETE ON conversations BEGIN
+        INSERT INTO conversations_fts(conversations_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+    END""",
+    """CREATE TRIGGER conversations_fts_au AFTER UPDATE OF title ON conversations
+    WHEN old.title IS NOT new.title BEGIN
+        INSERT INTO conversations_fts(conversations_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+        INSERT INTO conversations_fts(rowid, title) VALUES (new.rowid, new.title);
+    END""",
+]
+
+
+def _has_fts(conn: sqlite3.Connection) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='messages_fts'"
+    ).fetchone()
+    return row is not None
+
+
+def _migrate_fts(conn: sqlite3.Connection):
+    """Create the full-text index, if this SQLite build ships FTS5."""
+    if _has_fts(conn):
+        return
+    conn.execute("SAVEPOINT fts")
+    try:
+        for stmt in _FTS_SCHEMA:
+            conn.execute(stmt)
+        # index whatever was stored before the index existed
+        conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild')")
+    except sqlite3.OperationalError:
+        # "no such module: fts5": search falls back to LIKE
+        conn.execute("ROLLBACK TO fts")
+    conn.execute("RELEASE fts")
+
+
+def _migrate_listing_indexes(conn: sqlite3.Connection):
+    """Index the sidebar ordering so pages are read straight off the index."""
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_conversations_updated "
+        "ON conversations(updated_at DESC, thread_id DESC)"
+    )
+
+
+def _migrate_checkpoints(conn: sqlite3.Connection):
+    """Agent checkpoints (see checkpoint_storage.py).
+
+    Channel values live in ``checkpoint_blobs`` keyed by version, so a
+    checkpoint only writes the channels that changed since its parent.
+    """
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS checkpoints (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL DEFAULT '',
+        checkpoint_id TEXT NOT NULL,
+        parent_checkpoint_id TEXT,
+        type TEXT,
+        checkpoint BLOB,
+        channel_versions TEXT,
+        metadata_type TEXT,
+        metadata BLOB,
+        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+    )"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS checkpoint_blobs (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL DEFAULT '',
+        channel TEXT NOT NULL,
+        version TEXT NOT NULL,
+        type TEXT NOT NULL,
+        blob BLOB,
+        PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+    )"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS checkpoint_writes (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL DEFAULT '',
+        checkpoint_id TEXT NOT NULL,
+        task_id TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        channel TEXT NOT NULL,
+        type TEXT,
+        blob BLOB,
+        task_path TEXT NOT NULL DEFAULT '',
+        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+    )"""
+    )
+
+
+def _migrate_mailbox(conn: sqlite3.Connection):
+    """Local mirror of the mailbox (see mailbox_mirror.py).
+
+    ``mail_sync`` keeps the delta link and the time of the last sync for each
+    mirrored folder.
+    """
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS mail_messages (
+        id TEXT PRIMARY KEY,
+        folder TEXT NOT NULL,
+        subject TEXT,
+        sender TEXT,
+        received_at TEXT,
+        is_read INTEGER,
+        preview TEXT,
+        body TEXT
+    )"""
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_mail_messages_received "
+        "ON mail_messages(folder, received_at DESC)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_mail_messages_unread "
+        "ON mail_messages(folder, is_read, received_at DESC)"
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS mail_sync (
+        folder TEXT PRIMARY KEY,
+        delta_link TEXT,
+        synced_at REAL
+    )"""
+    )
+
+
+def _migrate_llm_cache(conn: sqlite3.Connection):
+    """Cached model responses (see llm_cache.py)."""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY,
+        model TEXT,
+        response TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        last_used REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)")
+
+
+def _migrate_archive(conn: sqlite3.Connection):
+    """Cold storage for conversations that have not been updated in a while.
+
+    Each row holds every message of one thread as a single compressed JSON
+    blob; ``message_count`` and ``last_message`` keep the sidebar from having
+    to decompress it.
+    """
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS archived_conversations (
+        thread_id TEXT PRIMARY KEY,
+        codec TEXT NOT NULL,
+        data BLOB NOT NULL,
+        message_count INTEGER NOT NULL,
+        last_message TEXT,
+        archived_at TEXT NOT NULL
+    )"""
+    )
+
+
+# schema version N is reached by applying the first N migrations; the current
+# version lives in PRAGMA user_version
+_MIGRATIONS: List[Callable[[sqlite3.Connection], None]] = [
+    _migrate_base,
+    _migrate_fts,
+    _migrate_listing_indexes,
+    _migrate_checkpoints,
+    _migrate_mailbox,
+    _migrate_llm_cache,
+    _migrate_archive,
+]
+
+
+class ConversationSummary(NamedTuple):
+    """A sidebar row; unpacks like the ``(thread_id, title)`` tuples."""
+
+    thread_id: str
+    title: str
+    updated_at: str
+    message_count: int
+    last_message: Optional[str]
+
+
+class ConversationPage(NamedTuple):
+    items: List[ConversationSummary]
+    # (updated_at, thread_id) of the last item, or None on the last page
+    next_cursor: Optional[Tuple[str, str]]
+
+
+class ConversationConflictError(RuntimeError):
+    """Raised when an append does not line up with the stored tail of a thread."""
+
+
+class LazySources:
+    """Stored ``sources`` JSON, decoded only when :attr:`value` is read.
+
+    Saving a message that still holds a ``LazySources`` writes the original
+    text back without a decode/encode round trip.
+    """
+
+    __slots__ = ("raw", "_value", "_decoded")
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self._decoded = False
+        self._value = None
+
+    @property
+    def value(self):
+        if not self._decoded:
+            self._value = json.loads(self.raw)
+            self._decoded = True
+        return self._value
+
+    def __bool__(self):
+        # empty payloads are falsy, like the decoded [] / {} would be
+        return self.raw.strip() not in ("", "[]", "{}", "null", '""')
+
+    def __eq__(self, other):
+        if isinstance(other, LazySources):
+            return self.raw == other.raw
+        return self.value == other
+
+    def __repr__(self):
+        return f"LazySources({self.raw[:40]!r})"
+
+
+class ConversationWindow(NamedTuple):
+    messages: List[dict]
+    # seq of the first message; pass it as ``before_seq`` to load older ones
+    start_seq: int
+
+    @property
+    def has_older(self) -> bool:
+        return self.start_seq > 0
+
+
+class MaintenanceReport(NamedTuple):
+    archived: int
+    purged: int
+    # database size before and after, in bytes
+    size_before: int
+    size_after: int
+
+    @property
+    def reclaimed(self) -> int:
+        return self.size_before - self.size_after
+
+
+def _dump_sources(sources) -> Optional[str]:
+    if sources is None:
+        return None
+    if isinstance(sources, LazySources):
+        return sources.raw
+    return json.dumps(sources)
+
+
+def _message_row(thread_id: str, seq: int, msg: dict) -> tuple:
+    return (
+        thread_id,
+        seq,
+        msg.get("role"),
+        msg.get("content"),
+        _dump_sources(msg.get("sources")),
+    )
+
+
+def _touch_conversation(conn: sqlite3.Connection, thread_id: str, title: Optional[str]):
+    conn.execute(
+        "INSERT INTO conversations(thread_id, updated_at, title) VALUES(?, ?, ?) "
+        "ON CONFLICT(thread_id) DO UPDATE SET updated_at=excluded.updated_at, title=COALESCE(?, title)",
+        (
+            thread_id,
+            datetime.now().isoformat(),
+            title,
+            title,
+        ),
+    )
+
+
+def _next_seq(conn: sqlite3.Connection, thread_id: str) -> int:
+    row = conn.execute(
+        "SELECT MAX(seq) FROM messages WHERE thread_id=?", (thread_id,)
+    ).fetchone()
+    return 0 if row[0] is None else row[0] + 1
+
+
+def _insert_messages(conn: sqlite3.Connection, thread_id: str, start_seq: int, messages: List[dict]):
+    conn.executemany(
+        "INSERT INTO messages(thread_id, seq, role, content, sources) VALUES(?, ?, ?, ?, ?)",
+        [_message_row(thread_id, start_seq + i, msg) for i, msg in enumerate(messages)],
+    )
+
+
+def _stored_prefix_matches(conn: sqlite3.Connection, thread_id: str, start_seq: int, messages: List[dict]) -> bool:
+    """Check whether the stored messages from ``start_seq`` on are exactly ``messages``."""
+    rows = conn.execute(
+        "SELECT role, content, sources FROM messages WHERE thread_id=? AND seq>=? ORDER BY seq",
+        (thread_id, start_seq),
+    ).fetchall()
+    if len(rows) != len(messages):
+        return False
+    return all(
+        tuple(row) == _message_row(thread_id, seq, msg)[2:]
+        for seq, (row, msg) in enumerate(zip(rows, messages), start_seq)
+    )
+
+
+# ====== cold storage ======
+
+def _compress(data: bytes) -> Tuple[str, bytes]:
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "zlib", zlib.compress(data, 9)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("conversation archived with zstd; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"unknown archive codec {codec!r}")
+
+
+def _archived_rows(conn: sqlite3.Connection, thread_id: str) -> List[dict]:
+    """Messages of an archived thread as ``messages`` rows, oldest first."""
+    row = conn.execute(
+        "SELECT codec, data FROM archived_conversations WHERE thread_id=?", (thread_id,)
+    ).fetchone()
+    if row is None:
+        return []
+    return [
+        {"seq": seq, "role": role, "content": content, "sources": sources}
+        for seq, (role, content, sources) in enumerate(json.loads(_decompress(row["codec"], row["data"])))
+    ]
+
+
+def _archive_thread(conn: sqlite3.Connection, thread_id: str) -> int:
+    """Pack the messages of a thread into one compressed row; returns how many."""
+    rows = conn.execute(
+        "SELECT role, content, sources FROM messages WHERE thread_id=? ORDER BY seq", (thread_id,)
+    ).fetchall()
+    if not rows:
+        return 0
+    payload = json.dumps([tuple(row) for row in rows], ensure_ascii=False).encode("utf-8")
+    codec, data = _compress(payload)
+    conn.execute(
+        "INSERT INTO archived_conversations(thread_id, codec, data, message_count, last_message, archived_at) "
+        "VALUES(?, ?, ?, ?, ?, ?)",
+        (thread_id, codec, data, len(rows), (rows[-1]["content"] or "")[:PREVIEW_CHARS], datetime.now().isoformat()),
+    )
+    conn.execute("DELETE FROM messages WHERE thread_id=?", (thread_id,))
+    # the agent rebuilds its state from the stored history when the thread is reopened
+    _delete_checkpoints(conn, thread_id)
+    return len(rows)
+
+
+def _restore_archive(conn: sqlite3.Connection, thread_id: str):
+    """Move an archived thread back into ``messages`` before it is written to."""
+    rows = _archived_rows(conn, thread_id)
+    if not rows:
+        return
+    conn.executemany(
+        "INSERT INTO messages(thread_id, seq, role, content, sources) VALUES(?, ?, ?, ?, ?)",
+        [(thread_id, row["seq"], row["role"], row["content"], row["sources"]) for row in rows],
+    )
+    conn.execute("DELETE FROM archived_conversations WHERE thread_id=?", (thread_id,))
+
+
+def _delete_checkpoints(conn: sqlite3.Connection, thread_id: str):
+    for table in ("checkpoints", "checkpoint_blobs", "checkpoint_writes"):
+        conn.execute(f"DELETE FROM {table} WHERE thread_id=?", (thread_id,))
+
+
+def _delete_thread(conn: sqlite3.Connection, thread_id: str):
+    conn.execute("DELETE FROM messages WHERE thread_id=?", (thread_id,))
+    conn.execute("DELETE FROM archived_conversations WHERE thread_id=?", (thread_id,))
+    conn.execute("DELETE FROM conversations WHERE thread_id=?", (thread_id,))
+    _delete_checkpoints(conn, thread_id)
+
+
+def _database_bytes(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+def _fts_query(search: str) -> str:
+    """Turn free text into an FTS5 query matching every term as a prefix."""
+    return " ".join(f'"{term}"*' for term in re.findall(r"\w+", search))
+
+
+def _search_fts(conn: sqlite3.Connection, query: str, snippets: bool, limit: Optional[int]):
+    title_snippet = "highlight(conversations_fts, 0, '**', '**')" if snippets else "NULL"
+    content_snippet = "snippet(messages_fts, 0, '**', '**', '…', 12)" if snippets else "NULL"
+    # title hits weigh double; the bare snippet column comes from the best-ranked hit
+    return conn.execute(
+        f"""
+        WITH hits(thread_id, score, snippet) AS (
+            SELECT c.thread_id, 2 * bm25(conversations_fts), {title_snippet}
+            FROM conversations_fts JOIN conversations c ON c.rowid = conversations_fts.rowid
+            WHERE conversations_fts MATCH :q
+            UNION ALL
+            SELECT m.thread_id, bm25(messages_fts), {content_snippet}
+            FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH :q
         )
+        SELECT c.thread_id, c.title, MIN(h.score) AS score, h.snippet
+        FROM hits h JOIN conversations c ON c.thread_id = h.thread_id
+        GROUP BY c.thread_id
+        ORDER BY score, c.updated_at DESC
+        LIMIT :limit
+        """,
+        {"q": query, "limit": -1 if limit is None else limit},
+    ).fetchall()
 
 
+def _search_like(conn: sqlite3.Connection, search: str, limit: Optional[int]):
+    like = f"%{search.lower()}%"
+    return conn.execute(
+        """
+        SELECT DISTINCT c.thread_id, c.title, c.updated_at, NULL AS snippet
+        FROM conversations c
+        LEFT JOIN messages m ON c.thread_id = m.thread_id
+        WHERE LOWER(COALESCE(c.title, '')) LIKE ? OR LOWER(m.content) LIKE ?
+        ORDER BY c.updated_at DESC
+        LIMIT ?
+        """,
+        (like, like, -1 if limit is None else limit),
+    ).fetchall()
+
+
+def _fold(text: str) -> str:
+    """Lowercase ``text`` and strip accents, as FTS_TOKENIZE does."""
+    return "".join(ch for ch in unicodedata.normalize("NFKD", text.lower()) if not unicodedata.combining(ch))
+
+
+def _archive_snippet(content: str, terms: List[re.Pattern], size: int = 12) -> str:
+    """About ``size`` words around the first match, matches in bold like snippet()."""
+    words = content.split()
+    hits = [any(term.search(_fold(word)) for term in terms) for word in words]
+    start = max(hits.index(True) - size // 2, 0) if True in hits else 0
+    shown = [f"**{word}**" if hit else word for word, hit in zip(words[start:start + size], hits[start:start + size])]
+    return ("…" if start else "") + " ".join(shown) + ("…" if start + size < len(words) else "")
+
+
+def _search_archive(
+    conn: sqlite3.Connection, search: str, exclude: set, snippets: bool, limit: Optional[int]
+) -> List[dict]:
+    """Scan archived threads, which are not in the FTS index, for a message matching every term.
+
+    Each archive is decompressed, so this is linear in the archive size;
+    threads in ``exclude`` (already found) are skipped.
+    """
+    terms = [re.compile(r"\b" + re.escape(_fold(term))) for term in re.findall(r"\w+", search)]
+    if not terms:
+        return []
+    hits = []
+    rows = conn.execute(
+        "SELECT a.thread_id, c.title FROM archived_conversations a "
+        "JOIN conversations c ON c.thread_id = a.thread_id ORDER BY c.updated_at DESC"
+    ).fetchall()
+    for row in rows:
+        if limit is not None and len(hits) >= limit:
+            break
+        if row["thread_id"] in exclude:
+            continue
+        for message in _archived_rows(conn, row["thread_id"]):
+            content = message["content"] or ""
+            if all(term.search(_fold(content)) for term in terms):
+                snippet = _archive_snippet(content, terms) if snippets else None
+                hits.append({"thread_id": row["thread_id"], "title": row["title"], "snippet": snippet})
+                break
+    return hits
+
+
+class ConversationStorage:
+    """Conversation store backed by one SQLite file.
+
+    Owns a small pool of WAL-mode connections that are shared by all threads
+    (Streamlit runs each session in its own thread); a connection is only ever
+    used by the thread that borrowed it. The schema is migrated once, the
+    first time a connection is opened.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, pool_size: int = POOL_SIZE):
+        self.db_path = db_path
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=pool_size)
+        self._migrate_lock = threading.Lock()
+        self._migrated = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            timeout=30,
+            cached_statements=256,
+        )
+        conn.row_factory = sqlite3.Row
+        # only takes effect on a new file; older ones switch in vacuum()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._migrated:
+            with self._migrate_lock:
+                if not self._migrated:
+                    self._migrate(conn)
+                    self._migrated = True
+        return conn
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        # IMMEDIATE takes the write lock up front, so two processes opening the
+        # same file cannot both apply a migration
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for migration in _MIGRATIONS[version:]:
+                migration(conn)
+            if version < len(_MIGRATIONS):
+                conn.execute(f"PRAGMA user_version={len(_MIGRATIONS)}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a pooled connection for the duration of the block."""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection and commit (or roll back) when the block ends."""
+        with self.connection() as conn, conn:
+            yield conn
+
+    def close(self) -> None:
+        """Close every idle connection in the pool."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    @timed("sqlite", op="append_messages")
+    def append_messages(
+        self,
+        thread_id: str,
+        messages: List[dict],
+        *,
+        expected_seq: int,
+        title: Optional[str] = None,
+    ) -> int:
+        """Append new messages to a conversation without touching stored ones.
+
+        ``expected_seq`` is the number of messages the caller believes are
+        already stored. If the thread holds a different number, nothing is
+        written and :class:`ConversationConflictError` is raised. Returns the
+        next sequence number.
+        """
+        with self.transaction() as conn:
+            _restore_archive(conn, thread_id)
+            next_seq = _next_seq(conn, thread_id)
+            if next_seq != expected_seq:
+                raise ConversationConflictError(
+                    f"thread {thread_id} has {next_seq} stored messages, expected {expected_seq}"
+                )
+            _touch_conversation(conn, thread_id, title)
+            _insert_messages(conn, thread_id, next_seq, messages)
+        return next_seq + len(messages)
+
+    @timed("sqlite", op="save_conversation")
+    def save_conversation(
+        self,
+        thread_id: str,
+        messages: List[dict],
+        *,
+        title: Optional[str] = None,
+        start_seq: int = 0,
+    ):
+        """Persist messages of a conversation.
+
+        ``messages`` hold the thread from ``start_seq`` onward, so a window
+        from :meth:`load_conversation_window` can be saved as is. Only
+        messages past the stored tail are written when the stored history is
+        a prefix of ``messages``; the covered range is rewritten when history
+        was edited.
+        """
+        with self.transaction() as conn:
+            _restore_archive(conn, thread_id)
+            _touch_conversation(conn, thread_id, title)
+            stored = _next_seq(conn, thread_id)
+            if stored < start_seq:
+                raise ConversationConflictError(
+                    f"thread {thread_id} has {stored} stored messages, window starts at {start_seq}"
+                )
+            offset = stored - start_seq
+            # the whole overlap is compared: an edit anywhere in it means a rewrite
+            if offset <= len(messages) and _stored_prefix_matches(
+                conn, thread_id, start_seq, messages[:offset]
+            ):
+                _insert_messages(conn, thread_id, stored, messages[offset:])
+                return
+            conn.execute("DELETE FROM messages WHERE thread_id=? AND seq>=?", (thread_id, start_seq))
+            _insert_messages(conn, thread_id, start_seq, messages)
+
+    @timed("sqlite", op="load_conversation")
+    def load_conversation(self, thread_id: str) -> List[dict]:
+        """Retrieve messages for a conversation, archived or not."""
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT role, content, sources FROM messages WHERE thread_id=? ORDER BY seq",
+                (thread_id,),
+            ).fetchall() or _archived_rows(conn, thread_id)
+        result = []
+        for row in rows:
+            data = {
+                "role": row["role"],
+                "content": row["content"],
+            }
+            if row["sources"]:
+                data["sources"] = json.loads(row["sources"])
+            result.append(data)
+        return result
+
+    @timed("sqlite", op="load_conversation_window")
+    def load_conversation_window(
+        self,
+        thread_id: str,
+        *,
+        limit: int = WINDOW_SIZE,
+        before_seq: Optional[int] = None,
+    ) -> ConversationWindow:
+        """Retrieve the last ``limit`` messages before ``before_seq``.
+
+        Without ``before_seq`` the newest messages are returned. ``sources``
+        come back as :class:`LazySources` and are only decoded when read.
+        """
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT seq, role, content, sources FROM messages "
+                "WHERE thread_id=? AND seq<? ORDER BY seq DESC LIMIT ?",
+                (thread_id, before_seq if before_seq is not None else 2**63 - 1, limit),
+            ).fetchall()
+            rows.reverse()
+            if not rows:
+                archived = _archived_rows(conn, thread_id)
+                if before_seq is not None:
+                    archived = archived[:before_seq]
+                rows = archived[max(len(archived) - limit, 0):]
+        messages = []
+        for row in rows:
+            data = {
+                "role": row["role"],
+                "content": row["content"],
+            }
+            if row["sources"]:
+                data["sources"] = LazySources(row["sources"])
+            messages.append(data)
+        if rows:
+            start_seq = rows[0]["seq"]
+        else:
+            start_seq = before_seq if before_seq is not None else 0
+        return ConversationWindow(messages, start_seq)
+
+    @timed("sqlite", op="list_conversations")
+    def list_conversations(self) -> List[Tuple[str, str]]:
+        """List available conversations as (thread_id, title)."""
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT thread_id, title FROM conversations ORDER BY updated_at DESC"
+            ).fetchall()
+        return [(row["thread_id"], row["title"] or "") for row in rows]
+
+    @timed("sqlite", op="list_conversations_page")
+    def list_conversations_page(
+        self,
+        *,
+        limit: int = PAGE_SIZE,
+        cursor: Optional[Tuple[str, str]] = None,
+    ) -> ConversationPage:
+        """List conversations newest first, one page at a time.
+
+        Pass the ``next_cursor`` of a page as ``cursor`` to get the following
+        one. Message count and last message come from index lookups on
+        ``(thread_id, seq)`` (or the archive row), so the cost depends on the
+        page size only.
+        """
+        where = "WHERE (c.updated_at, c.thread_id) < (?, ?)" if cursor else ""
+        with self.connection() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT c.thread_id, c.title, c.updated_at,
+                    COALESCE((SELECT MAX(seq) + 1 FROM messages m
+                              WHERE m.thread_id = c.thread_id),
+                             a.message_count, 0) AS message_count,
+                    COALESCE((SELECT substr(content, 1, {PREVIEW_CHARS}) FROM messages m
+                              WHERE m.thread_id = c.thread_id ORDER BY seq DESC LIMIT 1),
+                             substr(a.last_message, 1, {PREVIEW_CHARS})) AS last_message
+                FROM conversations c
+                LEFT JOIN archived_conversations a ON a.thread_id = c.thread_id
+                {where}
+                ORDER BY c.updated_at DESC, c.thread_id DESC
+                LIMIT ?
+                """,
+                (*(cursor or ()), limit + 1),
+            ).fetchall()
+        items = [
+            ConversationSummary(
+                row["thread_id"],
+                row["title"] or "",
+                row["updated_at"],
+                row["message_count"],
+                row["last_message"],
+            )
+            for row in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = (items[-1].updated_at, items[-1].thread_id)
+        return ConversationPage(items, next_cursor)
+
+    @timed("sqlite", op="search_conversations")
+    def search_conversations(
+        self,
+        search: str,
+        *,
+        snippets: bool = False,
+        limit: Optional[int] = None,
+    ) -> List[tuple]:
+        """Search conversations by title or message content.
+
+        Results are ranked by relevance (bm25) when FTS5 is available. With
+        ``snippets=True`` each result is ``(thread_id, title, snippet)``, where
+        the snippet highlights the best match; otherwise ``(thread_id, title)``.
+        Archived conversations are not in the search index: when the index
+        gives fewer than ``limit`` results their messages are scanned, and
+        those hits come after the ranked ones.
+        """
+        query = _fts_query(search) if search else ""
+        if not query:
+            convs = self.list_conversations()
+            convs = convs[:limit] if limit is not None else convs
+            return [(tid, title, None) for tid, title in convs] if snippets else convs
+        with self.connection() as conn:
+            if _has_fts(conn):
+                rows = _search_fts(conn, query, snippets, limit)
+            else:
+                rows = _search_like(conn, search, limit)
+            if limit is None or len(rows) < limit:
+                rows += _search_archive(
+                    conn,
+                    search,
+                    {row["thread_id"] for row in rows},
+                    snippets,
+                    None if limit is None else limit - len(rows),
+                )
+        if snippets:
+            return [(row["thread_id"], row["title"] or "", row["snippet"]) for row in rows]
+        return [(row["thread_id"], row["title"] or "") for row in rows]
+
+    @timed("sqlite", op="delete_conversation")
+    def delete_conversation(self, thread_id: str) -> None:
+        """Remove a conversation, its messages and the agent checkpoints."""
+        with self.transaction() as conn:
+            _delete_thread(conn, thread_id)
+
+    @timed("sqlite", op="rename_conversation")
+    def rename_conversation(
+        self,
+        thread_id: str,
+        new_title: str,
+        *,
+        expected_title: Optional[str] = None,
+    ) -> bool:
+        """Change the title of a stored conversation.
+
+        With ``expected_title`` the title only changes if it still is that
+        value, so an automatic title never overwrites a rename by the user.
+        Returns whether the conversation was updated.
+        """
+        sql = "UPDATE conversations SET title=?, updated_at=? WHERE thread_id=?"
+        params = [new_title, datetime.now().isoformat(), thread_id]
+        if expected_title is not None:
+            sql += " AND title=?"
+            params.append(expected_title)
+        with self.transaction() as conn:
+            return conn.execute(sql, params).rowcount > 0
+
+    @timed("sqlite", op="archive_stale")
+    def archive_stale(self, days: float, *, now: Optional[datetime] = None) -> int:
+        """Compress the messages of conversations not updated for ``days`` days.
+
+        Archived threads read back transparently through the load methods and
+        are moved back into ``messages`` on the next write. Their agent
+        checkpoints are dropped and their content leaves the full-text index.
+        Returns the number of conversations archived.
+        """
+        cutoff = ((now or datetime.now()) - timedelta(days=days)).isoformat()
+        with self.connection() as conn:
+            stale = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT c.thread_id FROM conversations c WHERE c.updated_at < ? "
+                    "AND EXISTS (SELECT 1 FROM messages m WHERE m.thread_id = c.thread_id)",
+                    (cutoff,),
+                )
+            ]
+        archived = 0
+        # one short transaction per thread, so the app is never blocked for long
+        for thread_id in stale:
+            with self.transaction() as conn:
+                still_stale = conn.execute(
+                    "SELECT 1 FROM conversations WHERE thread_id=? AND updated_at < ?", (thread_id, cutoff)
+                ).fetchone()
+                if still_stale and _archive_thread(conn, thread_id):
+                    archived += 1
+        return archived
+
+    @timed("sqlite", op="purge")
+    def purge(self, days: float, *, now: Optional[datetime] = None) -> int:
+        """Delete conversations not updated for ``days`` days, archived or not.
+
+        Returns the number of conversations deleted.
+        """
+        cutoff = ((now or datetime.now()) - timedelta(days=days)).isoformat()
+        with self.transaction() as conn:
+            expired = [
+                row[0]
+                for row in conn.execute("SELECT thread_id FROM conversations WHERE updated_at < ?", (cutoff,))
+            ]
+            for thread_id in expired:
+                _delete_thread(conn, thread_id)
+        return len(expired)
+
+    @timed("sqlite", op="vacuum")
+    def vacuum(self) -> Tuple[int, int]:
+        """Return free pages to the file system; returns the size before and after.
+
+        The full-text indexes are optimized first, so the entries of deleted
+        messages go away too. New databases use incremental auto-vacuum, so
+        this only truncates the free pages; older files get one full
+        ``VACUUM`` that switches them to incremental mode.
+        """
+        with self.connection() as conn:
+            before = _database_bytes(conn)
+            if _has_fts(conn):
+                # merges the index segments, dropping the entries of deleted messages
+                with conn:
+                    conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('optimize')")
+                    conn.execute("INSERT INTO conversations_fts(conversations_fts) VALUES ('optimize')")
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0:
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+                # VACUUM may renumber the implicit rowids conversations_fts points to
+                if _has_fts(conn):
+                    with conn:
+                        conn.execute("INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild')")
+            else:
+                # execute() would only run the first step, which frees a single page
+                conn.executescript("PRAGMA incremental_vacuum")
+            # the file only shrinks once the WAL is checkpointed
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+            return before, _database_bytes(conn)
+
+    def maintenance(
+        self,
+        *,
+        archive_after_days: Optional[float] = None,
+        retention_days: Optional[float] = None,
+        now: Optional[datetime] = None,
+    ) -> MaintenanceReport:
+        """Purge expired conversations, archive stale ones and vacuum.
+
+        Either step is skipped when its number of days is ``None`` or 0.
+        """
+        with self.connection() as conn:
+            before = _database_bytes(conn)
+        purged = self.purge(retention_days, now=now) if retention_days else 0
+        archived = self.archive_stale(archive_after_days, now=now) if archive_after_days else 0
+        _, after = self.vacuum()
+        return MaintenanceReport(archived, purged, before, after)
+
+
+_storages: Dict[str, ConversationStorage] = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(db_path: str = DB_PATH) -> ConversationStorage:
+    """Return the process-wide storage (and connection pool) for ``db_path``."""
+    storage = _storages.get(db_path)
+    if storage is None:
+        with _storages_lock:
+            storage = _storages.setdefault(db_path, ConversationStorage(db_path))
+    return storage
+
+
+def close_all() -> None:
+    """Close the pooled connections of every storage opened so far."""
+    with _storages_lock:
+        for storage in _storages.values():
+            storage.close()
+        _storages.clear()
+
+
+# ====== module-level API (kept for compatibility) ======
+
+def append_messages(
+    thread_id: str,
+    messages: List[dict],
+    *,
+    expected_seq: int,
+    title: Optional[str] = None,
+    db_path: str = DB_PATH,
+) -> int:
+    """Append new messages to a conversation; see :meth:`ConversationStorage.append_messages`."""
+    return get_storage(db_path).append_messages(
+        thread_id, messages, expected_seq=expected_seq, title=title
+    )
 
 
 def save_conversation(
@@ -47,92 +1026,70 @@ def save_conversation(
     messages: List[dict],
     *,
     title: Optional[str] = None,
+    start_seq: int = 0,
     db_path: str = DB_PATH,
 ):
-    """Persist messages of a conversation."""
-    now = datetime.now().isoformat()
-    with closing(_get_conn(db_path)) as conn, conn:
-        conn.execute(
-            "INSERT INTO conversations(thread_id, updated_at, title) VALUES(?, ?, ?) "
-            "ON CONFLICT(thread_id) DO UPDATE SET updated_at=excluded.updated_at, title=COALESCE(?, title)",
-            (
-                thread_id,
-                now,
-                title,
-                title,
-            ),
-        )
-        conn.execute("DELETE FROM messages WHERE thread_id=?", (thread_id,))
-        for msg in messages:
-            conn.execute(
-                "INSERT INTO messages(thread_id, role, content, sources) VALUES(?, ?, ?, ?)",
-                (
-                    thread_id,
-                    msg.get("role"),
-                    msg.get("content"),
-                    json.dumps(msg.get("sources")) if msg.get("sources") is not None else None,
-                ),
-            )
+    """Persist messages of a conversation; see :meth:`ConversationStorage.save_conversation`."""
+    get_storage(db_path).save_conversation(thread_id, messages, title=title, start_seq=start_seq)
 
 
 def load_conversation(thread_id: str, db_path: str = DB_PATH) -> List[dict]:
     """Retrieve messages for a conversation."""
-    with closing(_get_conn(db_path)) as conn:
-        rows = conn.execute(
-            "SELECT role, content, sources FROM messages WHERE thread_id=? ORDER BY id",
-            (thread_id,),
-        ).fetchall()
-    result = []
-    for row in rows:
-        data = {
-            "role": row["role"],
-            "content": row["content"],
-        }
-        if row["sources"]:
-            data["sources"] = json.loads(row["sources"])
-        result.append(data)
-    return result
+    return get_storage(db_path).load_conversation(thread_id)
+
+
+def load_conversation_window(
+    thread_id: str,
+    *,
+    limit: int = WINDOW_SIZE,
+    before_seq: Optional[int] = None,
+    db_path: str = DB_PATH,
+) -> ConversationWindow:
+    """Retrieve a window of messages; see :meth:`ConversationStorage.load_conversation_window`."""
+    return get_storage(db_path).load_conversation_window(
+        thread_id, limit=limit, before_seq=before_seq
+    )
 
 
 def list_conversations(db_path: str = DB_PATH) -> List[Tuple[str, str]]:
     """List available conversations as (thread_id, title)."""
-    with closing(_get_conn(db_path)) as conn:
-        rows = conn.execute(
-            "SELECT thread_id, title FROM conversations ORDER BY updated_at DESC"
-        ).fetchall()
-    return [(row["thread_id"], row["title"] or "") for row in rows]
+    return get_storage(db_path).list_conversations()
+
+
+def list_conversations_page(
+    *,
+    limit: int = PAGE_SIZE,
+    cursor: Optional[Tuple[str, str]] = None,
+    db_path: str = DB_PATH,
+) -> ConversationPage:
+    """List one page of conversations; see :meth:`ConversationStorage.list_conversations_page`."""
+    return get_storage(db_path).list_conversations_page(limit=limit, cursor=cursor)
 
 
-def search_conversations(search: str, db_path: str = DB_PATH) -> List[Tuple[str, str]]:
+def search_conversations(
+    search: str,
+    db_path: str = DB_PATH,
+    *,
+    snippets: bool = False,
+    limit: Optional[int] = None,
+) -> List[tuple]:
     """Search conversations by title or message content."""
-    if not search:
-        return list_conversations(db_path)
-    like = f"%{search.lower()}%"
-    with closing(_get_conn(db_path)) as conn:
-        rows = conn.execute(
-            """
-            SELECT DISTINCT c.thread_id, c.title
-            FROM conversations c
-            LEFT JOIN messages m ON c.thread_id = m.thread_id
-            WHERE LOWER(COALESCE(c.title, '')) LIKE ? OR LOWER(m.content) LIKE ?
-            ORDER BY c.updated_at DESC
-            """,
-            (like, like),
-        ).fetchall()
-    return [(row["thread_id"], row["title"] or "") for row in rows]
+    return get_storage(db_path).search_conversations(search, snippets=snippets, limit=limit)
 
 
 def delete_conversation(thread_id: str, db_path: str = DB_PATH) -> None:
     """Remove a conversation and its messages."""
-    with closing(_get_conn(db_path)) as conn, conn:
-        conn.execute("DELETE FROM messages WHERE thread_id=?", (thread_id,))
-        conn.execute("DELETE FROM conversations WHERE thread_id=?", (thread_id,))
+    get_storage(db_path).delete_conversation(thread_id)
 
 
-def rename_conversation(thread_id: str, new_title: str, db_path: str = DB_PATH) -> None:
-    """Change the title of a stored conversation."""
-    with closing(_get_conn(db_path)) as conn, conn:
-        conn.execute(
-            "UPDATE conversations SET title=?, updated_at=? WHERE thread_id=?",
-            (new_title, datetime.now().isoformat(), thread_id),
-        )
+def rename_conversation(
+    thread_id: str,
+    new_title: str,
+    db_path: str = DB_PATH,
+    *,
+    expected_title: Optional[str] = None,
+) -> bool:
+    """Change the title of a stored conversation; see :meth:`ConversationStorage.rename_conversation`."""
+    return get_storage(db_path).rename_conversation(
+        thread_id, new_title, expected_title=expected_title
+    )
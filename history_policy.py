@@ -0,0 +1,295 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Optional, Sequence
+
+from langchain_core.messages import BaseMessage, SystemMessage
+
+from token_accounting import count_tokens, normalize_model_name
+
+# janela de contexto (tokens) por família de modelo; CONTEXT_TOKENS no .env tem prioridade
+CONTEXT_TOKENS = {
+    "mistral": 32768,
+    "mixtral": 32768,
+    "llama3": 8192,
+    "llama-3": 8192,
+    "openchat": 8192,
+    "gemma": 8192,
+    "nous-hermes2": 4096,
+    "gpt-4o": 128000,
+    "gpt-4": 8192,
+}
+DEFAULT_CONTEXT_TOKENS = 4096
+# parte da janela reservada para o prompt do sistema, as ferramentas e a resposta
+RESERVED_FRACTION = 0.4
+# custo aproximado de cada mensagem além do conteúdo (papel, separadores)
+MESSAGE_OVERHEAD_TOKENS = 4
+# resumos guardados em memória (um por conversa em andamento); os usados há mais tempo saem
+MAX_SUMMARIES = 1000
+
+
+def context_tokens_for(model_name: Optional[str]) -> int:
+    """Tamanho da janela de contexto do modelo (ou CONTEXT_TOKENS do ambiente)."""
+    if env := os.getenv("CONTEXT_TOKENS"):
+        return int(env)
+    name = normalize_model_name(model_name)
+    for prefix, size in CONTEXT_TOKENS.items():
+        if name.startswith(prefix):
+            return size
+    return DEFAULT_CONTEXT_TOKENS
+
+
+class HistoryReport(NamedTuple):
+    tokens_before: int
+    tokens_after: int
+    messages_before: int
+    messages_after: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+class HistoryPolicy:
+    """Escolhe quais mensagens do histórico vão para o modelo.
+
+    A base é uma janela deslizante: mantém as mensagens mais novas que cabem
+    em ``max_tokens``. A última mensagem do usuário (e o que veio depois dela,
+    como chamadas de ferramentas) sempre é enviada. O estado do grafo não é
+    alterado; só a entrada do modelo.
+    """
+
+    def __init__(self, max_tokens: int, model_name: Optional[str] = None):
+        self.max_tokens = max_tokens
+        self.model_name = model_name
+        self.last_report: Optional[HistoryReport] = None
+        self.tokens_saved_total = 0
+        # contagem por id de mensagem, para não recontar o histórico a cada turno
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._counts_lock = threading.Lock()
+
+    @classmethod
+    def for_model(cls, model_name: Optional[str], **kwargs) -> "HistoryPolicy":
+        budget = int(context_tokens_for(model_name) * (1 - RESERVED_FRACTION))
+        return cls(budget, model_name=model_name, **kwargs)
+
+    # ====== contagem ======
+
+    def message_tokens(self, msg: BaseMessage) -> int:
+        key = msg.id
+        if key is not None:
+            with self._counts_lock:
+                if key in self._counts:
+                    self._counts.move_to_end(key)
+                    return self._counts[key]
+        n = count_tokens(msg.text(), self.model_name) + MESSAGE_OVERHEAD_TOKENS
+        if key is not None:
+            with self._counts_lock:
+                self._counts[key] = n
+                if len(self._counts) > 10_000:
+                    self._counts.popitem(last=False)
+        return n
+
+    def _total(self, messages: Sequence[BaseMessage]) -> int:
+        return sum(self.message_tokens(m) for m in messages)
+
+    # ====== seleção ======
+
+    @staticmethod
+    def _current_turn_start(messages: Sequence[BaseMessage]) -> int:
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i].type == "human":
+                return i
+        return 0
+
+    @staticmethod
+    def _clean_start(messages: List[BaseMessage]) -> List[BaseMessage]:
+        # uma resposta de ferramenta sem a chamada que a originou é rejeitada pelos provedores
+        start = 0
+        while start < len(messages) and messages[start].type == "tool":
+            start += 1
+        return messages[start:]
+
+    def _window(self, history: Sequence[BaseMessage], budget: int) -> List[BaseMessage]:
+        """Mensagens mais novas de ``history`` que cabem em ``budget``."""
+        kept: List[BaseMessage] = []
+        for msg in reversed(history):
+            cost = self.message_tokens(msg)
+            if cost > budget:
+                break
+            budget -= cost
+            kept.append(msg)
+        kept.reverse()
+        return self._clean_start(kept)
+
+    def select(self, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        turn = self._current_turn_start(messages)
+        current = list(messages[turn:])
+        budget = self.max_tokens - self._total(current)
+        return self._window(messages[:turn], budget) + current
+
+    def apply(self, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        return self._apply(messages)[0]
+
+    def _apply(self, messages: Sequence[BaseMessage]):
+        selected = self.select(messages)
+        before, after = self._total(messages), self._total(selected)
+        report = HistoryReport(before, after, len(messages), len(selected))
+        with self._counts_lock:
+            self.last_report = report
+            self.tokens_saved_total += max(before - after, 0)
+        return selected, report
+
+    def as_prompt(self, system_prompt: str, on_report: Optional[Callable[[HistoryReport], None]] = None):
+        """Função ``prompt`` para ``create_react_agent``."""
+        system = SystemMessage(content=system_prompt)
+
+        def prompt(state) -> List[BaseMessage]:
+            # o relatório desta chamada, não o last_report, que é de todas as sessões
+            selected, report = self._apply(state["messages"])
+            if on_report is not None:
+                on_report(report)
+            return [system] + selected
+
+        return prompt
+
+
+class SlidingWindowPolicy(HistoryPolicy):
+    """Janela deslizante por orçamento de tokens (comportamento da base)."""
+
+
+class MiddleOutPolicy(HistoryPolicy):
+    """Mantém o começo e o fim da conversa e corta o meio.
+
+    O começo costuma trazer o contexto da conversa; o fim, o assunto atual.
+    Saídas de ferramentas de turnos anteriores maiores que ``max_tool_tokens``
+    também são encurtadas no meio.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        model_name: Optional[str] = None,
+        *,
+        head_messages: int = 2,
+        max_tool_tokens: int = 300,
+    ):
+        super().__init__(max_tokens, model_name=model_name)
+        self.head_messages = head_messages
+        self.max_tool_tokens = max_tool_tokens
+
+    def _shrink_tool_output(self, msg: BaseMessage) -> BaseMessage:
+        if msg.type != "tool" or self.message_tokens(msg) <= self.max_tool_tokens:
+            return msg
+        text = msg.text()
+        # aproximação por caracteres: cerca de 4 por token
+        keep = self.max_tool_tokens * 2
+        shrunk = text[:keep] + "\n[…]\n" + text[-keep:]
+        return msg.model_copy(update={"content": shrunk, "id": f"{msg.id}:middle-out"})
+
+    def select(self, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        turn = self._current_turn_start(messages)
+        current = list(messages[turn:])
+        history = [self._shrink_tool_output(m) for m in messages[:turn]]
+        budget = self.max_tokens - self._total(current)
+
+        head: List[BaseMessage] = []
+        for msg in history[: self.head_messages]:
+            cost = self.message_tokens(msg)
+            if cost > budget // 2:
+                break
+            budget -= cost
+            head.append(msg)
+        # o começo não pode terminar numa chamada de ferramenta sem a resposta
+        while head and (head[-1].type == "tool" or getattr(head[-1], "tool_calls", None)):
+            budget += self.message_tokens(head.pop())
+        tail = self._window(history[len(head):], budget)
+        return head + tail + current
+
+
+class RollingSummaryPolicy(HistoryPolicy):
+    """Resume os turnos antigos em segundo plano e envia o resumo no lugar deles.
+
+    O que não cabe na janela é resumido por ``summarize`` numa thread de
+    fundo; enquanto o resumo não fica pronto, vale a janela deslizante. Cada
+    novo resumo parte do anterior e inclui só as mensagens que saíram da
+    janela desde então.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        model_name: Optional[str] = None,
+        *,
+        summarize: Callable[[Optional[str], List[BaseMessage]], str],
+        summary_fraction: float = 0.25,
+        max_summaries: int = MAX_SUMMARIES,
+    ):
+        super().__init__(max_tokens, model_name=model_name)
+        self.summarize = summarize
+        self.summary_budget = int(max_tokens * summary_fraction)
+        self.max_summaries = max_summaries
+        # id da última mensagem resumida -> resumo de tudo até ela
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: set = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+
+    def _latest_summary(self, dropped: Sequence[BaseMessage]):
+        """(índice após a última mensagem coberta, resumo) — ou (0, None)."""
+        with self._lock:
+            for i in range(len(dropped) - 1, -1, -1):
+                key = dropped[i].id
+                if key in self._summaries:
+                    self._summaries.move_to_end(key)
+                    return i + 1, self._summaries[key]
+        return 0, None
+
+    def _schedule(self, previous: Optional[str], pending: List[BaseMessage]) -> None:
+        key = pending[-1].id
+        with self._lock:
+            if key is None or key in self._pending or key in self._summaries:
+                return
+            self._pending.add(key)
+
+        def run():
+            try:
+                summary = self.summarize(previous, pending)
+                with self._lock:
+                    self._summaries[key] = summary
+                    while len(self._summaries) > self.max_summaries:
+                        self._summaries.popitem(last=False)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+        self._executor.submit(run)
+
+    def select(self, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        turn = self._current_turn_start(messages)
+        current = list(messages[turn:])
+        budget = self.max_tokens - self._total(current) - self.summary_budget
+        window = self._window(messages[:turn], budget)
+        dropped = messages[: turn - len(window)]
+        if not dropped:
+            return window + current
+
+        covered, summary = self._latest_summary(dropped)
+        if covered < len(dropped):
+            self._schedule(summary, list(dropped[covered:]))
+        if summary is None:
+            return window + current
+        note = SystemMessage(content=f"Resumo da conversa até aqui:\n{summary}")
+        return [note] + window + current
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Espera os resumos em andamento (útil em testes)."""
+        self._executor.submit(lambda: None).result(timeout=timeout)
+
+
+POLICIES = {
+    "window": SlidingWindowPolicy,
+    "middle_out": MiddleOutPolicy,
+    "summary": RollingSummaryPolicy,
+}
@@ -0,0 +1,186 @@
+"""Conversão de corpos de e-mail em HTML para texto (usada pelo format_body).
+
+O parser é o ``html.parser`` da biblioteca padrão, em Python puro, e é ele
+que domina o tempo: sem limite de caracteres, um documento grande (~600 KB)
+leva de 2 a 3 vezes o tempo das expressões regulares que ele substituiu (veja
+benchmarks/bench_format_body.py). Em troca o custo é linear mesmo com
+marcação quebrada (âncoras sem fechamento) e, com ``max_chars``, a leitura
+para no limite, então um corpo cortado em 8000 caracteres custa poucos ms
+qualquer que seja o tamanho do documento.
+"""
+import re
+from html.parser import HTMLParser
+from typing import List, Optional
+
+from token_accounting import truncate_to_tokens
+
+# conteúdo dessas tags nunca aparece no texto
+SKIP_TAGS = frozenset({"style", "script", "head", "title", "noscript", "template"})
+# tags que separam parágrafos (linha em branco) e que só quebram a linha
+PARAGRAPH_TAGS = frozenset({
+    "p", "div", "table", "ul", "ol", "blockquote", "pre", "hr", "section", "article",
+    "header", "footer", "h1", "h2", "h3", "h4", "h5", "h6",
+})
+LINE_TAGS = frozenset({"br", "tr", "li", "dt", "dd"})
+TRUNCATION_MARK = "…"
+# o HTML é entregue ao parser em pedaços deste tamanho; com limite de
+# caracteres, o resto do documento nem chega a ser lido
+FEED_CHUNK_CHARS = 16384
+
+# \s também cobre o &nbsp; (U+00A0) já decodificado
+_SPACES = re.compile(r"\s+")
+
+
+class _Stop(Exception):
+    pass
+
+
+class HtmlTextExtractor(HTMLParser):
+    """Converte HTML em texto numa única passada.
+
+    Links viram ``[texto](url)``, entidades são decodificadas pelo próprio
+    parser e as tags de bloco viram quebras de linha, então os parágrafos
+    são preservados. Com ``max_chars`` a leitura para assim que o limite é
+    atingido.
+    """
+
+    def __init__(self, max_chars: Optional[int] = None):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.truncated = False
+        self._parts: List[str] = []
+        self._length = 0
+        # quebra pendente antes do próximo texto: 0 nada, 1 linha, 2 parágrafo
+        self._pending_break = 0
+        # espaço pendente antes do próximo texto; espaços nunca são emitidos no fim
+        self._pending_space = False
+        self._at_line_start = True
+        self._skip_depth = 0
+        # (href, índice em _parts onde o texto do link começa, _at_line_start naquele ponto)
+        self._links: List[tuple] = []
+
+    # ====== montagem do texto ======
+
+    def _emit(self, text: str) -> None:
+        """Acrescenta ``text`` (espaços já normalizados) depois da quebra ou espaço pendente."""
+        word = text.strip(" ")
+        if not word:
+            # só espaço: vira no máximo um espaço pendente entre palavras
+            if text and not self._at_line_start and not self._pending_break:
+                self._pending_space = True
+            return
+        if self._pending_break and self._length:
+            separator = "\n" * self._pending_break
+            self._at_line_start = True
+        elif (self._pending_space or text[0] == " ") and not self._at_line_start:
+            separator = " "
+        else:
+            separator = ""
+        self._pending_break = 0
+        self._pending_space = text[-1] == " "
+        if separator:
+            word = separator + word
+        self._parts.append(word)
+        self._length += len(word)
+        self._at_line_start = False
+        if self.max_chars is not None and self._length > self.max_chars:
+            self.truncated = True
+            raise _Stop
+
+    def _break(self, level: int) -> None:
+        if level > self._pending_break:
+            self._pending_break = level
+        self._pending_space = False
+
+    # ====== eventos do parser ======
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif self._skip_depth:
+            return
+        elif tag == "a":
+            href = dict(attrs).get("href")
+            self._links.append((href.strip() if href else None, len(self._parts), self._at_line_start))
+        elif tag in PARAGRAPH_TAGS:
+            self._break(2)
+        elif tag in LINE_TAGS:
+            self._break(1)
+            if tag == "li":
+                self._emit("- ")
+        elif tag in ("td", "th") and not self._at_line_start:
+            # células vizinhas não podem grudar
+            self._pending_space = True
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            return
+        self.handle_starttag(tag, attrs)
+        if tag == "a":
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif self._skip_depth:
+            return
+        elif tag == "a" and self._links:
+            href, start, at_line_start = self._links.pop()
+            raw = "".join(self._parts[start:])
+            text = " ".join(raw.split())
+            if href is None or not text:
+                return
+            # troca o texto já emitido pelo link em markdown, no mesmo lugar,
+            # com a mesma quebra ou espaço que vinha antes dele
+            del self._parts[start:]
+            self._length -= len(raw)
+            self._at_line_start = at_line_start
+            pending_break, pending_space = self._pending_break, self._pending_space
+            lead = raw[: len(raw) - len(raw.lstrip())]
+            self._pending_break = lead.count("\n")
+            self._pending_space = False
+            self._emit(f" [{text}]({href})" if lead == " " else f"[{text}]({href})")
+            self._pending_break, self._pending_space = pending_break, pending_space
+        elif tag in PARAGRAPH_TAGS:
+            self._break(2)
+        elif tag in ("tr", "li", "dt", "dd"):
+            self._break(1)
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if data.isspace():
+            # indentação entre tags: no máximo um espaço entre palavras
+            if not self._at_line_start and not self._pending_break:
+                self._pending_space = True
+            return
+        self._emit(_SPACES.sub(" ", data))
+
+    # ====== resultado ======
+
+    def text(self) -> str:
+        text = "".join(self._parts).strip()
+        if self.max_chars is not None and len(text) > self.max_chars:
+            text = text[: self.max_chars].rstrip()
+            self.truncated = True
+        return text + TRUNCATION_MARK if self.truncated else text
+
+
+def html_to_text(
+    html: str,
+    max_chars: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+    model_name: Optional[str] = None,
+) -> str:
+    """Texto de ``html``, com limite opcional de caracteres e/ou de tokens."""
+    parser = HtmlTextExtractor(max_chars=max_chars)
+    try:
+        for start in range(0, len(html), FEED_CHUNK_CHARS):
+            parser.feed(html[start:start + FEED_CHUNK_CHARS])
+        parser.close()
+    except _Stop:
+        pass
+    text = parser.text()
+    if max_tokens is not None:
+        text = truncate_to_tokens(text, max_tokens, model_name, mark=TRUNCATION_MARK)
+    return text
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Any, Callable, NamedTuple, Optional, Sequence
+
+from conversation_storage import DB_PATH, get_storage
+
+# desligado por padrão: LLM_CACHE=1 liga
+ENABLED = os.getenv("LLM_CACHE", "0") == "1"
+TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX", "1000"))
+
+# ferramentas cujo resultado depende da hora ou da caixa de e-mail: um turno
+# que chamou qualquer uma delas nunca vai para o cache
+UNCACHEABLE_TOOLS = frozenset(
+    {"GetCurrentDateTime", "GetEmails", "GetEmailBodies", "ReadMore", "DeleteEmailById"}
+)
+
+_SPACES = re.compile(r"\s+")
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+    entries: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def normalize_prompt(text: str) -> str:
+    """Forma canônica do texto: NFC e espaços colapsados."""
+    return _SPACES.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+def make_key(model_name: Optional[str], messages: Sequence[Any], tool_state: Any = None) -> str:
+    """Chave do cache: modelo, mensagens normalizadas e estado das ferramentas.
+
+    ``messages`` pode ter strings, dicts ``{"role", "content"}`` ou mensagens
+    do LangChain.
+    """
+    parts = []
+    for msg in messages:
+        if isinstance(msg, str):
+            parts.append(["", normalize_prompt(msg)])
+        elif isinstance(msg, dict):
+            parts.append([msg.get("role", ""), normalize_prompt(msg.get("content", ""))])
+        else:
+            parts.append([msg.type, normalize_prompt(msg.text())])
+    payload = json.dumps([model_name or "", parts, tool_state], ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Cache de respostas do modelo no SQLite, com validade (TTL) e LRU.
+
+    Entradas mais velhas que ``ttl`` são ignoradas e apagadas; passando de
+    ``max_entries``, saem as usadas há mais tempo. ``hits`` e ``misses``
+    contam as consultas deste processo.
+    """
+
+    def __init__(
+        self,
+        db_path: str = DB_PATH,
+        *,
+        ttl: float = TTL_SECONDS,
+        max_entries: int = MAX_ENTRIES,
+        enabled: bool = True,
+    ):
+        self.storage = get_storage(db_path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self.storage.transaction() as conn:
+            row = conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row["created_at"] > self.ttl:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                conn.execute(
+                    "UPDATE llm_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key)
+                )
+        self._count(row is not None)
+        return row["response"] if row is not None else None
+
+    def put(self, key: str, response: str, model_name: Optional[str] = None) -> None:
+        if not self.enabled or not response:
+            return
+        now = time.time()
+        with self.storage.transaction() as conn:
+            conn.execute(
+                """INSERT INTO llm_cache(key, model, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    response = excluded.response, created_at = excluded.created_at,
+                    last_used = excluded.last_used""",
+                (key, model_name, response, now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now: float) -> None:
+        conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+        excess = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+
+    def cached(self, key: str, compute: Callable[[], str], model_name: Optional[str] = None) -> str:
+        """Resposta do cache ou, se não houver, a de ``compute()`` (que é guardada)."""
+        response = self.get(key)
+        if response is None:
+            response = compute()
+            self.put(key, response, model_name)
+        return response
+
+    def stats(self) -> CacheStats:
+        with self.storage.connection() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return CacheStats(self.hits, self.misses, entries)
+
+    def clear(self) -> None:
+        with self.storage.transaction() as conn:
+            conn.execute("DELETE FROM llm_cache")
@@ -1,22 +1,371 @@
+import logging
+import os
 import requests
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from token_manager import TokenManager # ajuste conforme seu projeto
+from mailbox_mirror import DeltaExpiredError, MailboxMirror
+from html_text import html_to_text
+from token_accounting import truncate_to_tokens
+from metrics import span
 from pprint import pprint
 
-def get_emails(status="unread", limit=10, mark_as_read=True, subject_keyword=None):
+# URL base do Microsoft Graph; pode apontar para um servidor local de testes
+GRAPH_URL = os.getenv("GRAPH_BASE_URL", "https://graph.microsoft.com/v1.0")
+# o endpoint $batch aceita no máximo 20 requisições por chamada
+BATCH_LIMIT = 20
+MAX_RETRIES = 5
+MAX_RETRY_AFTER = 60
+POOL_SIZE = 10
+
+# campos pedidos na listagem; o corpo completo só vem de get_email_bodies
+LIST_FIELDS = "id,subject,from,receivedDateTime,bodyPreview,isRead"
+# pede o corpo já em texto puro em vez de HTML
+PREFER_TEXT_BODY = 'outlook.body-content-type="text"'
+
+# ====== ESPELHO LOCAL DA CAIXA DE ENTRADA ======
+# MAIL_MIRROR=1 liga o espelho. Ele cobre só a Caixa de Entrada dos últimos
+# MAIL_SYNC_DAYS dias; a consulta direta (padrão) vê todas as pastas e datas
+MAIL_MIRROR = os.getenv("MAIL_MIRROR", "0") == "1"
+# a primeira sincronização só traz os e-mails recebidos nesse período (dias)
+MAIL_SYNC_DAYS = int(os.getenv("MAIL_SYNC_DAYS", "90"))
+DELTA_PAGE_SIZE = 100
+# leitura direta (sem espelho): e-mails por página e buscas antecipadas simultâneas
+LIST_PAGE_SIZE = 50
+PREFETCH_WORKERS = 4
+
+# ====== LIMITES DO CORPO DOS E-MAILS ======
+# corpos maiores que isso são cortados antes de irem para o modelo (0 = sem limite)
+BODY_MAX_CHARS = int(os.getenv("MAIL_BODY_MAX_CHARS", "8000"))
+BODY_MAX_TOKENS = int(os.getenv("MAIL_BODY_MAX_TOKENS", "0"))
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+_mailbox = None
+_initial_sync = None
+_executor = None
+# permite trocar a espera nos testes
+_sleep = time.sleep
+
+
+class GraphRequestError(RuntimeError):
+    """Resposta de erro do Graph (depois das novas tentativas)."""
+
+    def __init__(self, status_code, text):
+        super().__init__(f"{status_code} - {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+def get_session():
+    """Sessão HTTP compartilhada: reaproveita conexões (e o handshake TLS) entre chamadas."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_mailbox():
+    """Espelho local da caixa de entrada (None sem MAIL_MIRROR=1)."""
+    global _mailbox
+    if not MAIL_MIRROR:
+        return None
+    if _mailbox is None:
+        with _session_lock:
+            if _mailbox is None:
+                _mailbox = MailboxMirror()
+    return _mailbox
+
+
+def _access_token():
+    # instância única por processo: o token fica em memória e é renovado em segundo plano
+    return TokenManager.shared().get_access_token()
+
+
+def _retry_after(headers, default=1):
+    """Segundos a esperar segundo o cabeçalho Retry-After (limitado a MAX_RETRY_AFTER)."""
+    for key, value in (headers or {}).items():
+        if key.lower() == "retry-after":
+            try:
+                return min(max(int(value), 0), MAX_RETRY_AFTER)
+            except (TypeError, ValueError):
+                break
+    return default
+
+
+def graph_batch(requests_list, access_token, session=None):
+    """
+    Envia requisições ao Graph pelo endpoint JSON $batch, em lotes de até BATCH_LIMIT.
+
+    requests_list: lista de dicts {"method", "url" (relativa, ex: "/me/messages/ID"), "body"?, "headers"?}
+    Retorna uma lista com a resposta de cada requisição, na mesma ordem:
+    dicts {"status", "headers", "body"}. Itens com 429 (throttling) são
+    reenviados após o tempo indicado em Retry-After, até MAX_RETRIES vezes.
+    """
+    session = session or get_session()
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json",
+    }
+    results = [None] * len(requests_list)
+
+    for start in range(0, len(requests_list), BATCH_LIMIT):
+        todo = {}
+        for i in range(start, min(start + BATCH_LIMIT, len(requests_list))):
+            req = {"id": str(i), "method": requests_list[i]["method"], "url": requests_list[i]["url"]}
+            req_headers = dict(requests_list[i].get("headers", {}))
+            if "body" in requests_list[i]:
+                req["body"] = requests_list[i]["body"]
+                req_headers["Content-Type"] = "application/json"
+            if req_headers:
+                req["headers"] = req_headers
+            todo[req["id"]] = req
+
+        attempt = 0
+        while todo:
+            try:
+                with span("graph_request", method="POST", endpoint="$batch") as fields:
+                    response = session.post(f"{GRAPH_URL}/$batch", headers=headers, json={"requests": list(todo.values())})
+                    fields.update(status=response.status_code, requests=len(todo))
+            except requests.exceptions.RequestException as e:
+                logger.error(f"🚨 Exceção na requisição em lote: {e}")
+                for req_id in todo:
+                    results[int(req_id)] = {"status": None, "headers": {}, "body": str(e)}
+                break
+
+            if response.status_code in (429, 503) and attempt < MAX_RETRIES:
+                attempt += 1
+                delay = _retry_after(response.headers)
+                logger.warning(f"⏳ Graph limitou as requisições ({response.status_code}); nova tentativa em {delay}s.")
+                _sleep(delay)
+                continue
+            if response.status_code != 200:
+                logger.warning(f"⚠️ Erro na requisição em lote: {response.status_code} - {response.text}")
+                for req_id in todo:
+                    results[int(req_id)] = {"status": response.status_code, "headers": {}, "body": response.text}
+                break
+
+            retry, delay = {}, 0
+            for item in response.json().get("responses", []):
+                if item.get("status") == 429 and attempt < MAX_RETRIES:
+                    retry[item["id"]] = todo[item["id"]]
+                    delay = max(delay, _retry_after(item.get("headers")))
+                else:
+                    results[int(item["id"])] = item
+            if retry:
+                attempt += 1
+                logger.warning(f"⏳ {len(retry)} requisição(ões) limitadas pelo Graph; nova tentativa em {delay}s.")
+                _sleep(delay)
+            todo = retry
+
+    return results
+
+
+def get_emails(status="unread", limit=10, mark_as_read=True, subject_keyword=None, include_body=False, session=None):
     """
     status: 'unread', 'read' ou 'all'
     limit: quantidade máxima de e-mails a retornar
     mark_as_read: se True, marca os e-mails como lidos após recuperar
     subject_keyword: string opcional para filtrar e-mails por assunto
+    include_body: se True, traz o corpo completo; por padrão só o início (bodyPreview)
+    """
+    logger.debug("🔄 Iniciando a obtenção de e-mails...")
+    session = session or get_session()
+
+    # com o espelho em dia, filtros e ordenação são resolvidos no banco local
+    mailbox = get_mailbox()
+    if mailbox is not None and _refresh_mailbox(mailbox, session):
+        emails = mailbox.query(status, limit, subject_keyword)
+        logger.info(f"📥 Encontrados {len(emails)} e-mails no espelho local.")
+        if not emails:
+            return "Nenhum e-mail encontrado com esse filtro."
+        if include_body:
+            bodies = get_email_bodies([email["id"] for email in emails], session=session)
+            for email in emails:
+                email["body"] = bodies[email["id"]]
+    else:
+        emails = _get_emails_live(status, limit, subject_keyword, include_body, session)
+        if isinstance(emails, str):
+            return emails
+
+    if mark_as_read:
+        mark_unread_as_read(emails, session=session)
+
+    logger.debug("📤 Processamento de e-mails concluído.")
+    return emails
+
+
+def mark_unread_as_read(emails, session=None):
+    """Marca como lidos os e-mails da lista (de ``get_emails``) que ainda não foram lidos."""
+    unread_ids = [email["id"] for email in emails if email["isRead"] is False]
+    if unread_ids:
+        mark_emails_as_read(unread_ids, session=session)
+
+
+def _refresh_mailbox(mailbox, session):
+    """Sincroniza o espelho se estiver velho. False se ele ainda não puder ser usado."""
+    if mailbox.synced_at is None:
+        # a primeira rodada baixa MAIL_SYNC_DAYS dias de e-mail: roda em segundo
+        # plano e, até terminar, as consultas vão direto ao Graph
+        _start_initial_sync(mailbox, session)
+        return False
+    try:
+        changes = mailbox.ensure_fresh(_delta_fetcher(session), _delta_url())
+        if changes is not None:
+            logger.info(f"🔁 Espelho da caixa de entrada sincronizado ({changes} alterações).")
+    except Exception as exc:
+        logger.warning(f"⚠️ Falha ao sincronizar o espelho, usando os dados locais: {exc}")
+    return True
+
+
+def _start_initial_sync(mailbox, session):
+    global _initial_sync
+    with _session_lock:
+        if _initial_sync is not None and _initial_sync.is_alive():
+            return
+        _initial_sync = threading.Thread(
+            target=_run_initial_sync, args=(mailbox, session), name="mail-mirror-sync", daemon=True
+        )
+        _initial_sync.start()
+
+
+def _run_initial_sync(mailbox, session):
+    try:
+        changes = mailbox.ensure_fresh(_delta_fetcher(session), _delta_url())
+        logger.info(f"🔁 Primeira sincronização do espelho concluída ({changes} e-mails).")
+    except Exception as exc:
+        # a próxima consulta tenta de novo
+        logger.warning(f"⚠️ Falha na primeira sincronização do espelho: {exc}")
+
+
+def _delta_url():
+    since = (datetime.now(timezone.utc) - timedelta(days=MAIL_SYNC_DAYS)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return (
+        f"{GRAPH_URL}/me/mailFolders/inbox/messages/delta"
+        f"?$select={LIST_FIELDS}&$filter=receivedDateTime ge {since}"
+    )
+
+
+def _delta_fetcher(session):
+    """Função que busca uma página da consulta delta (token obtido só se preciso)."""
+    access_token = None
+
+    def fetch_page(url):
+        nonlocal access_token
+        access_token = access_token or _access_token()
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Prefer": f"{PREFER_TEXT_BODY}, odata.maxpagesize={DELTA_PAGE_SIZE}",
+        }
+        try:
+            page = _get_json(session, url, headers)
+        except GraphRequestError as exc:
+            if exc.status_code == 410:
+                raise DeltaExpiredError(exc.text) from exc
+            raise
+        items = [
+            {"id": msg["id"], "removed": True} if "@removed" in msg else _email_summary(msg)
+            for msg in page.get("value", [])
+        ]
+        return items, page.get("@odata.nextLink"), page.get("@odata.deltaLink")
+
+    return fetch_page
+
+
+def _email_summary(msg):
+    """Cabeçalhos e preview de uma mensagem do Graph (campos ausentes ficam None)."""
+    preview = msg.get("bodyPreview")
+    return {
+        "id": msg["id"],
+        "subject": msg.get("subject"),
+        "from": (msg.get("from") or {}).get("emailAddress", {}).get("address"),
+        "receivedDateTime": msg.get("receivedDateTime"),
+        "isRead": msg.get("isRead"),
+        "preview": None if preview is None else clean_text(preview),
+    }
+
+
+def _get_emails_live(status, limit, subject_keyword, include_body, session):
+    """Consulta direta ao Graph, com filtro e ordenação no servidor."""
+    try:
+        emails = list(iter_emails(status, limit, subject_keyword, include_body, session=session))
+    except GraphRequestError as exc:
+        logger.warning(f"⚠️ Erro ao buscar e-mails: {exc}")
+        return f"Erro ao buscar e-mails: {exc}"
+
+    if not emails:
+        logger.info("⚠️ Nenhum e-mail encontrado com esse filtro.")
+        return "Nenhum e-mail encontrado com esse filtro."
+
+    logger.info(f"📥 Encontrados {len(emails)} e-mails.")
+    return emails
+
+
+def iter_emails(status="unread", limit=10, subject_keyword=None, include_body=False, session=None, page_size=LIST_PAGE_SIZE):
+    """
+    Gera os e-mails direto do Graph, página a página (seguindo @odata.nextLink).
+
+    Cada página é processada assim que chega e a leitura para ao atingir
+    `limit`. Quando ainda faltam páginas, a próxima é buscada em segundo
+    plano enquanto a atual é limpa.
     """
-    print("🔄 Iniciando a obtenção de e-mails...")
+    session = session or get_session()
+    access_token = _access_token()
+    logger.debug("✅ Token de acesso obtido.")
 
-    # Inicializando o TokenManager
-    tm = TokenManager()
-    access_token = tm.get_access_token()
-    print(f"✅ Token de acesso obtido: {access_token[:10]}...")  # Mostra os primeiros 10 caracteres do token
-  
+    url = _list_url(status, min(limit, page_size), subject_keyword, include_body)
+    logger.debug(f"🔗 URL final da requisição: {url}")
+
+    # Configurando os cabeçalhos da requisição
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json",
+        "ConsistencyLevel": "eventual",
+        "Prefer": PREFER_TEXT_BODY,
+    }
+
+    page = _get_json(session, url, headers)
+    remaining = limit
+    prefetch = None
+    try:
+        while True:
+            messages = page.get("value", [])
+            next_link = page.get("@odata.nextLink")
+            if next_link and remaining > len(messages):
+                prefetch = _prefetch_executor().submit(_get_json, session, next_link, headers)
+
+            for msg in messages:
+                email = _email_summary(msg)
+                if include_body:
+                    email["body"] = _message_body(msg)
+                yield email
+                remaining -= 1
+                if remaining <= 0:
+                    return
+
+            if prefetch is None:
+                return
+            page, prefetch = prefetch.result(), None
+    finally:
+        # quem parou de consumir antes do fim não precisa da página já pedida
+        if prefetch is not None:
+            prefetch.cancel()
+
+
+def _list_url(status, top, subject_keyword, include_body):
     # Definindo o filtro de status
     status_filter = {
         "unread": "isRead eq false",
@@ -27,134 +376,174 @@ def get_emails(status="unread", limit=10, mark_as_read=True, subject_keyword=Non
     filters = []
     if status_filter.get(status):
         filters.append(status_filter[status])
-        print(f"🔍 Filtro de status aplicado: {status_filter[status]}")
+        logger.debug(f"🔍 Filtro de status aplicado: {status_filter[status]}")
     else:
-        print(f"⚠️ Status inválido fornecido: {status}. Considerando 'all'.")
+        logger.warning(f"⚠️ Status inválido fornecido: {status}. Considerando 'all'.")
 
     if subject_keyword:
         filters.append(f"contains(subject,'{subject_keyword}')")
-        print(f"🔍 Filtro de assunto aplicado: {subject_keyword}")
+        logger.debug(f"🔍 Filtro de assunto aplicado: {subject_keyword}")
 
     # Montando a URL de requisição
-    url = "https://graph.microsoft.com/v1.0/me/messages"
+    url = f"{GRAPH_URL}/me/messages"
     #usando o client_id
     #url = f"https://graph.microsoft.com/v1.0/users/{tm.user_name}/messages"
 
     query_parts = []
     if filters:
         query_parts.append(f"$filter={' and '.join(filters)}")
-        print(f"🔍 Filtros aplicados: {filters}")
+        logger.debug(f"🔍 Filtros aplicados: {filters}")
 
+    query_parts.append(f"$select={LIST_FIELDS}" + (",body" if include_body else ""))
     query_parts.append("$orderby=receivedDateTime desc")
-    query_parts.append(f"$top={limit}")
-    url += "?" + "&".join(query_parts)
-
-    print(f"🔗 URL final da requisição: {url}")
-
-    # Configurando os cabeçalhos da requisição
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-        "ConsistencyLevel": "eventual"
-    }
-
-    # Realizando a requisição
-    response = requests.get(url, headers=headers)
+    query_parts.append(f"$top={top}")
+    return url + "?" + "&".join(query_parts)
+
+
+def _get_json(session, url, headers):
+    """GET no Graph com novas tentativas em 429/503; devolve o JSON ou levanta GraphRequestError."""
+    for attempt in range(MAX_RETRIES + 1):
+        with span("graph_request", method="GET", endpoint=_endpoint(url)) as fields:
+            response = session.get(url, headers=headers)
+            fields["status"] = response.status_code
+        if response.status_code not in (429, 503) or attempt == MAX_RETRIES:
+            break
+        _sleep(_retry_after(response.headers))
     if response.status_code != 200:
-        print(f"⚠️ Erro ao buscar e-mails: {response.status_code} - {response.text}")
-        return f"Erro ao buscar e-mails: {response.status_code} - {response.text}"
-
-    print(f"✅ Requisição bem-sucedida! Status code: {response.status_code}")
-
-    messages = response.json().get("value", [])
-    if not messages:
-        print("⚠️ Nenhum e-mail encontrado com esse filtro.")
-        return "Nenhum e-mail encontrado com esse filtro."
-
-    emails = []
-    print(f"📥 Encontrados {len(messages)} e-mails.")
-
-    for msg in messages:
-        msg_id = msg["id"]
-        subject = msg["subject"]
-        sender = msg["from"]["emailAddress"]["address"]
-        received = msg["receivedDateTime"]
-
-        # Limpando o corpo do e-mail
-        body = format_body(msg["body"]["content"])
-
-        # Adicionando o e-mail à lista
-        emails.append({
-            "id": msg_id,
-            "subject": subject,
-            "from": sender,
-            "receivedDateTime": received,
-            "body": body,
-        })
-
-        if mark_as_read and not msg.get("isRead", True):
-            patch_url = f"https://graph.microsoft.com/v1.0/me/messages/{msg_id}"
-            patch_data = {"isRead": True}
-            patch_response = requests.patch(patch_url, headers=headers, json=patch_data)
-            if patch_response.status_code != 200:
-                print(f"⚠️ Erro ao marcar como lido: {patch_response.status_code} - {patch_response.text}")
-            else:
-                print(f"✅ E-mail {msg_id} marcado como lido.")
-
-    print(f"📤 Processamento de e-mails concluído.")
-    return emails
+        raise GraphRequestError(response.status_code, response.text)
+    return response.json()
+
+
+def _endpoint(url):
+    """Caminho do Graph sem query e sem ids, para rotular as métricas (ex.: me/messages/{id})."""
+    path = url.split("?", 1)[0]
+    if path.startswith(GRAPH_URL):
+        path = path[len(GRAPH_URL):]
+    parts = ["{id}" if len(part) > 40 else part for part in path.strip("/").split("/")]
+    return "/".join(parts)
+
+
+def _prefetch_executor():
+    global _executor
+    if _executor is None:
+        with _session_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="graph-prefetch")
+    return _executor
+
+def get_email_bodies(message_ids: list[str], session=None):
+    """Busca o corpo completo (texto limpo) dos e-mails pedidos. Retorna {id: corpo}."""
+    mailbox = get_mailbox()
+    bodies = mailbox.bodies(message_ids) if mailbox is not None else {}
+    missing = [message_id for message_id in message_ids if message_id not in bodies]
+    if not missing:
+        return {message_id: bodies[message_id] for message_id in message_ids}
+
+    access_token = _access_token()
+    logger.info(f"📄 Buscando o conteúdo de {len(missing)} e-mail(s)...")
+    responses = graph_batch(
+        [
+            {
+                "method": "GET",
+                "url": f"/me/messages/{message_id}?$select=body",
+                "headers": {"Prefer": PREFER_TEXT_BODY},
+            }
+            for message_id in missing
+        ],
+        access_token,
+        session=session,
+    )
+    fetched = {}
+    for message_id, response in zip(missing, responses):
+        status = response.get("status") if response else None
+        if status == 200:
+            fetched[message_id] = _message_body(response["body"])
+        else:
+            logger.warning(f"⚠️ Erro ao buscar o e-mail {message_id}: {status}")
+            bodies[message_id] = f"Erro ao buscar o e-mail: {status}"
+    if mailbox is not None and fetched:
+        mailbox.store_bodies(fetched)
+    bodies.update(fetched)
+    return {message_id: bodies[message_id] for message_id in message_ids}
+
+def _message_body(msg):
+    """Corpo de uma mensagem do Graph como texto limpo (HTML só se o Prefer não foi atendido)."""
+    body = msg.get("body") or {}
+    max_chars, max_tokens = BODY_MAX_CHARS or None, BODY_MAX_TOKENS or None
+    if body.get("contentType", "text").lower() == "html":
+        return format_body(body.get("content", ""), max_chars=max_chars, max_tokens=max_tokens)
+    text = clean_text(body.get("content", ""))
+    if max_chars is not None and len(text) > max_chars:
+        text = text[:max_chars].rstrip() + "…"
+    if max_tokens is not None:
+        text = truncate_to_tokens(text, max_tokens, mark="…")
+    return text
+
+def clean_text(text):
+    """Compacta espaços de um texto puro mantendo as quebras de parágrafo."""
+    text = re.sub(r'[ \t\r\f\v\u00a0]+', ' ', text or '')
+    text = re.sub(r' ?\n ?', '\n', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+def mark_emails_as_read(message_ids: list[str], access_token=None, session=None):
+    """Marca os e-mails como lidos em lote. Retorna {id: True/False}."""
+    access_token = access_token or _access_token()
+    responses = graph_batch(
+        [{"method": "PATCH", "url": f"/me/messages/{message_id}", "body": {"isRead": True}} for message_id in message_ids],
+        access_token,
+        session=session,
+    )
+    results = {}
+    for message_id, response in zip(message_ids, responses):
+        results[message_id] = response is not None and response.get("status") == 200
+        if results[message_id]:
+            logger.debug(f"✅ E-mail {message_id} marcado como lido.")
+        else:
+            logger.warning(f"⚠️ Erro ao marcar como lido: {response and response.get('status')} - {response and response.get('body')}")
+    _write_through(lambda mailbox: mailbox.mark_read([i for i, ok in results.items() if ok]))
+    return results
 
-def delete_email_by_id(message_ids: list[str]):
-    tm = TokenManager()
-    access_token = tm.get_access_token()
+def delete_email_by_id(message_ids: list[str], session=None):
+    access_token = _access_token()
 
-    headers = {
-        "Authorization": f"Bearer {access_token}"
-    }
+    logger.info(f"🗑️ Tentando deletar {len(message_ids)} e-mail(s)...")
+    responses = graph_batch(
+        [{"method": "DELETE", "url": f"/me/messages/{message_id}"} for message_id in message_ids],
+        access_token,
+        session=session,
+    )
 
     results = {}
-
-    for message_id in message_ids:
-        url = f"https://graph.microsoft.com/v1.0/me/messages/{message_id}"
-        try:
-            print(f"🗑️ Tentando deletar e-mail: {message_id}...")
-            response = requests.delete(url, headers=headers)
-            
-            if response.status_code == 204:
-                print(f"✅ E-mail {message_id} deletado com sucesso.")
-                results[message_id] = True
-            else:
-                print(f"❌ Erro ao deletar e-mail {message_id}: {response.status_code}")
-                print(f"📄 Resposta da API: {response.text}")
-                results[message_id] = False
-
-        except requests.exceptions.RequestException as e:
-            print(f"🚨 Exceção ao tentar deletar o e-mail {message_id}: {e}")
+    for message_id, response in zip(message_ids, responses):
+        if response is not None and response.get("status") == 204:
+            logger.info(f"✅ E-mail {message_id} deletado com sucesso.")
+            results[message_id] = True
+        else:
+            logger.error(f"❌ Erro ao deletar e-mail {message_id}: {response and response.get('status')}")
+            logger.error(f"📄 Resposta da API: {response and response.get('body')}")
             results[message_id] = False
 
+    _write_through(lambda mailbox: mailbox.remove([i for i, ok in results.items() if ok]))
     return results
 
+def _write_through(update):
+    """Aplica no espelho local uma alteração já confirmada pelo Graph."""
+    mailbox = get_mailbox()
+    if mailbox is None:
+        return
+    try:
+        update(mailbox)
+    except Exception as exc:
+        # o espelho se corrige na próxima sincronização delta
+        logger.warning(f"⚠️ Falha ao atualizar o espelho local: {exc}")
 
 
 
-def format_body(html):
-    # Converte <a href="URL">texto</a> para [texto](URL)
-    def replace_link(match):
-        href = match.group(1).strip()
-        texto = match.group(2).strip()
-        return f"[{texto}]({href})"
 
-    # Converte links
-    html = re.sub(r'<a\s+[^>]*href=["\'](.*?)["\'][^>]*>(.*?)</a>', replace_link, html, flags=re.DOTALL | re.IGNORECASE)
+def format_body(html, max_chars=None, max_tokens=None):
+    """Converte o HTML de um e-mail em texto: links viram [texto](url), parágrafos são mantidos.
 
-    # Remove <style> e outras tags
-    html = re.sub(r'<style.*?>.*?</style>', '', html, flags=re.DOTALL | re.IGNORECASE)
-    html = re.sub(r'<[^>]+>', '', html)
-    html = re.sub(r'&nbsp;|&#160;', ' ', html)
-
-    # Compactação: remove espaços duplicados e linhas em branco
-    html = re.sub(r'\s+', ' ', html)               # múltiplos espaços → um espaço
-    html = re.sub(r'(\n\s*){2,}', '\n', html)       # múltiplas quebras de linha → uma
-    html = html.strip()
-
-    return html
+    max_chars / max_tokens: cortam o texto (marcado com "…") ao passar do limite
+    """
+    return html_to_text(html, max_chars=max_chars, max_tokens=max_tokens)
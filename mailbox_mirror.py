@@ -0,0 +1,225 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from conversation_storage import DB_PATH, get_storage
+
+# a mirror older than this (seconds) is synced before answering a query
+MAX_AGE_SECONDS = float(os.getenv("MAIL_MAX_AGE", "60"))
+INBOX = "inbox"
+
+# fetch_page(url) -> (items, next_link, delta_link); items are e-mail summaries
+# ({"id", "subject", "from", "receivedDateTime", "isRead", "preview"}) or
+# {"id", "removed": True} for messages that left the folder
+FetchPage = Callable[[str], Tuple[List[dict], Optional[str], Optional[str]]]
+
+
+class DeltaExpiredError(RuntimeError):
+    """The stored delta link is no longer accepted (Graph answers 410 Gone)."""
+
+
+def _row(folder: str, item: dict) -> tuple:
+    is_read = item.get("isRead")
+    return (
+        item["id"],
+        folder,
+        item.get("subject"),
+        item.get("from"),
+        item.get("receivedDateTime"),
+        None if is_read is None else int(is_read),
+        item.get("preview"),
+    )
+
+
+def _like_pattern(text: str) -> str:
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+class MailboxMirror:
+    """Local copy of one mail folder, kept current with Graph delta queries.
+
+    ``sync`` follows the pages of a delta query and stores the final
+    ``@odata.deltaLink``, so the next round only downloads what changed
+    since. Queries are answered from the local index. Bodies are not part
+    of the sync; they are cached the first time they are fetched.
+    """
+
+    def __init__(
+        self,
+        db_path: str = DB_PATH,
+        *,
+        folder: str = INBOX,
+        max_age: float = MAX_AGE_SECONDS,
+    ):
+        self.storage = get_storage(db_path)
+        self.folder = folder
+        self.max_age = max_age
+        self._sync_lock = threading.Lock()
+
+    # ====== sincronização ======
+
+    def _state(self) -> Tuple[Optional[str], Optional[float]]:
+        with self.storage.connection() as conn:
+            row = conn.execute(
+                "SELECT delta_link, synced_at FROM mail_sync WHERE folder = ?", (self.folder,)
+            ).fetchone()
+        return (row["delta_link"], row["synced_at"]) if row else (None, None)
+
+    @property
+    def synced_at(self) -> Optional[float]:
+        """Unix time the last completed sync started, or None if never synced."""
+        return self._state()[1]
+
+    def is_fresh(self) -> bool:
+        synced_at = self.synced_at
+        return synced_at is not None and time.time() - synced_at < self.max_age
+
+    def sync(self, fetch_page: FetchPage, initial_url: str) -> int:
+        """Run one delta round and return the number of changes applied.
+
+        Without a stored delta link (or when it expired) this is a full
+        round starting at ``initial_url``; messages it does not list are
+        removed from the mirror.
+        """
+        with self._sync_lock:
+            return self._sync(fetch_page, initial_url)
+
+    def ensure_fresh(self, fetch_page: FetchPage, initial_url: str) -> Optional[int]:
+        """Sync if the mirror is older than ``max_age``; None if it was fresh."""
+        with self._sync_lock:
+            # another thread may have synced while this one waited for the lock
+            if self.is_fresh():
+                return None
+            return self._sync(fetch_page, initial_url)
+
+    def _sync(self, fetch_page: FetchPage, initial_url: str) -> int:
+        delta_link, _ = self._state()
+        if delta_link is None:
+            return self._follow(fetch_page, initial_url, full=True)
+        try:
+            return self._follow(fetch_page, delta_link, full=False)
+        except DeltaExpiredError:
+            return self._follow(fetch_page, initial_url, full=True)
+
+    def _follow(self, fetch_page: FetchPage, url: str, full: bool) -> int:
+        started = time.time()
+        changes = 0
+        seen = set()
+        while url:
+            items, next_link, delta_link = fetch_page(url)
+            with self.storage.transaction() as conn:
+                changes += self._apply(conn, items)
+            seen.update(item["id"] for item in items if not item.get("removed"))
+            url = next_link
+
+        with self.storage.transaction() as conn:
+            if full:
+                changes += self._drop_unseen(conn, seen)
+            if delta_link:
+                conn.execute(
+                    """INSERT INTO mail_sync(folder, delta_link, synced_at) VALUES (?, ?, ?)
+                    ON CONFLICT(folder) DO UPDATE SET
+                        delta_link = excluded.delta_link, synced_at = excluded.synced_at""",
+                    (self.folder, delta_link, started),
+                )
+        return changes
+
+    def _apply(self, conn, items: Sequence[dict]) -> int:
+        removed = [(item["id"],) for item in items if item.get("removed")]
+        changed = [_row(self.folder, item) for item in items if not item.get("removed")]
+        conn.executemany("DELETE FROM mail_messages WHERE id = ?", removed)
+        # a delta item may carry only some fields; the missing ones keep their value
+        conn.executemany(
+            """INSERT INTO mail_messages(id, folder, subject, sender, received_at, is_read, preview)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                folder = excluded.folder,
+                subject = COALESCE(excluded.subject, subject),
+                sender = COALESCE(excluded.sender, sender),
+                received_at = COALESCE(excluded.received_at, received_at),
+                is_read = COALESCE(excluded.is_read, is_read),
+                preview = COALESCE(excluded.preview, preview)""",
+            changed,
+        )
+        return len(removed) + len(changed)
+
+    def _drop_unseen(self, conn, seen: Iterable[str]) -> int:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS mail_seen (id TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM mail_seen")
+        conn.executemany("INSERT OR IGNORE INTO mail_seen(id) VALUES (?)", ((i,) for i in seen))
+        cur = conn.execute(
+            "DELETE FROM mail_messages WHERE folder = ? AND id NOT IN (SELECT id FROM mail_seen)",
+            (self.folder,),
+        )
+        conn.execute("DELETE FROM mail_seen")
+        return cur.rowcount
+
+    # ====== consultas ======
+
+    def query(
+        self, status: str = "all", limit: int = 10, subject_keyword: Optional[str] = None
+    ) -> List[dict]:
+        """Newest messages matching the filters, shaped like ``mail.get_emails`` results."""
+        sql = (
+            "SELECT id, subject, sender, received_at, is_read, preview "
+            "FROM mail_messages WHERE folder = ?"
+        )
+        params: list = [self.folder]
+        if status == "unread":
+            sql += " AND is_read = 0"
+        elif status == "read":
+            sql += " AND is_read = 1"
+        if subject_keyword:
+            sql += " AND subject LIKE ? ESCAPE '\\'"
+            params.append(_like_pattern(subject_keyword))
+        sql += " ORDER BY received_at DESC LIMIT ?"
+        params.append(limit)
+        with self.storage.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [
+            {
+                "id": row["id"],
+                "subject": row["subject"],
+                "from": row["sender"],
+                "receivedDateTime": row["received_at"],
+                "isRead": None if row["is_read"] is None else bool(row["is_read"]),
+                "preview": row["preview"],
+            }
+            for row in rows
+        ]
+
+    def bodies(self, message_ids: Sequence[str]) -> Dict[str, str]:
+        """Cached bodies of the given messages (ids without one are left out)."""
+        if not message_ids:
+            return {}
+        marks = ",".join("?" * len(message_ids))
+        with self.storage.connection() as conn:
+            rows = conn.execute(
+                f"SELECT id, body FROM mail_messages WHERE id IN ({marks}) AND body IS NOT NULL",
+                list(message_ids),
+            ).fetchall()
+        return {row["id"]: row["body"] for row in rows}
+
+    # ====== escrita (write-through) ======
+
+    def store_bodies(self, bodies: Dict[str, str]) -> None:
+        with self.storage.transaction() as conn:
+            conn.executemany(
+                "UPDATE mail_messages SET body = ? WHERE id = ?",
+                [(body, message_id) for message_id, body in bodies.items()],
+            )
+
+    def mark_read(self, message_ids: Sequence[str], is_read: bool = True) -> None:
+        with self.storage.transaction() as conn:
+            conn.executemany(
+                "UPDATE mail_messages SET is_read = ? WHERE id = ?",
+                [(int(is_read), message_id) for message_id in message_ids],
+            )
+
+    def remove(self, message_ids: Sequence[str]) -> None:
+        with self.storage.transaction() as conn:
+            conn.executemany(
+                "DELETE FROM mail_messages WHERE id = ?", [(message_id,) for message_id in message_ids]
+            )
@@ -0,0 +1,68 @@
+"""Manutenção do conversations.db: retenção, arquivamento e vacuum.
+
+Uso:
+    python maintenance.py [--db conversations.db] [--archive-after-days 30]
+                          [--retention-days 365]
+
+Em ordem, apaga as conversas sem atualização há mais de ``RETENTION_DAYS``
+dias (0, o padrão, guarda tudo), comprime as mensagens das conversas paradas
+há mais de ``ARCHIVE_AFTER_DAYS`` dias num único blob (zstd, ou zlib sem o
+zstandard) e devolve ao disco o espaço livre. No fim mostra quanto espaço foi
+recuperado. Pode rodar com o assistente aberto; bom para um cron diário.
+"""
+import argparse
+import os
+import sys
+
+from conversation_storage import DB_PATH, ConversationStorage
+from metrics import configure_logging
+
+# conversas sem atualização há mais que isso são comprimidas; 0 desliga
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+# conversas sem atualização há mais que isso são apagadas; 0 guarda para sempre
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", "0"))
+
+
+def _size(num_bytes):
+    for unit in ("B", "KB", "MB"):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
+
+
+def _file_size(path):
+    # o WAL também ocupa disco até o checkpoint
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--archive-after-days", type=float, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--retention-days", type=float, default=RETENTION_DAYS)
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    if not os.path.exists(args.db):
+        print(f"{args.db} não existe")
+        return 1
+    file_before = _file_size(args.db)
+    storage = ConversationStorage(args.db)
+    try:
+        report = storage.maintenance(
+            archive_after_days=args.archive_after_days, retention_days=args.retention_days
+        )
+    finally:
+        storage.close()
+    file_after = _file_size(args.db)
+
+    print(f"conversas apagadas:   {report.purged}")
+    print(f"conversas arquivadas: {report.archived}")
+    print(f"banco:   {_size(report.size_before)} → {_size(report.size_after)} ({_size(report.reclaimed)} recuperados)")
+    print(f"arquivo: {_size(file_before)} → {_size(file_after)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,323 @@
+import atexit
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# ====== CONFIGURAÇÃO ======
+# LOG_LEVEL=WARNING (ou ERROR) silencia as mensagens informativas em produção
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text" (padrão) ou "json": uma linha JSON por evento, para coletores de log
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# se definido, as métricas são gravadas nesse arquivo no formato texto do Prometheus
+# (lido, por exemplo, pelo textfile collector do node_exporter)
+METRICS_FILE = os.getenv("METRICS_FILE")
+
+# limites dos buckets (segundos) dos histogramas de duração
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 35, 50, 75, 100, 200)
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in pairs
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    """Histograma com buckets fixos, uma série por combinação de labels."""
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # labels → (contagem por bucket, soma, total)
+        self._series: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(_labels(labels))
+            return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = _format_labels(labels, ("le", _format_value(bound)))
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(labels, ('le', '+Inf'))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Counter:
+    """Contador que só cresce, uma série por combinação de labels."""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._series: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._series.get(_labels(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._series.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Conjunto de métricas do processo, exportável no formato texto do Prometheus."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            elif not isinstance(metric, cls):
+                raise TypeError(f"métrica {name} já registrada como {type(metric).__name__}")
+            return metric
+
+    def histogram(self, name: str, help: str = "", buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help or f"Duração de {name}", buckets)
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        return self._get(Counter, name, help or name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        return "".join(line + "\n" for metric in metrics for line in metric.render())
+
+    def write(self, path: str) -> None:
+        # grava num temporário e troca de uma vez: quem lê nunca vê o arquivo pela
+        # metade. O nome é único, então dois processos não escrevem no mesmo temporário
+        tmp = tempfile.NamedTemporaryFile(
+            "w",
+            encoding="utf-8",
+            dir=os.path.dirname(os.path.abspath(path)),
+            prefix=f".{os.path.basename(path)}.",
+            suffix=".tmp",
+            delete=False,
+        )
+        try:
+            with tmp:
+                tmp.write(self.render())
+            # NamedTemporaryFile cria com 0600; o coletor (ex.: node_exporter) pode ser outro usuário
+            os.chmod(tmp.name, 0o644)
+            os.replace(tmp.name, path)
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
+
+
+registry = MetricsRegistry()
+
+
+# ====== LOGS ESTRUTURADOS ======
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registro, com os campos extras de ``log_event``."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legível; os campos extras vão no fim como chave=valor."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Configura o logging do processo (só se ninguém configurou antes)."""
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+def log_event(event: str, level: int = logging.INFO, **fields) -> None:
+    logger.log(level, event, extra={"fields": fields})
+
+
+# ====== SPANS ======
+
+@contextmanager
+def span(name: str, **labels) -> Iterator[dict]:
+    """Mede a duração de um trecho no histograma ``<name>_seconds``.
+
+    ``labels`` viram labels da métrica (use poucos valores distintos); o
+    dicionário devolvido recebe campos extras que só vão para o log.
+    """
+    fields: dict = {}
+    outcome = "ok"
+    start = time.perf_counter()
+    try:
+        yield fields
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        registry.histogram(f"{name}_seconds").observe(duration, outcome=outcome, **labels)
+        log_event(name, logging.DEBUG, duration_ms=round(duration * 1000, 2), outcome=outcome, **labels, **fields)
+
+
+def timed(name: str, **labels):
+    """Decorador: cada chamada da função vira um ``span(name, **labels)``."""
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# ====== TURNOS ======
+
+class TurnTimer:
+    """Tempos de um turno do chatbot: primeiro token, duração e tokens/s.
+
+    ``first_token()`` é chamado a cada pedaço (só o primeiro conta),
+    ``finish()`` no fim do streaming e ``report(tokens)`` quando a contagem
+    de tokens da resposta fica pronta.
+    """
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.started = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.outcome = "ok"
+
+    def first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def finish(self, outcome: str = "ok") -> None:
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+            self.outcome = outcome
+
+    @property
+    def ttft(self) -> Optional[float]:
+        return None if self.first_token_at is None else self.first_token_at - self.started
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.finished_at is None else self.finished_at - self.started
+
+    def tokens_per_second(self, tokens: int) -> Optional[float]:
+        if self.first_token_at is None or self.finished_at is None or self.finished_at <= self.first_token_at:
+            return None
+        return tokens / (self.finished_at - self.first_token_at)
+
+    def report(self, tokens: int) -> None:
+        self.finish()
+        labels = dict(self.labels, outcome=self.outcome)
+        registry.histogram("turn_duration_seconds", "Duração total de um turno").observe(self.duration, **labels)
+        if self.ttft is not None:
+            registry.histogram("turn_ttft_seconds", "Tempo até o primeiro token").observe(self.ttft, **labels)
+        rate = self.tokens_per_second(tokens)
+        if rate is not None:
+            registry.histogram("turn_tokens_per_second", "Tokens de saída por segundo", RATE_BUCKETS).observe(rate, **labels)
+        registry.counter("turn_output_tokens_total", "Tokens de saída gerados").inc(tokens, **labels)
+        log_event(
+            "turn",
+            ttft_ms=None if self.ttft is None else round(self.ttft * 1000, 1),
+            duration_ms=round(self.duration * 1000, 1),
+            tokens=tokens,
+            tokens_per_second=None if rate is None else round(rate, 1),
+            **labels,
+        )
+        export()
+
+
+def export() -> None:
+    """Grava as métricas em METRICS_FILE, se configurado."""
+    if not METRICS_FILE:
+        return
+    try:
+        registry.write(METRICS_FILE)
+    except OSError as exc:
+        logger.warning(f"Não foi possível gravar as métricas em {METRICS_FILE}: {exc}")
+
+
+atexit.register(export)
@@ -0,0 +1,114 @@
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Sequence
+
+# quantas medições recentes de cada backend entram nas estatísticas
+WINDOW = 20
+# acima dessa taxa de erro (com pelo menos MIN_SAMPLES medições) o backend fica de lado
+MAX_ERROR_RATE = 0.5
+MIN_SAMPLES = 3
+# depois desse tempo sem erros, um backend fora de uso volta a ser tentado (segundos)
+COOLDOWN_SECONDS = 30.0
+
+
+class BackendSnapshot(NamedTuple):
+    name: str
+    ttft: Optional[float]
+    error_rate: float
+    samples: int
+    healthy: bool
+
+
+class BackendStats:
+    """Tempo até o primeiro token e erros recentes de um backend."""
+
+    def __init__(self, window: int = WINDOW):
+        self.ttfts: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.last_error: Optional[float] = None
+
+    @property
+    def ttft(self) -> Optional[float]:
+        """Mediana dos tempos recentes (None se ainda não houve resposta)."""
+        return statistics.median(self.ttfts) if self.ttfts else None
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+
+class ModelRouter:
+    """Escolhe o backend de cada turno pelas medições recentes.
+
+    A ordem é: backends saudáveis pelo menor TTFT mediano (os ainda sem
+    medição depois dos medidos, na ordem em que foram declarados) e, por
+    último, os que estão com muitos erros. Um backend com muitos erros volta
+    a contar como saudável depois de ``cooldown`` segundos sem novos erros.
+    """
+
+    def __init__(
+        self,
+        names: Sequence[str],
+        *,
+        window: int = WINDOW,
+        max_error_rate: float = MAX_ERROR_RATE,
+        min_samples: int = MIN_SAMPLES,
+        cooldown: float = COOLDOWN_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not names:
+            raise ValueError("ModelRouter precisa de pelo menos um backend")
+        self.names = list(names)
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self._clock = clock
+        self._stats: Dict[str, BackendStats] = {name: BackendStats(window) for name in self.names}
+        self._lock = threading.Lock()
+
+    def _healthy(self, stats: BackendStats, now: float) -> bool:
+        if len(stats.outcomes) < self.min_samples or stats.error_rate <= self.max_error_rate:
+            return True
+        return stats.last_error is not None and now - stats.last_error >= self.cooldown
+
+    def ranked(self) -> List[str]:
+        """Nomes dos backends, do preferido ao último recurso."""
+        now = self._clock()
+        with self._lock:
+            def key(item):
+                index, name = item
+                stats = self._stats[name]
+                ttft = stats.ttft
+                return (not self._healthy(stats, now), ttft is None, ttft or 0.0, index)
+
+            return [name for _, name in sorted(enumerate(self.names), key=key)]
+
+    def record_success(self, name: str, ttft: float) -> None:
+        with self._lock:
+            stats = self._stats[name]
+            stats.ttfts.append(ttft)
+            stats.outcomes.append(True)
+
+    def record_error(self, name: str) -> None:
+        with self._lock:
+            stats = self._stats[name]
+            stats.outcomes.append(False)
+            stats.last_error = self._clock()
+
+    def snapshot(self) -> List[BackendSnapshot]:
+        now = self._clock()
+        with self._lock:
+            return [
+                BackendSnapshot(
+                    name,
+                    self._stats[name].ttft,
+                    self._stats[name].error_rate,
+                    len(self._stats[name].outcomes),
+                    self._healthy(self._stats[name], now),
+                )
+                for name in self.names
+            ]
@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import time
+from contextlib import suppress
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage, message_chunk_to_message
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+from model_router import ModelRouter
+
+logger = logging.getLogger(__name__)
+
+# tempo máximo esperando o primeiro token de um backend antes de passar ao próximo (segundos)
+FIRST_TOKEN_TIMEOUT = 30.0
+
+_EMPTY = object()
+
+
+async def _first_chunk(stream):
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return _EMPTY
+
+
+async def _discard(task, stream):
+    # cancela uma tentativa que perdeu (ou estourou o tempo) e fecha a conexão dela
+    task.cancel()
+    with suppress(BaseException):
+        await task
+    with suppress(Exception):
+        await stream.aclose()
+
+
+class RouterChatModel(BaseChatModel):
+    """Modelo de chat que distribui cada turno entre vários backends.
+
+    ``backends`` mapeia um nome para um modelo de chat (ChatOllama,
+    ChatOpenAI...). A cada turno o ``router`` (ModelRouter) dá a ordem dos
+    backends pelo TTFT recente e pela taxa de erro; o turno vai para o
+    primeiro, e passa para o seguinte se ele falhar ou não mandar o primeiro
+    token em ``first_token_timeout`` segundos. Com ``hedge_after``, se o
+    primeiro token não chegou nesse prazo, o próximo backend é iniciado em
+    paralelo e fica a resposta de quem responder primeiro; o outro é cancelado.
+
+    Timeout e hedge valem para o caminho assíncrono (astream/ainvoke, usado
+    pelo app); no síncrono só há failover em caso de erro.
+    """
+
+    backends: Dict[str, Any]
+    router: ModelRouter
+    first_token_timeout: float = FIRST_TOKEN_TIMEOUT
+    hedge_after: Optional[float] = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @classmethod
+    def from_backends(cls, backends: Dict[str, Any], **kwargs) -> "RouterChatModel":
+        router_options = {
+            key: kwargs.pop(key)
+            for key in ("window", "max_error_rate", "min_samples", "cooldown")
+            if key in kwargs
+        }
+        return cls(backends=backends, router=ModelRouter(list(backends), **router_options), **kwargs)
+
+    @property
+    def _llm_type(self) -> str:
+        return "router"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"backends": list(self.backends), "hedge_after": self.hedge_after}
+
+    def bind_tools(self, tools, **kwargs) -> "RouterChatModel":
+        # cada backend recebe as ferramentas; as estatísticas continuam compartilhadas
+        return self.model_copy(
+            update={"backends": {name: chat.bind_tools(tools, **kwargs) for name, chat in self.backends.items()}}
+        )
+
+    # ====== CAMINHO SÍNCRONO ======
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        if stop is not None:
+            kwargs["stop"] = stop
+        error = None
+        for name in self.router.ranked():
+            started = time.monotonic()
+            stream = iter(self.backends[name].stream(messages, **kwargs))
+            try:
+                first = next(stream, _EMPTY)
+            except Exception as exc:
+                logger.warning(f"⚠️ Backend {name} falhou: {exc}")
+                self.router.record_error(name)
+                error = exc
+                continue
+            self.router.record_success(name, time.monotonic() - started)
+            if first is _EMPTY:
+                return
+            for chunk in _chain(first, stream):
+                generation = ChatGenerationChunk(message=chunk)
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.content, chunk=generation)
+                yield generation
+            return
+        raise error
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return _to_result(self._stream(messages, stop, run_manager, **kwargs))
+
+    # ====== CAMINHO ASSÍNCRONO ======
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        if stop is not None:
+            kwargs["stop"] = stop
+        waiting = self.router.ranked()
+        # tentativa em andamento: task do primeiro pedaço → (nome, stream, início)
+        attempts: Dict[asyncio.Task, tuple] = {}
+        hedged = False
+        error: Optional[BaseException] = None
+
+        def start_next():
+            name = waiting.pop(0)
+            stream = self.backends[name].astream(messages, **kwargs)
+            attempts[asyncio.ensure_future(_first_chunk(stream))] = (name, stream, time.monotonic())
+
+        start_next()
+        winner = None
+        try:
+            while attempts and winner is None:
+                now = time.monotonic()
+                deadline = min(started + self.first_token_timeout for _, _, started in attempts.values())
+                if self.hedge_after is not None and waiting and not hedged:
+                    last_start = max(started for _, _, started in attempts.values())
+                    deadline = min(deadline, last_start + self.hedge_after)
+                done, _ = await asyncio.wait(
+                    attempts, timeout=max(0.0, deadline - now), return_when=asyncio.FIRST_COMPLETED
+                )
+
+                for task in done:
+                    name, stream, started = attempts.pop(task)
+                    if winner is None and task.exception() is None:
+                        winner = (name, stream, task.result(), started)
+                        continue
+                    if task.exception() is not None:
+                        error = task.exception()
+                        logger.warning(f"⚠️ Backend {name} falhou: {error}")
+                        self.router.record_error(name)
+                        with suppress(Exception):
+                            await stream.aclose()
+                        if waiting and not attempts:
+                            start_next()
+                    else:
+                        await _discard(task, stream)
+                if winner is not None:
+                    break
+
+                now = time.monotonic()
+                for task, (name, stream, started) in list(attempts.items()):
+                    if now - started >= self.first_token_timeout:
+                        del attempts[task]
+                        await _discard(task, stream)
+                        logger.warning(f"⏱️ Backend {name} não respondeu em {self.first_token_timeout:.0f}s")
+                        self.router.record_error(name)
+                        error = TimeoutError(f"backend {name} sem resposta em {self.first_token_timeout}s")
+                        if waiting:
+                            start_next()
+                if (
+                    self.hedge_after is not None and waiting and not hedged and attempts
+                    and now - max(started for _, _, started in attempts.values()) >= self.hedge_after
+                ):
+                    hedged = True
+                    start_next()
+        finally:
+            for task, (_, stream, _) in list(attempts.items()):
+                await _discard(task, stream)
+
+        if winner is None:
+            raise error or RuntimeError("nenhum backend disponível")
+
+        name, stream, first, started = winner
+        self.router.record_success(name, time.monotonic() - started)
+        if first is _EMPTY:
+            return
+        try:
+            chunk = first
+            while True:
+                generation = ChatGenerationChunk(message=chunk)
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.content, chunk=generation)
+                yield generation
+                try:
+                    chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+        finally:
+            with suppress(Exception):
+                await stream.aclose()
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        chunks = [chunk async for chunk in self._astream(messages, stop, run_manager, **kwargs)]
+        return _to_result(chunks)
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+def _to_result(chunks) -> ChatResult:
+    message = None
+    for chunk in chunks:
+        message = chunk.message if message is None else message + chunk.message
+    message = message or AIMessageChunk(content="")
+    return ChatResult(generations=[ChatGeneration(message=message_chunk_to_message(message))])
@@ -0,0 +1,322 @@
+"""Servidor HTTP do assistente, sem interface (para outros frontends e testes de carga).
+
+Uso:
+    python server.py [--host 127.0.0.1] [--port 8080]
+
+Rotas:
+  POST   /conversations                     cria uma conversa → {"thread_id"}
+  GET    /conversations?limit=&cursor=      lista, mais recentes primeiro
+  GET    /conversations/search?q=&limit=    busca por título ou conteúdo
+  GET    /conversations/{id}?limit=&before= janela de mensagens
+  PATCH  /conversations/{id}                {"title": "..."} renomeia
+  DELETE /conversations/{id}                apaga
+  POST   /conversations/{id}/messages       {"content": "..."} → resposta em SSE
+  GET    /health, GET /metrics              estado da fila; métricas (Prometheus)
+
+A resposta de uma mensagem é um stream SSE com os eventos ``queued``
+({"position"}), enquanto espera a vez; ``start``; ``token`` ({"text"});
+``sources`` (lista de fontes); e por fim ``done`` ({"text", "sources"}) ou
+``error``. Cada backend tem um limite de turnos simultâneos
+(SERVER_CONCURRENCY; no MODE=router, a soma dos provedores roteados, pois
+o provedor só é escolhido dentro do modelo) e uma fila justa entre clientes (cabeçalho X-Client-Id
+ou o IP); com a fila cheia a resposta é 429 com Retry-After. Se o cliente
+desconectar, a geração é cancelada.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import aclosing
+
+from aiohttp import web
+
+from admission import MAX_QUEUE, AdmissionController, Overloaded
+from background_tasks import heuristic_title
+from conversation_storage import DB_PATH, LazySources, get_storage
+from metrics import configure_logging, registry
+
+logger = logging.getLogger(__name__)
+
+HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+PORT = int(os.getenv("SERVER_PORT", "8080"))
+# turnos simultâneos por backend: o Ollama local processa poucos pedidos por vez;
+# sem "router=N", o MODE=router soma os limites dos provedores roteados
+CONCURRENCY = os.getenv("SERVER_CONCURRENCY", "local=2,openrouter=8")
+DEFAULT_CONCURRENCY = 2
+QUEUE_SIZE = int(os.getenv("SERVER_MAX_QUEUE", str(MAX_QUEUE)))
+
+
+def parse_concurrency(spec):
+    """Converte "local=2,openrouter=8" em {"local": 2, "openrouter": 8}."""
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            limits[name.strip()] = int(value)
+    return limits
+
+
+def _int_param(request, name, default, minimum):
+    """Inteiro da query string; valor inválido vira 400, não 500."""
+    raw = request.query.get(name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} deve ser um número inteiro")
+    if value < minimum:
+        raise web.HTTPBadRequest(text=f"{name} deve ser pelo menos {minimum}")
+    return value
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _json_message(message):
+    data = dict(message)
+    if isinstance(data.get("sources"), LazySources):
+        data["sources"] = data["sources"].value
+    return data
+
+
+class AssistantServer:
+    """Rotas HTTP sobre o ``achatbot`` e o ``conversation_storage``.
+
+    ``chatbot``, ``backend`` e ``router_backends`` existem para testes; por
+    padrão são o ``achatbot``, o MODE e os ROUTER_BACKENDS do agente_graph
+    (importado só aqui).
+    """
+
+    def __init__(
+        self,
+        chatbot=None,
+        *,
+        backend=None,
+        router_backends=(),
+        limits=None,
+        max_queue=QUEUE_SIZE,
+        db_path=DB_PATH,
+    ):
+        if chatbot is None:
+            from agente_graph import MODE, ROUTER_BACKENDS, achatbot, warm_up
+
+            chatbot, backend = achatbot, backend or MODE
+            router_backends = router_backends or ROUTER_BACKENDS
+            warm_up()
+        self.chatbot = chatbot
+        self.backend = backend or "local"
+        limits = parse_concurrency(CONCURRENCY) if limits is None else limits
+        if self.backend == "router" and "router" not in limits and router_backends:
+            # o RouterChatModel escolhe o provedor de cada turno (e pode trocar no meio),
+            # então a fila só limita o total: a soma do que os provedores aguentam
+            self.max_concurrent = sum(limits.get(name, DEFAULT_CONCURRENCY) for name in router_backends)
+        else:
+            self.max_concurrent = limits.get(self.backend, DEFAULT_CONCURRENCY)
+        self.max_queue = max_queue
+        self.storage = get_storage(db_path)
+        self.admission = None
+        # conversas com um turno em andamento: um segundo turno na mesma conversa é recusado
+        self._busy = set()
+
+    def app(self):
+        app = web.Application()
+        app.on_startup.append(self._on_startup)
+        app.add_routes([
+            web.get("/health", self.health),
+            web.get("/metrics", self.metrics),
+            web.post("/conversations", self.create_conversation),
+            web.get("/conversations", self.list_conversations),
+            web.get("/conversations/search", self.search_conversations),
+            web.get("/conversations/{thread_id}", self.get_conversation),
+            web.patch("/conversations/{thread_id}", self.rename_conversation),
+            web.delete("/conversations/{thread_id}", self.delete_conversation),
+            web.post("/conversations/{thread_id}/messages", self.post_message),
+        ])
+        return app
+
+    async def _on_startup(self, app):
+        # a fila usa o event loop do servidor, então nasce junto com ele
+        self.admission = AdmissionController(
+            self.backend, max_concurrent=self.max_concurrent, max_queue=self.max_queue
+        )
+
+    # ====== ESTADO ======
+
+    async def health(self, request):
+        stats = self.admission.stats
+        return web.json_response({"status": "ok", "backend": self.backend, **stats._asdict()})
+
+    async def metrics(self, request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    # ====== CONVERSAS ======
+
+    async def create_conversation(self, request):
+        return web.json_response({"thread_id": str(uuid.uuid4())}, status=201)
+
+    async def list_conversations(self, request):
+        limit = _int_param(request, "limit", 20, minimum=1)
+        cursor = tuple(request.query["cursor"].split("|", 1)) if "cursor" in request.query else None
+        if cursor is not None and len(cursor) != 2:
+            raise web.HTTPBadRequest(text="cursor inválido")
+        page = await asyncio.to_thread(self.storage.list_conversations_page, limit=limit, cursor=cursor)
+        return web.json_response({
+            "items": [item._asdict() for item in page.items],
+            "next_cursor": "|".join(page.next_cursor) if page.next_cursor else None,
+        })
+
+    async def search_conversations(self, request):
+        limit = _int_param(request, "limit", 20, minimum=1)
+        rows = await asyncio.to_thread(
+            self.storage.search_conversations, request.query.get("q", ""), snippets=True, limit=limit
+        )
+        return web.json_response(
+            [{"thread_id": tid, "title": title, "snippet": snippet} for tid, title, snippet in rows]
+        )
+
+    async def get_conversation(self, request):
+        window = await asyncio.to_thread(
+            self.storage.load_conversation_window,
+            request.match_info["thread_id"],
+            limit=_int_param(request, "limit", 50, minimum=1),
+            before_seq=_int_param(request, "before", None, minimum=0),
+        )
+        return web.json_response({
+            "messages": [_json_message(m) for m in window.messages],
+            "start_seq": window.start_seq,
+            "has_older": window.has_older,
+        })
+
+    async def rename_conversation(self, request):
+        body = await self._json_body(request)
+        if not isinstance(body.get("title"), str) or not body["title"].strip():
+            raise web.HTTPBadRequest(text='informe {"title": "..."}')
+        updated = await asyncio.to_thread(
+            self.storage.rename_conversation, request.match_info["thread_id"], body["title"].strip()
+        )
+        if not updated:
+            raise web.HTTPNotFound()
+        return web.json_response({"title": body["title"].strip()})
+
+    async def delete_conversation(self, request):
+        thread_id = request.match_info["thread_id"]
+        if thread_id in self._busy:
+            return web.json_response({"error": "turno em andamento nesta conversa"}, status=409)
+        await asyncio.to_thread(self.storage.delete_conversation, thread_id)
+        return web.Response(status=204)
+
+    # ====== TURNOS ======
+
+    async def post_message(self, request):
+        thread_id = request.match_info["thread_id"]
+        body = await self._json_body(request)
+        content = body.get("content")
+        if not isinstance(content, str) or not content.strip():
+            raise web.HTTPBadRequest(text='informe {"content": "..."}')
+        if thread_id in self._busy:
+            return web.json_response({"error": "turno em andamento nesta conversa"}, status=409)
+
+        client = request.headers.get("X-Client-Id") or request.remote or "anon"
+        try:
+            ticket = self.admission.enqueue(client)
+        except Overloaded as exc:
+            registry.counter("admission_rejected_total", "Pedidos recusados com a fila cheia").inc(backend=self.backend)
+            logger.warning(f"🚦 Fila do backend {self.backend} cheia; pedido de {client} recusado")
+            return web.json_response(
+                {"error": str(exc), "backend": exc.backend, "retry_after": exc.retry_after},
+                status=429,
+                headers={"Retry-After": str(exc.retry_after)},
+            )
+
+        self._busy.add(thread_id)
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+        user_message = {"role": "user", "content": content}
+        try:
+            await response.prepare(request)
+            queued_at = time.perf_counter()
+            await self.admission.wait(
+                ticket,
+                lambda position: response.write(_sse("queued", {"position": position, "backend": self.backend})),
+            )
+            registry.histogram("admission_wait_seconds", "Espera na fila do servidor").observe(
+                time.perf_counter() - queued_at, backend=self.backend
+            )
+            await response.write(_sse("start", {}))
+
+            text, sources = [], []
+            async with aclosing(self.chatbot(user_message, thread_id)) as stream:
+                async for chunk in stream:
+                    if isinstance(chunk, list):
+                        sources = chunk
+                        await response.write(_sse("sources", chunk))
+                    else:
+                        text.append(chunk)
+                        await response.write(_sse("token", {"text": chunk}))
+
+            answer = {"role": "assistant", "content": "".join(text)}
+            if sources:
+                answer["sources"] = sources
+            await asyncio.to_thread(self._save_turn, thread_id, user_message, answer)
+            await response.write(_sse("done", {"text": answer["content"], "sources": sources}))
+        except (ConnectionResetError, asyncio.CancelledError) as exc:
+            # o aclosing já fechou o achatbot, que cancela a geração no modelo
+            logger.info(f"🔌 Cliente desconectou; turno da conversa {thread_id} cancelado")
+            if isinstance(exc, asyncio.CancelledError):
+                raise
+        except asyncio.TimeoutError:
+            await self._send_error(response, "tempo máximo do turno esgotado")
+        except Exception as exc:
+            logger.exception(f"❌ Erro no turno da conversa {thread_id}")
+            await self._send_error(response, str(exc))
+        finally:
+            self.admission.release(ticket)
+            self._busy.discard(thread_id)
+        return response
+
+    def _save_turn(self, thread_id, user_message, answer):
+        window = self.storage.load_conversation_window(thread_id, limit=1)
+        stored = window.start_seq + len(window.messages)
+        messages = [user_message, answer]
+        title = heuristic_title(messages) if stored == 0 else None
+        self.storage.append_messages(thread_id, messages, expected_seq=stored, title=title)
+
+    @staticmethod
+    async def _send_error(response, message):
+        try:
+            await response.write(_sse("error", {"error": message}))
+        except ConnectionResetError:
+            pass
+
+    @staticmethod
+    async def _json_body(request):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text="corpo JSON inválido")
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text="corpo JSON inválido")
+        return body
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor HTTP do assistente")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    # handler_cancellation: cliente que desconecta cancela o handler (e a geração)
+    web.run_app(AssistantServer().app(), host=args.host, port=args.port, handler_cancellation=True)
+
+
+if __name__ == "__main__":
+    main()
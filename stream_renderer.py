@@ -0,0 +1,85 @@
+import time
+from typing import Callable, List, NamedTuple
+
+# intervalo mínimo entre duas atualizações da tela (segundos)
+FLUSH_INTERVAL = 0.1
+# atualiza antes do intervalo se acumular esse tanto de texto novo
+FLUSH_CHARS = 400
+
+
+class RenderStats(NamedTuple):
+    chunks: int
+    chars: int
+    flushes: int
+    bytes_sent: int
+
+
+class StreamRenderer:
+    """Mostra uma resposta em streaming sem redesenhar a cada token.
+
+    Os pedaços ficam numa lista e só são juntados numa atualização, que
+    acontece quando passou ``interval`` segundos desde a anterior ou quando
+    chegaram ``min_chars`` caracteres novos. ``close()`` (ou o fim do bloco
+    ``with``) sempre faz a última atualização.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[str], object],
+        *,
+        interval: float = FLUSH_INTERVAL,
+        min_chars: int = FLUSH_CHARS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._write = write
+        self.interval = interval
+        self.min_chars = min_chars
+        self._clock = clock
+        self._text = ""
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self._last_flush = clock()
+        self._chunks = 0
+        self._flushes = 0
+        self._bytes_sent = 0
+
+    def add(self, chunk: str) -> None:
+        if not chunk:
+            return
+        self._pending.append(chunk)
+        self._pending_chars += len(chunk)
+        self._chunks += 1
+        if (
+            self._pending_chars >= self.min_chars
+            or self._clock() - self._last_flush >= self.interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        self._text += "".join(self._pending)
+        self._pending.clear()
+        self._pending_chars = 0
+        self._write(self._text)
+        self._last_flush = self._clock()
+        self._flushes += 1
+        self._bytes_sent += len(self._text.encode("utf-8"))
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "StreamRenderer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def text(self) -> str:
+        """Tudo o que foi recebido, inclusive o que ainda não foi mostrado."""
+        return self._text + "".join(self._pending)
+
+    @property
+    def stats(self) -> RenderStats:
+        return RenderStats(self._chunks, len(self.text), self._flushes, self._bytes_sent)
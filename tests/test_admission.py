@@ -0,0 +1,106 @@
+import sys
+import pathlib
+import asyncio
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import pytest
+
+from admission import AdmissionController, Overloaded
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def settle():
+    # deixa as tarefas que esperam a fila acordarem e recalcularem a posição
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_admits_up_to_the_limit_then_queues_and_rejects():
+    async def scenario():
+        controller = AdmissionController("local", max_concurrent=2, max_queue=1)
+        first, second = controller.enqueue("a"), controller.enqueue("b")
+        assert first.admitted.done() and second.admitted.done()
+
+        third = controller.enqueue("c")
+        assert not third.admitted.done()
+        assert controller.position(third) == 1
+        with pytest.raises(Overloaded) as exc:
+            controller.enqueue("d")
+        assert exc.value.retry_after >= 1
+
+        controller.release(first)
+        assert third.admitted.done()
+        assert controller.stats == (2, 0, 2, 1)
+
+    run(scenario())
+
+
+def test_queue_is_round_robin_between_clients():
+    async def scenario():
+        controller = AdmissionController("local", max_concurrent=1, max_queue=10)
+        running = controller.enqueue("x")
+        flood = [controller.enqueue("a") for _ in range(3)]
+        other = controller.enqueue("b")
+
+        # "b" chegou depois dos três de "a", mas passa na frente de dois deles
+        assert [controller.position(t) for t in flood] == [1, 3, 4]
+        assert controller.position(other) == 2
+
+        order = []
+        current = running
+        for _ in range(4):
+            controller.release(current)
+            current = next(t for t in flood + [other] if t.admitted.done() and t not in order)
+            order.append(current)
+        assert order == [flood[0], other, flood[1], flood[2]]
+
+    run(scenario())
+
+
+def test_waiters_get_position_updates_and_leaving_frees_the_place():
+    async def scenario():
+        controller = AdmissionController("local", max_concurrent=1, max_queue=5)
+        running = controller.enqueue("x")
+        positions = []
+
+        async def report(position):
+            positions.append(position)
+
+        ahead = controller.enqueue("a")
+        waiter = asyncio.create_task(controller.wait(controller.enqueue("b"), report))
+        await settle()
+        assert positions == [2]
+
+        controller.release(ahead)  # desistiu antes da vez
+        await settle()
+        assert positions == [2, 1]
+
+        controller.release(running)
+        await asyncio.wait_for(waiter, 1)
+        assert controller.stats.running == 1 and controller.stats.waiting == 0
+
+    run(scenario())
+
+
+def test_admit_context_releases_on_cancel():
+    async def scenario():
+        controller = AdmissionController("local", max_concurrent=1, max_queue=5)
+        entered = asyncio.Event()
+
+        async def turn():
+            async with controller.admit("a"):
+                entered.set()
+                await asyncio.sleep(10)
+
+        task = asyncio.create_task(turn())
+        await entered.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert controller.stats.running == 0
+
+    run(scenario())
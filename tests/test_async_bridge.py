@@ -0,0 +1,132 @@
+import sys
+import time
+import asyncio
+import pathlib
+import threading
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import async_bridge
+from async_bridge import BackgroundLoop
+
+
+@pytest.fixture
+def loop():
+    bg = BackgroundLoop("test-loop")
+    yield bg
+    bg.stop()
+
+
+def test_iterate_yields_items_in_order(loop):
+    async def gen():
+        for i in range(3):
+            await asyncio.sleep(0)
+            yield i
+
+    assert list(loop.iterate(gen())) == [0, 1, 2]
+
+
+def test_iterate_propagates_errors(loop):
+    async def gen():
+        yield "a"
+        raise ValueError("falhou")
+
+    it = loop.iterate(gen())
+    assert next(it) == "a"
+    with pytest.raises(ValueError):
+        next(it)
+
+
+def test_closing_consumer_cancels_producer(loop):
+    closed = threading.Event()
+
+    async def gen():
+        try:
+            while True:
+                yield "x"
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+
+    it = loop.iterate(gen())
+    assert next(it) == "x"
+    it.close()
+    assert closed.wait(timeout=5)
+
+
+def test_many_streams_share_one_loop(loop):
+    async def slow(n):
+        await asyncio.sleep(0.2)
+        yield n
+
+    start = time.monotonic()
+    futures = [loop.submit(asyncio.sleep(0.2)) for _ in range(20)]
+    for f in futures:
+        f.result(timeout=5)
+    assert list(loop.iterate(slow(1))) == [1]
+    # 20 esperas concorrentes no mesmo loop não somam os tempos
+    assert time.monotonic() - start < 2
+
+
+def test_consumer_does_not_hang_when_producer_or_loop_dies(loop, monkeypatch):
+    monkeypatch.setattr(async_bridge, "POLL_SECONDS", 0.05)
+
+    async def forever():
+        yield "x"
+        await asyncio.sleep(3600)
+        yield "nunca"
+
+    # tarefa cancelada dentro do loop, sem passar pelo consumidor
+    it = loop.iterate(forever())
+    assert next(it) == "x"
+    loop.loop.call_soon_threadsafe(lambda: [task.cancel() for task in asyncio.all_tasks(loop.loop)])
+    with pytest.raises(RuntimeError):
+        next(it)
+
+    # loop parado no meio da geração
+    it = loop.iterate(forever())
+    assert next(it) == "x"
+    dead = loop.loop
+    loop.stop()
+    with pytest.raises(RuntimeError):
+        next(it)
+    # encerra a tarefa que ficou no loop parado
+    for task in asyncio.all_tasks(dead):
+        task.cancel()
+    dead.run_until_complete(asyncio.sleep(0.05))
+    dead.close()
+
+
+def test_with_deadline_times_out_and_closes_the_stream():
+    closed = []
+
+    async def slow():
+        try:
+            yield "a"
+            await asyncio.sleep(3600)
+            yield "b"
+        finally:
+            closed.append(True)
+
+    async def consume():
+        items = []
+        with pytest.raises(asyncio.TimeoutError):
+            async for item in async_bridge.with_deadline(slow(), 0.1):
+                items.append(item)
+        return items
+
+    assert asyncio.run(consume()) == ["a"]
+    assert closed == [True]
+
+
+def test_with_deadline_passes_through_a_finished_stream():
+    async def quick():
+        for i in range(3):
+            yield i
+
+    async def consume():
+        return [item async for item in async_bridge.with_deadline(quick(), 5)]
+
+    assert asyncio.run(consume()) == [0, 1, 2]
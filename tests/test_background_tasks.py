@@ -0,0 +1,82 @@
+import sys
+import time
+import pathlib
+import threading
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from background_tasks import PostTurnWorker, heuristic_title
+
+
+def test_tasks_with_same_key_run_in_order():
+    worker = PostTurnWorker(workers=3)
+    done = []
+
+    def task(n):
+        time.sleep(0.001 * (5 - n % 5))
+        done.append(n)
+
+    for n in range(20):
+        worker.submit("conversa", task, n)
+    worker.wait("conversa", timeout=5)
+    assert done == list(range(20))
+    worker.shutdown()
+
+
+def test_shutdown_drains_pending_tasks():
+    worker = PostTurnWorker(workers=1)
+    release = threading.Event()
+    done = []
+    worker.submit("a", release.wait, 5)
+    for n in range(5):
+        worker.submit("a", done.append, n)
+    assert worker.pending >= 4
+
+    release.set()
+    worker.shutdown(wait=True, timeout=5)
+    assert done == [0, 1, 2, 3, 4]
+
+
+def test_failed_task_does_not_stop_worker():
+    worker = PostTurnWorker(workers=1)
+    failed = worker.submit("a", lambda: 1 / 0)
+    ok = worker.submit("a", lambda: "ok")
+    assert ok.result(timeout=5) == "ok"
+    assert isinstance(failed.exception(), ZeroDivisionError)
+    worker.shutdown()
+
+
+def test_slow_title_does_not_hold_the_save_lane():
+    saves = PostTurnWorker(workers=1)
+    titles = PostTurnWorker(workers=1)
+    release = threading.Event()
+    done = []
+
+    def refine(key):
+        release.wait(5)
+        saves.submit(key, done.append, "rename")
+
+    saves.submit("a", done.append, "save")
+    titles.submit("a", refine, "a")
+    saves.submit("b", done.append, "save b")
+    # o wait da barra lateral não espera a chamada ao LLM
+    saves.wait("a", timeout=1)
+    saves.wait("b", timeout=1)
+    assert done == ["save", "save b"]
+
+    release.set()
+    titles.wait("a", timeout=5)
+    saves.wait("a", timeout=5)
+    assert done == ["save", "save b", "rename"]
+    titles.shutdown()
+    saves.shutdown()
+
+
+def test_heuristic_title():
+    messages = [
+        {"role": "user", "content": "  quais são os meus e-mails não lidos de hoje?"},
+        {"role": "assistant", "content": "..."},
+    ]
+    assert heuristic_title(messages) == "Quais são os meus e-mails…"
+    assert heuristic_title([{"role": "user", "content": "oi!"}]) == "Oi"
+    assert heuristic_title([]) == "Nova conversa"
@@ -0,0 +1,88 @@
+import sys
+import pathlib
+
+import pytest
+
+pytest.importorskip("langgraph")
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.prebuilt import create_react_agent
+
+from checkpoint_storage import SQLiteCheckpointSaver, ensure_thread_state
+from conversation_storage import save_conversation, load_conversation
+
+
+class FakeChat(FakeMessagesListChatModel):
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+def make_agent(saver, n_replies=10):
+    model = FakeChat(responses=[AIMessage(content=f"resposta {i}") for i in range(n_replies)])
+    return create_react_agent(model=model, tools=[], checkpointer=saver)
+
+
+def ask(agent, thread_id, text):
+    config = {"configurable": {"thread_id": thread_id}}
+    return agent.invoke({"messages": [HumanMessage(content=text)]}, config)
+
+
+def test_state_survives_a_new_saver(tmp_path):
+    path = str(tmp_path / "conv.db")
+    ask(make_agent(SQLiteCheckpointSaver(path)), "t1", "oi")
+
+    agent = make_agent(SQLiteCheckpointSaver(path))
+    state = agent.get_state({"configurable": {"thread_id": "t1"}})
+    assert [m.content for m in state.values["messages"]] == ["oi", "resposta 0"]
+
+    result = ask(agent, "t1", "de novo")
+    assert [m.content for m in result["messages"]] == ["oi", "resposta 0", "de novo", "resposta 0"]
+
+
+def test_keeps_only_last_checkpoints(tmp_path):
+    path = str(tmp_path / "conv.db")
+    saver = SQLiteCheckpointSaver(path, keep_last=2)
+    agent = make_agent(saver)
+    for i in range(4):
+        ask(agent, "t1", f"pergunta {i}")
+
+    config = {"configurable": {"thread_id": "t1"}}
+    assert len(list(saver.list(config))) == 2
+    messages = agent.get_state(config).values["messages"]
+    assert len(messages) == 8
+
+    with saver.storage.connection() as conn:
+        versions = conn.execute(
+            "SELECT COUNT(*) FROM checkpoint_blobs WHERE channel='messages'"
+        ).fetchone()[0]
+    assert versions <= 2
+
+
+def test_idle_threads_leave_the_cache(tmp_path):
+    saver = SQLiteCheckpointSaver(str(tmp_path / "conv.db"), idle_seconds=0)
+    agent = make_agent(saver)
+    ask(agent, "t1", "oi")
+    agent.get_state({"configurable": {"thread_id": "t1"}})
+    saver.evict_idle()
+    assert not saver._hot
+    assert agent.get_state({"configurable": {"thread_id": "t1"}}).values["messages"]
+
+
+def test_rehydrates_thread_from_stored_messages(tmp_path):
+    path = str(tmp_path / "conv.db")
+    save_conversation(
+        "old",
+        [{"role": "user", "content": "oi"}, {"role": "assistant", "content": "olá", "sources": []}],
+        db_path=path,
+    )
+    agent = make_agent(SQLiteCheckpointSaver(path))
+    config = {"configurable": {"thread_id": "old"}}
+
+    assert ensure_thread_state(agent, config, lambda tid: load_conversation(tid, db_path=path))
+    assert not ensure_thread_state(agent, config, lambda tid: load_conversation(tid, db_path=path))
+
+    result = ask(agent, "old", "lembra?")
+    assert [m.content for m in result["messages"]] == ["oi", "olá", "lembra?", "resposta 0"]
@@ -1,5 +1,10 @@
 import sys
+import sqlite3
 import pathlib
+import threading
+from datetime import datetime, timedelta
+
+import pytest
 
 sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
 
@@ -10,7 +15,14 @@ from conversation_storage import (
     delete_conversation,
     rename_conversation,
     search_conversations,
+    append_messages,
+    ConversationConflictError,
+    ConversationStorage,
+    list_conversations_page,
+    load_conversation_window,
+    LazySources,
 )
+import conversation_storage
 
 
 def test_save_and_load(tmp_path, monkeypatch):
@@ -55,3 +67,297 @@ def test_search_conversations(tmp_path):
     res = search_conversations("outra", db_path=str(path))
     assert (tid2, "outro") in res and (tid1, "saudações") not in res
 
+
+
+def test_save_appends_only_new_messages(tmp_path):
+    path = str(tmp_path / "conv.db")
+    tid = "t-append"
+    msgs = [{"role": "user", "content": "oi"}, {"role": "assistant", "content": "olá", "sources": []}]
+    save_conversation(tid, msgs, db_path=path)
+
+    conn = sqlite3.connect(path)
+    first_ids = [r[0] for r in conn.execute("SELECT id FROM messages ORDER BY seq")]
+
+    msgs = msgs + [{"role": "user", "content": "tudo bem?"}]
+    save_conversation(tid, msgs, db_path=path)
+    rows = conn.execute("SELECT id, seq FROM messages ORDER BY seq").fetchall()
+    conn.close()
+
+    # stored rows are kept and only the new message is inserted
+    assert [r[0] for r in rows[:2]] == first_ids
+    assert [r[1] for r in rows] == [0, 1, 2]
+    assert load_conversation(tid, db_path=path) == msgs
+
+
+def test_save_rewrites_edited_history(tmp_path):
+    path = str(tmp_path / "conv.db")
+    tid = "t-edit"
+    save_conversation(tid, [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}], db_path=path)
+
+    edited = [{"role": "user", "content": "x"}]
+    save_conversation(tid, edited, db_path=path)
+    assert load_conversation(tid, db_path=path) == edited
+
+
+def test_save_rewrites_history_edited_in_the_middle(tmp_path):
+    path = str(tmp_path / "conv.db")
+    tid = "t-middle"
+    msgs = [{"role": "user", "content": str(i)} for i in range(4)]
+    save_conversation(tid, msgs, db_path=path)
+
+    # the last stored message is unchanged, only one before it was edited
+    edited = msgs[:1] + [{"role": "assistant", "content": "editada"}] + msgs[2:] + [{"role": "user", "content": "4"}]
+    save_conversation(tid, edited, db_path=path)
+    assert load_conversation(tid, db_path=path) == edited
+
+
+def test_append_messages_detects_conflict(tmp_path):
+    path = str(tmp_path / "conv.db")
+    tid = "t-conflict"
+    assert append_messages(tid, [{"role": "user", "content": "a"}], expected_seq=0, db_path=path) == 1
+    assert append_messages(tid, [{"role": "assistant", "content": "b"}], expected_seq=1, db_path=path) == 2
+
+    with pytest.raises(ConversationConflictError):
+        append_messages(tid, [{"role": "user", "content": "c"}], expected_seq=1, db_path=path)
+    assert [m["content"] for m in load_conversation(tid, db_path=path)] == ["a", "b"]
+
+
+def test_search_ignores_accents_and_ranks(tmp_path):
+    path = str(tmp_path / "conv.db")
+    save_conversation("a", [{"role": "user", "content": "uma reunião hoje"}], title="agenda", db_path=path)
+    save_conversation(
+        "b",
+        [{"role": "user", "content": "reunião de reunião sobre a reunião"}],
+        title="reunião semanal",
+        db_path=path,
+    )
+
+    res = search_conversations("reuniao", db_path=path)
+    assert [tid for tid, _ in res] == ["b", "a"]
+
+    res = search_conversations("uma reun", db_path=path, snippets=True)
+    assert res == [("a", "agenda", "**uma** **reunião** hoje")]
+
+
+def test_search_falls_back_without_fts(tmp_path, monkeypatch):
+    import conversation_storage
+
+    monkeypatch.setattr(
+        conversation_storage,
+        "_FTS_SCHEMA",
+        ["CREATE VIRTUAL TABLE messages_fts USING no_such_module(content)"],
+    )
+    path = str(tmp_path / "conv.db")
+    save_conversation("c1", [{"role": "user", "content": "foo bar"}], title="x", db_path=path)
+    assert search_conversations("bar", db_path=path) == [("c1", "x")]
+    assert search_conversations("bar", db_path=path, snippets=True) == [("c1", "x", None)]
+
+
+def test_storage_migrates_once_and_reuses_connections(tmp_path, monkeypatch):
+    import conversation_storage
+
+    calls = []
+    base = conversation_storage._MIGRATIONS[0]
+    monkeypatch.setattr(
+        conversation_storage,
+        "_MIGRATIONS",
+        [lambda conn: calls.append(1) or base(conn)] + conversation_storage._MIGRATIONS[1:],
+    )
+    storage = ConversationStorage(str(tmp_path / "conv.db"), pool_size=1)
+    with storage.connection() as conn:
+        first = conn
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(conversation_storage._MIGRATIONS)
+    with storage.connection() as conn:
+        assert conn is first
+    assert calls == [1]
+    storage.close()
+
+
+def test_storage_is_thread_safe(tmp_path):
+    storage = ConversationStorage(str(tmp_path / "conv.db"))
+
+    def worker(n):
+        tid = f"t{n}"
+        for i in range(20):
+            storage.append_messages(tid, [{"role": "user", "content": str(i)}], expected_seq=i)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(storage.list_conversations()) == 8
+    assert [m["content"] for m in storage.load_conversation("t3")] == [str(i) for i in range(20)]
+    storage.close()
+
+
+def test_list_conversations_page(tmp_path):
+    path = str(tmp_path / "conv.db")
+    for n in range(5):
+        msgs = [{"role": "user", "content": f"pergunta {n}"}, {"role": "assistant", "content": f"resposta {n}"}]
+        save_conversation(f"t{n}", msgs[: 1 + n % 2], title=f"c{n}", db_path=path)
+
+    page = list_conversations_page(limit=2, db_path=path)
+    assert [c.thread_id for c in page.items] == ["t4", "t3"]
+    assert page.items[0] == ("t4", "c4", page.items[0].updated_at, 1, "pergunta 4")
+    assert page.items[1].message_count == 2 and page.items[1].last_message == "resposta 3"
+
+    seen = [c.thread_id for c in page.items]
+    while page.next_cursor:
+        page = list_conversations_page(limit=2, cursor=page.next_cursor, db_path=path)
+        seen += [c.thread_id for c in page.items]
+    assert seen == ["t4", "t3", "t2", "t1", "t0"]
+
+
+def test_load_conversation_window(tmp_path):
+    path = str(tmp_path / "conv.db")
+    tid = "long"
+    msgs = [{"role": "user", "content": str(i), "sources": [{"doc": i}]} for i in range(10)]
+    save_conversation(tid, msgs, db_path=path)
+
+    window = load_conversation_window(tid, limit=4, db_path=path)
+    assert window.start_seq == 6 and window.has_older
+    assert [m["content"] for m in window.messages] == ["6", "7", "8", "9"]
+    sources = window.messages[0]["sources"]
+    assert isinstance(sources, LazySources) and sources.value == [{"doc": 6}]
+
+    older = load_conversation_window(tid, limit=4, before_seq=window.start_seq, db_path=path)
+    assert [m["content"] for m in older.messages] == ["2", "3", "4", "5"]
+    oldest = load_conversation_window(tid, limit=4, before_seq=older.start_seq, db_path=path)
+    assert oldest.start_seq == 0 and not oldest.has_older
+
+
+def test_save_window_appends_after_stored_history(tmp_path):
+    path = str(tmp_path / "conv.db")
+    tid = "win"
+    msgs = [{"role": "user", "content": str(i), "sources": [i]} for i in range(6)]
+    save_conversation(tid, msgs, db_path=path)
+
+    window = load_conversation_window(tid, limit=2, db_path=path)
+    window.messages.append({"role": "assistant", "content": "6"})
+    save_conversation(tid, window.messages, start_seq=window.start_seq, db_path=path)
+
+    assert load_conversation(tid, db_path=path) == msgs + [{"role": "assistant", "content": "6"}]
+
+
+def test_rename_only_if_title_unchanged(tmp_path):
+    path = str(tmp_path / "conv.db")
+    save_conversation("t", [{"role": "user", "content": "oi"}], title="provisório", db_path=path)
+
+    assert rename_conversation("t", "do usuário", db_path=path)
+    assert not rename_conversation("t", "do modelo", expected_title="provisório", db_path=path)
+    assert list_conversations(db_path=path) == [("t", "do usuário")]
+
+
+def _later(days=31):
+    return datetime.now() + timedelta(days=days)
+
+
+def test_archived_conversation_reads_back(tmp_path):
+    path = str(tmp_path / "conv.db")
+    storage = ConversationStorage(path)
+    msgs = [{"role": "user", "content": f"mensagem {i}", "sources": [{"doc": i}]} for i in range(6)]
+    storage.save_conversation("old", msgs, title="antiga")
+    storage.save_conversation("new", [{"role": "user", "content": "oi"}], title="nova")
+
+    assert storage.archive_stale(30, now=_later()) == 2
+    assert storage.archive_stale(30, now=_later()) == 0
+    with storage.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 0
+
+    assert storage.load_conversation("old") == msgs
+    window = storage.load_conversation_window("old", limit=4)
+    assert window.start_seq == 2 and [m["content"] for m in window.messages][0] == "mensagem 2"
+    assert window.messages[0]["sources"] == LazySources('[{"doc": 2}]')
+    older = storage.load_conversation_window("old", limit=4, before_seq=window.start_seq)
+    assert older.start_seq == 0 and [m["content"] for m in older.messages] == ["mensagem 0", "mensagem 1"]
+
+    items = {item.thread_id: item for item in storage.list_conversations_page().items}
+    assert items["old"].message_count == 6 and items["old"].last_message == "mensagem 5"
+    assert storage.search_conversations("antiga") == [("old", "antiga")]
+
+
+def test_writing_to_archived_conversation_restores_it(tmp_path):
+    path = str(tmp_path / "conv.db")
+    storage = ConversationStorage(path)
+    msgs = [{"role": "user", "content": "relatório trimestral"}, {"role": "assistant", "content": "pronto"}]
+    storage.save_conversation("t", msgs, title="t")
+    storage.archive_stale(30, now=_later())
+    assert storage.search_conversations("trimestral") == [("t", "t")]
+
+    turn = [{"role": "user", "content": "e agora?"}]
+    assert storage.append_messages("t", turn, expected_seq=2) == 3
+    assert storage.load_conversation("t") == msgs + turn
+    assert storage.search_conversations("trimestral") == [("t", "t")]
+    with storage.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM archived_conversations").fetchone()[0] == 0
+
+    storage.archive_stale(30, now=_later())
+    storage.save_conversation("t", msgs + turn + [{"role": "assistant", "content": "fim"}])
+    assert [m["content"] for m in storage.load_conversation("t")][-2:] == ["e agora?", "fim"]
+
+
+def test_search_finds_archived_conversations_by_content(tmp_path):
+    storage = ConversationStorage(str(tmp_path / "conv.db"))
+    storage.save_conversation("old", [{"role": "user", "content": "como está a migração do relatório?"}], title="velha")
+    storage.archive_stale(30, now=_later())
+    storage.save_conversation("new", [{"role": "user", "content": "relatorio novo"}], title="nova")
+
+    # live hits are ranked first; the archive scan ignores accents like the index
+    assert storage.search_conversations("relatorio") == [("new", "nova"), ("old", "velha")]
+    assert storage.search_conversations("relatorio", limit=1) == [("new", "nova")]
+    assert storage.search_conversations("migracao relat", snippets=True) == [
+        ("old", "velha", "como está a **migração** do **relatório?**")
+    ]
+    assert storage.search_conversations("inexistente") == []
+
+
+def test_archive_codecs(tmp_path, monkeypatch):
+    msgs = [{"role": "assistant", "content": "palavra " * 500}]
+    if conversation_storage.zstandard is not None:
+        storage = ConversationStorage(str(tmp_path / "zstd.db"))
+        storage.save_conversation("t", msgs)
+        storage.archive_stale(30, now=_later())
+        with storage.connection() as conn:
+            codec, data = conn.execute("SELECT codec, data FROM archived_conversations").fetchone()
+        assert codec == "zstd" and len(data) < 200
+
+    monkeypatch.setattr(conversation_storage, "zstandard", None)
+    storage = ConversationStorage(str(tmp_path / "zlib.db"))
+    storage.save_conversation("t", msgs)
+    storage.archive_stale(30, now=_later())
+    with storage.connection() as conn:
+        assert conn.execute("SELECT codec FROM archived_conversations").fetchone()[0] == "zlib"
+    assert storage.load_conversation("t") == msgs
+
+
+def test_maintenance_purges_and_reclaims_space(tmp_path):
+    path = str(tmp_path / "conv.db")
+    # a file created before incremental auto-vacuum
+    sqlite3.connect(path).execute("CREATE TABLE legacy(x)").connection.close()
+    storage = ConversationStorage(path)
+    for n in range(20):
+        storage.save_conversation(f"t{n}", [{"role": "user", "content": "texto longo " * 2000}], title=f"conversa {n}")
+
+    report = storage.maintenance(retention_days=30, now=_later())
+    assert report.purged == 20 and report.archived == 0
+    assert report.reclaimed > 400_000
+    assert storage.list_conversations() == []
+    with storage.connection() as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    # the title index survives the VACUUM that renumbers rowids
+    storage.save_conversation("a", [{"role": "user", "content": "x"}], title="alfa")
+    storage.save_conversation("b", [{"role": "user", "content": "y"}], title="beta")
+    storage.vacuum()
+    assert storage.search_conversations("beta") == [("b", "beta")]
+
+    # from now on deletes are reclaimed incrementally
+    for n in range(20):
+        storage.save_conversation(f"t{n}", [{"role": "user", "content": "texto longo " * 2000}])
+    for n in range(20):
+        storage.delete_conversation(f"t{n}")
+    before, after = storage.vacuum()
+    assert before - after > 400_000
@@ -0,0 +1,105 @@
+import sys
+import pathlib
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+import history_policy
+from history_policy import MiddleOutPolicy, RollingSummaryPolicy, SlidingWindowPolicy
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # um token por palavra, para os orçamentos serem previsíveis
+    monkeypatch.setattr(history_policy, "count_tokens", lambda text, model_name=None: len(text.split()))
+    monkeypatch.setattr(history_policy, "MESSAGE_OVERHEAD_TOKENS", 0)
+
+
+def conversation(turns):
+    messages = []
+    for i in range(turns):
+        messages.append(HumanMessage(content=f"pergunta {i} " + "x " * 8, id=f"h{i}"))
+        messages.append(AIMessage(content=f"resposta {i} " + "y " * 8, id=f"a{i}"))
+    return messages
+
+
+def test_sliding_window_keeps_newest_within_budget():
+    messages = conversation(5) + [HumanMessage(content="agora", id="now")]
+    policy = SlidingWindowPolicy(max_tokens=41)
+
+    # 10 tokens por mensagem antiga, 1 para a pergunta atual
+    selected = policy.apply(messages)
+    assert [m.id for m in selected] == ["h3", "a3", "h4", "a4", "now"]
+    assert policy.last_report == (101, 41, 11, 5)
+    assert policy.last_report.tokens_saved == 60
+
+
+def test_window_never_starts_with_tool_output():
+    messages = [
+        HumanMessage(content="emails?", id="h0"),
+        AIMessage(content="", id="a0", tool_calls=[{"name": "GetEmails", "args": {}, "id": "c1"}]),
+        ToolMessage(content="muito texto " * 20, tool_call_id="c1", id="t0"),
+        AIMessage(content="você tem dois emails", id="a1"),
+        HumanMessage(content="obrigado", id="h1"),
+    ]
+    selected = SlidingWindowPolicy(max_tokens=10).apply(messages)
+    assert [m.id for m in selected] == ["a1", "h1"]
+
+
+def test_current_turn_is_always_sent():
+    messages = conversation(2) + [HumanMessage(content="z " * 50, id="big")]
+    assert [m.id for m in SlidingWindowPolicy(max_tokens=5).apply(messages)] == ["big"]
+
+
+def test_middle_out_keeps_head_and_tail():
+    messages = conversation(6) + [HumanMessage(content="agora", id="now")]
+    selected = MiddleOutPolicy(max_tokens=45, head_messages=2).apply(messages)
+    assert [m.id for m in selected] == ["h0", "a0", "h5", "a5", "now"]
+
+
+def test_middle_out_shrinks_old_tool_outputs():
+    messages = [
+        HumanMessage(content="emails?", id="h0"),
+        AIMessage(content="", id="a0", tool_calls=[{"name": "GetEmails", "args": {}, "id": "c1"}]),
+        ToolMessage(content="palavra " * 500, tool_call_id="c1", id="t0"),
+        AIMessage(content="pronto", id="a1"),
+        HumanMessage(content="e agora?", id="h1"),
+    ]
+    selected = MiddleOutPolicy(max_tokens=1000, head_messages=1, max_tool_tokens=50).apply(messages)
+    assert [m.type for m in selected] == ["human", "ai", "tool", "ai", "human"]
+    assert len(selected[2].content) < len(messages[2].content)
+    assert "[…]" in selected[2].content
+
+
+def test_rolling_summary_replaces_dropped_turns():
+    calls = []
+
+    def summarize(previous, messages):
+        calls.append((previous, [m.id for m in messages]))
+        return f"resumo até {messages[-1].id}"
+
+    policy = RollingSummaryPolicy(max_tokens=80, summarize=summarize, summary_fraction=0.25)
+    messages = conversation(5) + [HumanMessage(content="agora", id="now")]
+
+    first = policy.apply(messages)
+    assert first[0].type != "system"  # resumo ainda não estava pronto
+    policy.wait(timeout=5)
+
+    second = policy.apply(messages)
+    assert second[0].type == "system" and "resumo até" in second[0].content
+    assert len(calls) == 1
+    assert policy.last_report.tokens_saved > 0
+
+
+def test_rolling_summary_keeps_a_bounded_number_of_summaries():
+    policy = RollingSummaryPolicy(max_tokens=80, summarize=lambda previous, messages: "resumo", max_summaries=2)
+    for thread in range(4):
+        messages = [m.model_copy(update={"id": f"{thread}-{m.id}"}) for m in conversation(5)]
+        policy.apply(messages + [HumanMessage(content="agora", id=f"{thread}-now")])
+        policy.wait(timeout=5)
+    assert len(policy._summaries) == 2
@@ -0,0 +1,75 @@
+import sys
+import pathlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from html_text import html_to_text
+from token_accounting import count_tokens
+
+
+def test_paragraphs_lists_and_tables_keep_their_breaks():
+    html = (
+        "<html><head><title>Newsletter</title><style>p {color: red}</style></head><body>"
+        "<p>Olá&nbsp;mundo &amp; cia</p><p>Segundo   parágrafo<br>linha 2</p>"
+        "<ul><li>um</li><li>dois</li></ul>"
+        "<table><tr><td>a</td><td>b</td></tr><tr><td>c</td><td>d</td></tr></table>"
+        "<script>track()</script>fim</body></html>"
+    )
+    assert html_to_text(html) == (
+        "Olá mundo & cia\n\nSegundo parágrafo\nlinha 2\n\n- um\n- dois\n\na b\nc d\n\nfim"
+    )
+
+
+def test_links_and_entities():
+    html = "<p>&lt;Veja&gt; <a href=' https://a.com/?x=1&amp;y=2 '>o  site</a>, &eacute; <a>isso</a></p>"
+    assert html_to_text(html) == "<Veja> [o site](https://a.com/?x=1&y=2), é isso"
+
+
+def test_char_cap_stops_reading():
+    html = "<p>" + "palavra " * 10_000 + "</p><p>depois</p>"
+    text = html_to_text(html, max_chars=30)
+    assert text == "palavra palavra palavra palavr…"
+
+
+def test_token_cap():
+    html = "<p>" + "palavra " * 200 + "</p>"
+    text = html_to_text(html, max_tokens=20)
+    assert text.endswith("…")
+    assert count_tokens(text) <= 20 < count_tokens(html_to_text(html))
+
+
+def test_unclosed_and_malformed_markup():
+    html = "<div><p>sem fechamento<a href='u'>link<p>outro <b>negrito"
+    # link sem </a> fica só com o texto
+    assert html_to_text(html) == "sem fechamentolink\n\noutro negrito"
+
+
+def test_indented_markup_keeps_single_breaks():
+    html = """<html>
+  <body>
+    <div>
+      <p>Primeiro</p>
+      <p>
+        Segundo
+        parágrafo
+      </p>
+      <ul>
+        <li>um</li>
+        <li>dois</li>
+      </ul>
+      <table>
+        <tr>
+          <td>a</td>
+          <td>b</td>
+        </tr>
+      </table>
+    </div>
+  </body>
+</html>"""
+    assert html_to_text(html) == "Primeiro\n\nSegundo parágrafo\n\n- um\n- dois\n\na b"
+    assert html_to_text("<p>x</p>   <p>y</p>") == "x\n\ny"
+
+
+def test_spaces_collapse_across_chunks():
+    assert html_to_text("<b>a </b> b") == "a b"
+    assert html_to_text("<p>\n  Veja\n  <a href='u'> o site </a>\n  agora\n</p>") == "Veja [o site](u) agora"
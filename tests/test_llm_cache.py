@@ -0,0 +1,54 @@
+import sys
+import pathlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import pytest
+
+import llm_cache
+from llm_cache import LLMCache, make_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LLMCache(str(tmp_path / "cache.db"), ttl=60, max_entries=3)
+
+
+def test_key_ignores_whitespace_but_not_model_or_tool_state():
+    base = make_key("mistral", [{"role": "user", "content": "Olá,  tudo bem?\n"}], {"tools": ["A"]})
+    assert base == make_key("mistral", [{"role": "user", "content": " Olá, tudo bem?"}], {"tools": ["A"]})
+    assert base != make_key("llama3", [{"role": "user", "content": "Olá, tudo bem?"}], {"tools": ["A"]})
+    assert base != make_key("mistral", [{"role": "user", "content": "Olá, tudo bem?"}], {"tools": ["B"]})
+
+
+def test_hits_misses_and_ttl(cache, monkeypatch):
+    calls = []
+    compute = lambda: calls.append(1) or "resposta"
+    assert cache.cached("k", compute) == "resposta"
+    assert cache.cached("k", compute) == "resposta"
+    assert calls == [1]
+    assert cache.stats() == (1, 1, 1)
+
+    now = llm_cache.time.time()
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now + 61)
+    assert cache.get("k") is None
+    assert cache.stats().entries == 0
+
+
+def test_least_recently_used_entries_are_evicted(cache, monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr(llm_cache.time, "time", lambda: next(clock))
+    for key in "abc":
+        cache.put(key, key.upper())
+    cache.get("a")
+    cache.put("d", "D")
+
+    assert cache.get("b") is None
+    assert [cache.get(k) for k in "acd"] == ["A", "C", "D"]
+
+
+def test_disabled_cache_never_stores(tmp_path):
+    cache = LLMCache(str(tmp_path / "cache.db"), enabled=False)
+    cache.put("k", "v")
+    assert cache.get("k") is None
+    assert cache.stats() == (0, 0, 0)
@@ -14,7 +14,9 @@ sys.modules['token_manager'] = dummy_token_manager
 # Ensure repository root is on sys.path
 sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
 
+import mail
 from mail import format_body
+from mailbox_mirror import MailboxMirror
 
 
 def test_strip_tags():
@@ -26,3 +28,268 @@ def test_convert_links_to_markdown():
     html = "<p>See <a href='https://example.com'>example</a></p>"
     assert format_body(html) == "See [example](https://example.com)"
 
+
+
+class StubResponse:
+    def __init__(self, status_code, payload=None, headers=None):
+        self.status_code = status_code
+        self._payload = payload or {}
+        self.headers = headers or {}
+        self.text = str(payload)
+
+    def json(self):
+        return self._payload
+
+
+class StubGraphSession:
+    """Imita o endpoint $batch do Graph: apaga/atualiza mensagens conhecidas."""
+
+    def __init__(self, messages, throttle_first=0, throttle_batch=False):
+        self.messages = dict(messages)
+        self.batches = []
+        self.gets = []
+        self.changes = []
+        self.throttle_first = throttle_first
+        self.throttle_batch = throttle_batch
+
+    def _summary(self, msg_id):
+        return {"id": msg_id, "subject": f"assunto {msg_id}", "from": {"emailAddress": {"address": "a@b.c"}},
+                "receivedDateTime": f"2024-01-01T10:{int(msg_id[1:]):02d}:00Z",
+                "bodyPreview": "  início\n\n\n\ndo texto ", "isRead": self.messages[msg_id]["isRead"]}
+
+    def _delta(self, url):
+        # rodada completa paginada de 20 em 20; depois, só as mudanças desde o último token
+        if "token=" in url:
+            changes, self.changes = self.changes, []
+            return {"value": changes, "@odata.deltaLink": f"{url.split('?')[0]}?token={len(self.gets)}"}
+        page = int(url.split("page=")[1]) if "page=" in url else 0
+        ids = list(self.messages)[page * 20:(page + 1) * 20]
+        body = {"value": [self._summary(msg_id) for msg_id in ids]}
+        base = url.split("?")[0]
+        if (page + 1) * 20 < len(self.messages):
+            body["@odata.nextLink"] = f"{base}?page={page + 1}"
+        else:
+            self.changes = []
+            body["@odata.deltaLink"] = f"{base}?token={len(self.gets)}"
+        return body
+
+    def get(self, url, headers=None):
+        self.gets.append((url, headers))
+        if "/delta" in url:
+            return StubResponse(200, self._delta(url))
+        top = int(url.split("$top=")[1].split("&")[0])
+        skip = int(url.split("$skip=")[1]) if "$skip=" in url else 0
+        listing = [
+            {"id": msg_id, "subject": f"assunto {msg_id}", "from": {"emailAddress": {"address": "a@b.c"}},
+             "receivedDateTime": "2024-01-01T10:00:00Z", "bodyPreview": "  início\n\n\n\ndo texto ",
+             "isRead": msg["isRead"]}
+            for msg_id, msg in list(self.messages.items())[skip:skip + top]
+        ]
+        page = {"value": listing}
+        if skip + top < len(self.messages):
+            page["@odata.nextLink"] = f"{url.split('&$skip=')[0]}&$skip={skip + top}"
+        return StubResponse(200, page)
+
+    def post(self, url, headers=None, json=None):
+        assert url.endswith("/$batch")
+        assert len(json["requests"]) <= 20
+        self.batches.append(json["requests"])
+        if self.throttle_batch:
+            self.throttle_batch = False
+            return StubResponse(429, headers={"Retry-After": "3"})
+        responses = []
+        for req in json["requests"]:
+            msg_id = req["url"].split("?")[0].rsplit("/", 1)[-1]
+            if self.throttle_first > 0:
+                self.throttle_first -= 1
+                responses.append({"id": req["id"], "status": 429, "headers": {"Retry-After": "2"}})
+            elif msg_id not in self.messages:
+                responses.append({"id": req["id"], "status": 404, "body": {"error": "not found"}})
+            elif req["method"] == "GET":
+                assert req["headers"]["Prefer"] == mail.PREFER_TEXT_BODY
+                body = {"contentType": "text", "content": f"corpo de {msg_id}\r\n\r\n\r\nfim"}
+                responses.append({"id": req["id"], "status": 200, "body": {"id": msg_id, "body": body}})
+            elif req["method"] == "DELETE":
+                del self.messages[msg_id]
+                responses.append({"id": req["id"], "status": 204})
+            else:
+                self.messages[msg_id].update(req["body"])
+                responses.append({"id": req["id"], "status": 200, "body": self.messages[msg_id]})
+        # o Graph não garante a ordem das respostas
+        responses.reverse()
+        return StubResponse(200, {"responses": responses})
+
+
+@pytest.fixture
+def graph(monkeypatch, tmp_path):
+    sleeps = []
+    monkeypatch.setattr(mail, "MAIL_MIRROR", True)
+    monkeypatch.setattr(mail, "_mailbox", MailboxMirror(str(tmp_path / "mail.db")))
+    monkeypatch.setattr(mail, "_initial_sync", None)
+    monkeypatch.setattr(mail, "_sleep", sleeps.append)
+    monkeypatch.setattr(mail, "_access_token", lambda: "token")
+    stub = StubGraphSession({f"m{i}": {"isRead": False} for i in range(45)})
+    stub.sleeps = sleeps
+    return stub
+
+
+def test_delete_uses_batches_of_twenty(graph):
+    ids = [f"m{i}" for i in range(45)] + ["missing"]
+    results = mail.delete_email_by_id(ids, session=graph)
+
+    assert [len(b) for b in graph.batches] == [20, 20, 6]
+    assert results == {**{f"m{i}": True for i in range(45)}, "missing": False}
+    assert graph.messages == {}
+
+
+def test_mark_as_read_retries_throttled_items(graph):
+    graph.throttle_first = 3
+    results = mail.mark_emails_as_read(["m1", "m2", "m3", "m4"], access_token="t", session=graph)
+
+    assert results == {"m1": True, "m2": True, "m3": True, "m4": True}
+    assert [len(b) for b in graph.batches] == [4, 3]
+    assert graph.sleeps == [2]
+    assert all(graph.messages[f"m{i}"]["isRead"] for i in range(1, 5))
+
+
+def test_batch_retries_when_whole_request_is_throttled(graph):
+    graph.throttle_batch = True
+    assert mail.delete_email_by_id(["m0"], session=graph) == {"m0": True}
+    assert graph.sleeps == [3]
+
+
+def test_get_emails_lists_headers_only(graph, monkeypatch):
+    monkeypatch.setattr(mail, "MAIL_MIRROR", False)
+    emails = mail.get_emails(limit=3, mark_as_read=False, session=graph)
+
+    url, headers = graph.gets[0]
+    assert "$select=id,subject,from,receivedDateTime,bodyPreview,isRead&" in url
+    assert headers["Prefer"] == 'outlook.body-content-type="text"'
+    assert [e["id"] for e in emails] == ["m0", "m1", "m2"]
+    assert emails[0]["preview"] == "início\n\ndo texto"
+    assert "body" not in emails[0]
+    assert graph.batches == []
+
+
+def test_mark_unread_as_read_only_touches_given_unread_emails(graph, monkeypatch):
+    monkeypatch.setattr(mail, "MAIL_MIRROR", False)
+    graph.messages["m1"]["isRead"] = True
+    emails = mail.get_emails(limit=4, mark_as_read=False, session=graph)
+
+    # só os dois primeiros chegaram ao modelo
+    mail.mark_unread_as_read(emails[:2], session=graph)
+    assert [req["url"] for batch in graph.batches for req in batch] == ["/me/messages/m0"]
+    assert not graph.messages["m2"]["isRead"] and not graph.messages["m3"]["isRead"]
+
+
+def test_get_email_bodies_fetches_only_requested_ids(graph):
+    bodies = mail.get_email_bodies(["m7", "missing", "m2"], session=graph)
+
+    assert [req["url"] for req in graph.batches[0]] == [
+        "/me/messages/m7?$select=body",
+        "/me/messages/missing?$select=body",
+        "/me/messages/m2?$select=body",
+    ]
+    assert bodies["m7"] == "corpo de m7\n\nfim"
+    assert bodies["m2"] == "corpo de m2\n\nfim"
+    assert bodies["missing"].startswith("Erro")
+
+
+def _synced(graph):
+    # a primeira rodada de get_emails roda em segundo plano; aqui ela é feita direto
+    mail._mailbox.sync(mail._delta_fetcher(graph), mail._delta_url())
+
+
+def test_first_sync_runs_in_background_while_graph_answers(graph):
+    emails = mail.get_emails(limit=3, mark_as_read=False, session=graph)
+    mail._initial_sync.join(5)
+
+    # enquanto o espelho não existe, a resposta vem da consulta direta (todas as pastas)
+    assert [e["id"] for e in emails] == ["m0", "m1", "m2"]
+    assert any("/me/messages?" in url for url, _ in graph.gets)
+    assert mail._mailbox.synced_at is not None
+
+    gets = len(graph.gets)
+    emails = mail.get_emails(limit=3, mark_as_read=False, session=graph)
+    assert [e["id"] for e in emails] == ["m44", "m43", "m42"]
+    assert len(graph.gets) == gets
+
+
+def test_get_emails_answers_from_mirror(graph):
+    _synced(graph)
+    emails = mail.get_emails(limit=3, mark_as_read=False, session=graph)
+
+    # rodada completa em 3 páginas; a consulta em si não vai ao Graph
+    assert [url.split("?")[1] for url, _ in graph.gets][1:] == ["page=1", "page=2"]
+    assert "/me/mailFolders/inbox/messages/delta" in graph.gets[0][0]
+    assert [e["id"] for e in emails] == ["m44", "m43", "m42"]
+    assert emails[0]["preview"] == "início\n\ndo texto"
+
+    graph.messages["m44"]["isRead"] = True
+    mail.get_emails(limit=3, mark_as_read=False, session=graph)
+    assert len(graph.gets) == 3  # ainda dentro do limite de frescor
+
+    mail._mailbox.max_age = 0
+    graph.changes = [{"id": "m43", "@removed": {"reason": "deleted"}}, {"id": "m44", "isRead": True}]
+    unread = mail.get_emails(limit=2, mark_as_read=False, session=graph)
+    assert "token=" in graph.gets[-1][0]
+    assert [e["id"] for e in unread] == ["m42", "m41"]
+
+
+def test_mirror_writes_through_deletes_and_read_state(graph):
+    _synced(graph)
+    mail.get_emails(limit=2, session=graph)
+    assert all(graph.messages[m]["isRead"] for m in ("m44", "m43"))
+    assert [e["id"] for e in mail._mailbox.query("unread", limit=2)] == ["m42", "m41"]
+
+    mail.delete_email_by_id(["m42"], session=graph)
+    assert [e["id"] for e in mail._mailbox.query("all", limit=2)] == ["m44", "m43"]
+    assert mail._mailbox.query("all", limit=1, subject_keyword="m42") == []
+
+
+def test_get_email_bodies_are_cached_in_mirror(graph):
+    _synced(graph)
+    mail.get_emails(limit=1, mark_as_read=False, session=graph)
+    assert mail.get_email_bodies(["m44"], session=graph) == {"m44": "corpo de m44\n\nfim"}
+    assert mail.get_email_bodies(["m44"], session=graph) == {"m44": "corpo de m44\n\nfim"}
+    assert len(graph.batches) == 1
+
+
+def test_iter_emails_follows_next_link_with_prefetch(graph):
+    emails = list(mail.iter_emails("all", limit=45, session=graph, page_size=20))
+
+    assert [e["id"] for e in emails] == [f"m{i}" for i in range(45)]
+    assert [url.split("$skip=")[1] if "$skip=" in url else "0" for url, _ in graph.gets] == ["0", "20", "40"]
+
+
+def test_iter_emails_stops_at_limit(graph):
+    emails = mail.iter_emails("all", limit=25, session=graph, page_size=20)
+    assert len(list(emails)) == 25
+    assert len(graph.gets) == 2
+
+    # com limit dentro da primeira página nada é buscado antes
+    first = mail.iter_emails("all", limit=20, session=graph, page_size=20)
+    assert next(first)["id"] == "m0"
+    first.close()
+    assert len(graph.gets) == 3
+
+
+def test_live_listing_reports_graph_errors(graph, monkeypatch):
+    monkeypatch.setattr(mail, "MAIL_MIRROR", False)
+    graph.get = lambda url, headers=None: StubResponse(500, headers={}, payload={"error": "x"})
+    assert mail.get_emails(session=graph).startswith("Erro ao buscar e-mails: 500")
+
+
+def test_graph_latency_is_recorded_by_endpoint(graph, monkeypatch):
+    import metrics
+
+    registry = metrics.MetricsRegistry()
+    monkeypatch.setattr(metrics, "registry", registry)
+    monkeypatch.setattr(mail, "MAIL_MIRROR", False)
+    mail.get_emails(status="all", limit=3, mark_as_read=False, session=graph)
+    mail.delete_email_by_id(["m0"], session=graph)
+
+    histogram = registry.histogram("graph_request_seconds")
+    assert histogram.count(method="GET", endpoint="me/messages", outcome="ok") == 1
+    assert histogram.count(method="POST", endpoint="$batch", outcome="ok") == 1
+    assert mail._endpoint(f"{mail.GRAPH_URL}/me/messages/{'A' * 120}?$select=body") == "me/messages/{id}"
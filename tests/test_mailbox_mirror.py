@@ -0,0 +1,91 @@
+import sys
+import pathlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import pytest
+
+from mailbox_mirror import DeltaExpiredError, MailboxMirror
+
+
+def summary(msg_id, minute, is_read=False, subject=None):
+    return {
+        "id": msg_id,
+        "subject": subject or f"assunto {msg_id}",
+        "from": "a@b.c",
+        "receivedDateTime": f"2024-01-01T10:{minute:02d}:00Z",
+        "isRead": is_read,
+        "preview": "texto",
+    }
+
+
+class Pages:
+    """fetch_page falso: cada URL devolve a página registrada para ela."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def __call__(self, url):
+        self.calls.append(url)
+        page = self.pages[url]
+        if isinstance(page, Exception):
+            raise page
+        return page
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    return MailboxMirror(str(tmp_path / "mail.db"), max_age=60)
+
+
+def test_full_sync_then_incremental(mirror):
+    fetch = Pages({
+        "full": ([summary("a", 1), summary("b", 2)], "full-2", None),
+        "full-2": ([summary("c", 3, is_read=True)], None, "delta-1"),
+        "delta-1": ([{"id": "a", "removed": True}, {"id": "b", "isRead": True}], None, "delta-2"),
+    })
+    assert mirror.sync(fetch, "full") == 3
+    assert mirror.is_fresh()
+    assert [e["id"] for e in mirror.query("unread")] == ["b", "a"]
+
+    assert mirror.sync(fetch, "full") == 2
+    assert fetch.calls == ["full", "full-2", "delta-1"]
+    assert mirror.query("unread") == []
+    # a atualização parcial mantém os campos que não vieram
+    assert mirror.query("read") == [
+        {"id": "c", "subject": "assunto c", "from": "a@b.c", "receivedDateTime": "2024-01-01T10:03:00Z",
+         "isRead": True, "preview": "texto"},
+        {"id": "b", "subject": "assunto b", "from": "a@b.c", "receivedDateTime": "2024-01-01T10:02:00Z",
+         "isRead": True, "preview": "texto"},
+    ]
+
+
+def test_expired_delta_link_falls_back_to_full_sync(mirror):
+    mirror.sync(Pages({"full": ([summary("a", 1), summary("b", 2)], None, "old")}), "full")
+    mirror.store_bodies({"a": "corpo"})
+
+    fetch = Pages({"old": DeltaExpiredError("gone"), "full": ([summary("a", 1)], None, "new")})
+    mirror.sync(fetch, "full")
+
+    assert fetch.calls == ["old", "full"]
+    # o que a rodada completa não listou saiu da pasta
+    assert [e["id"] for e in mirror.query()] == ["a"]
+    assert mirror.bodies(["a", "b"]) == {"a": "corpo"}
+
+
+def test_ensure_fresh_skips_recent_sync(mirror):
+    fetch = Pages({"full": ([summary("a", 1)], None, "d1"), "d1": ([], None, "d2")})
+    assert mirror.ensure_fresh(fetch, "full") == 1
+    assert mirror.ensure_fresh(fetch, "full") is None
+    mirror.max_age = 0
+    assert mirror.ensure_fresh(fetch, "full") == 0
+    assert fetch.calls == ["full", "d1"]
+
+
+def test_subject_filter_escapes_wildcards(mirror):
+    items = [summary("a", 1, subject="Reunião 100% confirmada"), summary("b", 2, subject="Relatório")]
+    mirror.sync(Pages({"full": (items, None, "d")}), "full")
+    assert [e["id"] for e in mirror.query(subject_keyword="100%")] == ["a"]
+    assert [e["id"] for e in mirror.query(subject_keyword="RELAT")] == ["b"]
+    assert mirror.query(subject_keyword="_") == []
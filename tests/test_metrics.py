@@ -0,0 +1,84 @@
+import sys
+import pathlib
+import json
+import logging
+import threading
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import pytest
+
+import metrics
+from metrics import JsonFormatter, MetricsRegistry, TurnTimer, span
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(metrics, "registry", registry)
+    return registry
+
+
+def test_histogram_renders_cumulative_prometheus_buckets(registry):
+    histogram = registry.histogram("graph_request_seconds", "Latência do Graph", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        histogram.observe(value, endpoint="me/messages")
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP graph_request_seconds Latência do Graph", "# TYPE graph_request_seconds histogram"]
+    assert 'graph_request_seconds_bucket{endpoint="me/messages",le="0.1"} 1' in lines
+    assert 'graph_request_seconds_bucket{endpoint="me/messages",le="1"} 3' in lines
+    assert 'graph_request_seconds_bucket{endpoint="me/messages",le="+Inf"} 4' in lines
+    assert 'graph_request_seconds_sum{endpoint="me/messages"} 4.25' in lines
+    assert 'graph_request_seconds_count{endpoint="me/messages"} 4' in lines
+
+
+def test_span_records_outcome_and_logs_fields(registry, caplog):
+    caplog.set_level(logging.DEBUG, logger="metrics")
+    with span("sqlite", op="load") as fields:
+        fields["rows"] = 3
+    with pytest.raises(KeyError), span("sqlite", op="load"):
+        raise KeyError("x")
+
+    histogram = registry.histogram("sqlite_seconds")
+    assert histogram.count(op="load", outcome="ok") == 1
+    assert histogram.count(op="load", outcome="error") == 1
+    assert caplog.records[0].fields["rows"] == 3
+
+
+def test_turn_timer_reports_ttft_rate_and_tokens(registry, monkeypatch):
+    clock = iter([10.0, 10.5, 12.5])
+    monkeypatch.setattr(metrics.time, "perf_counter", lambda: next(clock))
+    turn = TurnTimer(mode="async")
+    turn.first_token()
+    turn.finish()
+    turn.report(40)
+
+    assert (turn.ttft, turn.duration, turn.tokens_per_second(40)) == (0.5, 2.5, 20.0)
+    assert registry.histogram("turn_ttft_seconds").count(mode="async", outcome="ok") == 1
+    assert registry.counter("turn_output_tokens_total").value(mode="async", outcome="ok") == 40
+
+
+def test_json_formatter_and_file_sink(registry, tmp_path):
+    record = logging.LogRecord("metrics", logging.INFO, __file__, 1, "turn", None, None)
+    record.fields = {"tokens": 12}
+    entry = json.loads(JsonFormatter().format(record))
+    assert (entry["msg"], entry["level"], entry["tokens"]) == ("turn", "INFO", 12)
+
+    registry.counter("eventos_total").inc(2)
+    path = tmp_path / "app.prom"
+    registry.write(str(path))
+    assert "eventos_total 2\n" in path.read_text()
+
+
+def test_concurrent_writes_use_separate_temp_files(registry, tmp_path):
+    registry.counter("eventos_total").inc()
+    path = tmp_path / "app.prom"
+    threads = [threading.Thread(target=registry.write, args=(str(path),)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert "eventos_total 1\n" in path.read_text()
+    assert [p.name for p in tmp_path.iterdir()] == ["app.prom"]
@@ -0,0 +1,58 @@
+import sys
+import pathlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import pytest
+
+from model_router import ModelRouter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_measured_backends_go_first_by_median_ttft():
+    router = ModelRouter(["local", "openrouter", "outro"])
+    assert router.ranked() == ["local", "openrouter", "outro"]
+
+    for ttft in (2.0, 2.5, 9.0):
+        router.record_success("local", ttft)
+    router.record_success("outro", 1.0)
+    assert router.ranked() == ["outro", "local", "openrouter"]
+
+
+def test_failing_backend_is_demoted_until_cooldown():
+    clock = Clock()
+    router = ModelRouter(["local", "openrouter"], min_samples=2, max_error_rate=0.5, cooldown=30, clock=clock)
+    router.record_success("local", 0.1)
+    router.record_success("openrouter", 1.0)
+    router.record_error("local")
+    assert router.ranked() == ["local", "openrouter"]  # 1 erro em 2: ainda no limite
+
+    router.record_error("local")
+    assert router.ranked() == ["openrouter", "local"]
+    assert [s.healthy for s in router.snapshot()] == [False, True]
+
+    clock.now = 31
+    assert router.ranked() == ["local", "openrouter"]
+
+
+def test_window_forgets_old_samples():
+    router = ModelRouter(["a", "b"], window=2)
+    router.record_success("a", 5.0)
+    router.record_success("b", 1.0)
+    router.record_success("a", 0.1)
+    router.record_success("a", 0.2)
+    snapshot = {s.name: s for s in router.snapshot()}
+    assert snapshot["a"].ttft == pytest.approx(0.15)
+    assert router.ranked() == ["a", "b"]
+
+
+def test_needs_at_least_one_backend():
+    with pytest.raises(ValueError):
+        ModelRouter([])
@@ -0,0 +1,139 @@
+import sys
+import pathlib
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import pytest
+
+pytest.importorskip("langchain_core")
+ChatOllama = pytest.importorskip("langchain_ollama").ChatOllama
+
+from router_chat_model import RouterChatModel
+
+
+class FakeOllama:
+    """Servidor HTTP local que imita o /api/chat do Ollama (NDJSON em streaming)."""
+
+    def __init__(self, reply, delay=0.0, status=200):
+        self.reply, self.delay, self.status = reply, delay, status
+        self.calls = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                fake.calls += 1
+                time.sleep(fake.delay)
+                if fake.status != 200:
+                    self.send_response(fake.status)
+                    self.end_headers()
+                    self.wfile.write(b'{"error": "sobrecarregado"}')
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                try:
+                    for word in fake.reply.split(" "):
+                        line = {"model": "fake", "created_at": "2024-01-01T00:00:00Z",
+                                "message": {"role": "assistant", "content": word + " "}, "done": False}
+                        self.wfile.write(json.dumps(line).encode() + b"\n")
+                        self.wfile.flush()
+                    done = {"model": "fake", "created_at": "2024-01-01T00:00:00Z",
+                            "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop"}
+                    self.wfile.write(json.dumps(done).encode() + b"\n")
+                except OSError:
+                    pass  # cliente cancelou
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def chat(self):
+        host, port = self.server.server_address
+        return ChatOllama(model="fake", base_url=f"http://{host}:{port}")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def make(*args, **kwargs):
+        started.append(FakeOllama(*args, **kwargs))
+        return started[-1]
+
+    yield make
+    for server in started:
+        server.close()
+
+
+def stats(model):
+    return {s.name: s for s in model.router.snapshot()}
+
+
+def test_fails_over_on_error_and_then_prefers_the_healthy_backend(servers):
+    broken, healthy = servers("nunca", status=503), servers("olá mundo")
+    model = RouterChatModel.from_backends({"a": broken.chat, "b": healthy.chat}, min_samples=1)
+
+    assert asyncio.run(model.ainvoke("oi")).content.strip() == "olá mundo"
+    assert stats(model)["a"].error_rate == 1.0 and stats(model)["b"].samples == 1
+    assert model.router.ranked() == ["b", "a"]
+    assert model.invoke("oi").content.strip() == "olá mundo"
+
+
+def test_fails_over_when_first_token_times_out(servers):
+    slow, fast = servers("lento", delay=2.0), servers("rápido")
+    model = RouterChatModel.from_backends({"a": slow.chat, "b": fast.chat}, first_token_timeout=0.3)
+
+    started = time.monotonic()
+    assert asyncio.run(model.ainvoke("oi")).content.strip() == "rápido"
+    assert time.monotonic() - started < 1.5
+    assert stats(model)["a"].error_rate == 1.0
+
+
+def test_hedge_returns_whoever_answers_first(servers):
+    slow, fast = servers("lento", delay=1.0), servers("rápido")
+    model = RouterChatModel.from_backends({"a": slow.chat, "b": fast.chat}, hedge_after=0.1)
+
+    async def collect():
+        return [chunk.content async for chunk in model.astream("oi")]
+
+    started = time.monotonic()
+    assert "".join(asyncio.run(collect())).strip() == "rápido"
+    assert time.monotonic() - started < 0.9
+    assert (slow.calls, fast.calls) == (1, 1)
+    # o perdedor cancelado não conta como erro; o vencedor ganha a medição
+    assert stats(model)["a"].samples == 0 and stats(model)["b"].samples == 1
+    assert model.router.ranked() == ["b", "a"]
+
+
+def test_raises_when_every_backend_fails(servers):
+    model = RouterChatModel.from_backends({"a": servers("x", status=500).chat})
+    with pytest.raises(Exception):
+        asyncio.run(model.ainvoke("oi"))
+
+
+def test_bind_tools_keeps_shared_stats(servers):
+    from langchain_core.tools import tool
+
+    @tool
+    def agora() -> str:
+        """Data e hora atuais."""
+        return "agora"
+
+    model = RouterChatModel.from_backends({"a": servers("ok").chat})
+    bound = model.bind_tools([agora])
+    assert bound.router is model.router
+    assert bound.backends["a"] is not model.backends["a"]
@@ -0,0 +1,139 @@
+import sys
+import pathlib
+import asyncio
+import json
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import pytest
+
+pytest.importorskip("aiohttp")
+from aiohttp.test_utils import TestClient, TestServer
+
+from server import AssistantServer
+
+
+class FakeChatbot:
+    """achatbot falso: responde palavra a palavra; ``gate`` segura a resposta até ser liberado."""
+
+    def __init__(self):
+        self.gate = None
+        self.started = 0
+        self.cancelled = 0
+
+    async def __call__(self, user_input, thread_id):
+        self.started += 1
+        try:
+            if self.gate is not None:
+                await self.gate.wait()
+            yield [{"ferramenta": "GetEmails", "resultado": "2 e-mails"}]
+            for word in f"resposta para {user_input['content']}".split(" "):
+                yield word + " "
+        except (asyncio.CancelledError, GeneratorExit):
+            self.cancelled += 1
+            raise
+
+
+def events(body):
+    parsed = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        parsed.append((lines["event"], json.loads(lines["data"])))
+    return parsed
+
+
+def run(scenario, tmp_path, **options):
+    chatbot = FakeChatbot()
+    server = AssistantServer(chatbot, backend="local", db_path=str(tmp_path / "server.db"), **options)
+
+    async def main():
+        async with TestClient(TestServer(server.app(), handler_cancellation=True)) as client:
+            await scenario(client, chatbot, server)
+
+    asyncio.run(main())
+
+
+def test_streams_a_turn_and_stores_the_conversation(tmp_path):
+    async def scenario(client, chatbot, server):
+        thread_id = (await (await client.post("/conversations")).json())["thread_id"]
+        response = await client.post(f"/conversations/{thread_id}/messages", json={"content": "oi"})
+        assert response.headers["Content-Type"].startswith("text/event-stream")
+        stream = events(await response.text())
+
+        assert [name for name, _ in stream] == ["start", "sources", "token", "token", "token", "done"]
+        assert stream[-1][1]["text"] == "resposta para oi "
+
+        stored = await (await client.get(f"/conversations/{thread_id}")).json()
+        assert [m["role"] for m in stored["messages"]] == ["user", "assistant"]
+        assert stored["messages"][1]["sources"][0]["ferramenta"] == "GetEmails"
+        page = await (await client.get("/conversations")).json()
+        assert page["items"][0]["thread_id"] == thread_id and page["items"][0]["title"]
+
+    run(scenario, tmp_path, limits={"local": 1})
+
+
+def test_queues_then_rejects_when_the_backend_is_full(tmp_path):
+    async def scenario(client, chatbot, server):
+        chatbot.gate = asyncio.Event()
+        first = asyncio.ensure_future(client.post("/conversations/a/messages", json={"content": "1"}))
+        while chatbot.started < 1:
+            await asyncio.sleep(0.01)
+        second = await client.post("/conversations/b/messages", json={"content": "2"}, headers={"X-Client-Id": "b"})
+        # o segundo está na fila: recebe a posição antes de qualquer token
+        assert await second.content.readuntil(b"\n\n") == b'event: queued\ndata: {"position": 1, "backend": "local"}\n\n'
+
+        rejected = await client.post("/conversations/c/messages", json={"content": "3"})
+        assert rejected.status == 429
+        assert int(rejected.headers["Retry-After"]) >= 1
+        busy = await client.post("/conversations/a/messages", json={"content": "de novo"})
+        assert busy.status == 409
+
+        chatbot.gate.set()
+        assert events(await (await first).text())[-1][0] == "done"
+        assert events((await second.content.read()).decode())[-1][0] == "done"
+        assert (await (await client.get("/health")).json())["running"] == 0
+
+    run(scenario, tmp_path, limits={"local": 1}, max_queue=1)
+
+
+def test_client_disconnect_cancels_generation_and_frees_the_slot(tmp_path):
+    async def scenario(client, chatbot, server):
+        chatbot.gate = asyncio.Event()
+        response = await client.post("/conversations/a/messages", json={"content": "oi"})
+        assert (await response.content.readuntil(b"\n\n")).startswith(b"event: start")
+        response.close()
+
+        for _ in range(100):
+            if chatbot.cancelled:
+                break
+            await asyncio.sleep(0.01)
+        assert chatbot.cancelled == 1
+        assert (await (await client.get("/health")).json())["running"] == 0
+        stored = await (await client.get("/conversations/a")).json()
+        assert stored["messages"] == []
+
+    run(scenario, tmp_path, limits={"local": 1})
+
+
+def test_invalid_query_parameters_are_bad_requests(tmp_path):
+    async def scenario(client, chatbot, server):
+        for url in (
+            "/conversations?limit=abc",
+            "/conversations?limit=0",
+            "/conversations?cursor=semseparador",
+            "/conversations/search?q=oi&limit=x",
+            "/conversations/t?before=ontem",
+            "/conversations/t?limit=-1",
+        ):
+            assert (await client.get(url)).status == 400, url
+
+    run(scenario, tmp_path)
+
+
+def test_router_mode_admits_the_sum_of_its_backends(tmp_path):
+    db_path = str(tmp_path / "server.db")
+    limits = {"local": 2, "openrouter": 8}
+    server = AssistantServer(FakeChatbot(), backend="router", router_backends=["local", "openrouter"], limits=limits, db_path=db_path)
+    assert server.max_concurrent == 10
+    server = AssistantServer(FakeChatbot(), backend="router", router_backends=["local"], limits={**limits, "router": 3}, db_path=db_path)
+    assert server.max_concurrent == 3
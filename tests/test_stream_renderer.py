@@ -0,0 +1,47 @@
+import sys
+import pathlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from stream_renderer import StreamRenderer
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_flushes_on_interval_and_size_and_always_at_the_end():
+    clock, writes = Clock(), []
+    with StreamRenderer(writes.append, interval=0.1, min_chars=10, clock=clock) as renderer:
+        for chunk in ["a", "b", "c"]:
+            renderer.add(chunk)
+        assert writes == []
+
+        clock.now = 0.2
+        renderer.add("d")
+        assert writes == ["abcd"]
+
+        renderer.add("0123456789")
+        assert writes[-1] == "abcd0123456789"
+
+        renderer.add("fim")
+        assert renderer.text == "abcd0123456789fim"
+    assert writes[-1] == "abcd0123456789fim"
+
+    stats = renderer.stats
+    assert (stats.chunks, stats.chars, stats.flushes) == (6, 17, 3)
+    assert stats.bytes_sent == 4 + 14 + 17
+
+
+def test_close_without_new_text_does_not_rewrite():
+    writes = []
+    renderer = StreamRenderer(writes.append, min_chars=1)
+    renderer.add("x")
+    renderer.add("")
+    renderer.close()
+    assert writes == ["x"]
+    assert renderer.stats.flushes == 1
@@ -0,0 +1,62 @@
+import sys
+import pathlib
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import token_accounting
+from token_accounting import (
+    StreamTokenCounter,
+    count_tokens,
+    normalize_model_name,
+    resolve_encoding_name,
+)
+
+
+class FakeEncoding:
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text):
+        self.calls += 1
+        return text.split()
+
+
+def test_resolve_encoding_name():
+    assert normalize_model_name("openchat/openchat-3.5") == "openchat-3.5"
+    assert normalize_model_name("llama3:8b-instruct") == "llama3"
+    assert resolve_encoding_name("openai/gpt-4o-mini") == "o200k_base"
+    assert resolve_encoding_name("gpt-4") == "cl100k_base"
+    assert resolve_encoding_name("mistral") == "cl100k_base"
+    assert resolve_encoding_name("algum-modelo-novo") == token_accounting.DEFAULT_ENCODING
+
+
+def test_o200k_models_count_with_their_own_tokenizer():
+    tiktoken = pytest.importorskip("tiktoken")
+    text = "Relatório trimestral de operações — revisão às 14h"
+    try:
+        expected = len(tiktoken.get_encoding("o200k_base").encode(text))
+    except Exception:
+        pytest.skip("o200k_base indisponível (sem acesso para baixar o encoding)")
+
+    assert count_tokens(text, "openai/gpt-4o-mini") == expected
+    assert count_tokens(text, "gpt-4o") != count_tokens(text, "gpt-4")
+
+
+def test_stream_counter_counts_once(monkeypatch):
+    fake = FakeEncoding()
+    monkeypatch.setattr(token_accounting, "encoding_for_model", lambda model_name: fake)
+
+    counter = StreamTokenCounter("mistral")
+    for chunk in ["uma ", "resposta ", "em ", "partes"]:
+        counter.add(chunk)
+    assert fake.calls == 0
+
+    assert counter.total() == 4
+    assert counter.total_async().result(timeout=5) == 4
+    assert fake.calls == 2
+
+
+def test_count_tokens_empty_text():
+    assert count_tokens("") == 0
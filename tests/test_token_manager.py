@@ -0,0 +1,167 @@
+import sys
+import types
+import threading
+import pathlib
+import importlib.util
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+class FakeCache:
+    def __init__(self):
+        self.state = "{}"
+        self.has_state_changed = False
+
+    def deserialize(self, data):
+        self.state = data
+
+    def serialize(self):
+        return self.state
+
+
+class FakeApp:
+    instances = 0
+
+    def __init__(self, client_id=None, authority=None, token_cache=None):
+        FakeApp.instances += 1
+        self.cache = token_cache
+        self.silent_calls = []
+        self.interactive_calls = 0
+        self.expires_in = 3600
+
+    def get_accounts(self):
+        return [{"username": "user"}] if self.interactive_calls or self.cache.state != "{}" else []
+
+    def _issue(self):
+        self.cache.state = f'{{"n": {len(self.silent_calls) + self.interactive_calls}}}'
+        self.cache.has_state_changed = True
+        return {"access_token": f"token-{len(self.silent_calls)}", "expires_in": self.expires_in}
+
+    def acquire_token_silent(self, scopes, account, force_refresh=False):
+        self.silent_calls.append(force_refresh)
+        return self._issue()
+
+    def acquire_token_interactive(self, scopes):
+        self.interactive_calls += 1
+        return self._issue()
+
+
+def load_token_manager():
+    # test_mail substitui token_manager em sys.modules; carrega o módulo real
+    # com um msal falso, sem deixar nenhum dos dois registrado
+    fake_msal = types.ModuleType("msal")
+    fake_msal.SerializableTokenCache = FakeCache
+    fake_msal.PublicClientApplication = FakeApp
+    saved = sys.modules.get("msal")
+    sys.modules["msal"] = fake_msal
+    try:
+        spec = importlib.util.spec_from_file_location("token_manager_under_test", ROOT / "token_manager.py")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        if saved is None:
+            del sys.modules["msal"]
+        else:
+            sys.modules["msal"] = saved
+    return module
+
+
+token_manager = load_token_manager()
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    # o timer de renovação é disparado à mão nos testes
+    timers = []
+
+    class FakeTimer:
+        def __init__(self, delay, fn):
+            self.delay, self.fn, self.daemon = delay, fn, False
+            timers.append(self)
+
+        def start(self):
+            pass
+
+        def cancel(self):
+            timers.remove(self)
+
+    monkeypatch.setattr(token_manager.threading, "Timer", FakeTimer)
+    tm = token_manager.TokenManager(cache_path=str(tmp_path / "token_cache.json"))
+    tm.timers = timers
+    yield tm
+    tm.close()
+
+
+def test_shared_instance_is_created_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(token_manager.TokenManager, "_shared", None)
+    created = FakeApp.instances
+    first = token_manager.TokenManager.shared(str(tmp_path / "cache.json"))
+    assert token_manager.TokenManager.shared() is first
+    assert FakeApp.instances == created + 1
+
+
+def test_token_is_kept_in_memory_until_close_to_expiry(manager, monkeypatch):
+    assert manager.get_access_token() == "token-0"
+    assert manager.get_access_token() == "token-0"
+    assert manager.app.interactive_calls == 1
+    assert manager.app.silent_calls == []
+
+    now = token_manager.time.time()
+    monkeypatch.setattr(token_manager.time, "time", lambda: now + 3600 - 30)
+    assert manager.get_access_token() == "token-1"
+    assert manager.app.silent_calls == [False]
+
+
+def test_refresh_runs_before_expiry(manager):
+    manager.get_access_token()
+    (timer,) = manager.timers
+    assert timer.delay == pytest.approx(3600 - token_manager.REFRESH_MARGIN, abs=5)
+
+    timer.fn()
+    assert manager.app.silent_calls == [True]
+    assert manager.get_access_token() == "token-1"
+    # a renovação agenda a próxima
+    assert manager.timers[-1] is not timer
+
+
+def test_cache_file_written_atomically_only_when_changed(manager):
+    path = pathlib.Path(manager.cache_path)
+    manager.get_access_token()
+    assert path.read_text() == '{"n": 1}'
+    assert not pathlib.Path(f"{path}.tmp").exists()
+
+    path.write_text("sentinel")
+    manager.persist_cache()
+    assert path.read_text() == "sentinel"
+
+
+def test_slow_refresh_does_not_block_callers_with_a_valid_token(manager, monkeypatch):
+    assert manager.get_access_token() == "token-0"
+    started, release = threading.Event(), threading.Event()
+    issue = manager.app.acquire_token_silent
+
+    def slow_silent(scopes, account, force_refresh=False):
+        started.set()
+        release.wait(5)
+        return issue(scopes, account, force_refresh)
+
+    monkeypatch.setattr(manager.app, "acquire_token_silent", slow_silent)
+    (timer,) = manager.timers
+    refresh = threading.Thread(target=timer.fn)
+    refresh.start()
+    assert started.wait(5)
+
+    # a renovação está presa na rede, mas o token atual ainda vale
+    answered = []
+    caller = threading.Thread(target=lambda: answered.append(manager.get_access_token()))
+    caller.start()
+    caller.join(1)
+    assert answered == ["token-0"]
+
+    release.set()
+    refresh.join(5)
+    assert manager.get_access_token() == "token-1"
@@ -0,0 +1,107 @@
+import sys
+import json
+import threading
+import pathlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import pytest
+
+import token_accounting
+import tool_output
+from tool_output import ToolOutputShaper, _fair_shares
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # um token por palavra (ou por linha JSON de cabeçalho) deixa as contas previsíveis
+    count = lambda text, model_name=None: len(text.split())
+    monkeypatch.setattr(tool_output, "count_tokens", count)
+    monkeypatch.setattr(token_accounting, "count_tokens", count)
+
+
+def test_fair_shares_give_leftover_to_longer_items():
+    assert _fair_shares([2, 50, 10, 50], 40) == [2, 14, 10, 14]
+    assert _fair_shares([3, 4], 100) == [3, 4]
+
+
+def test_list_of_emails_becomes_compact_lines_within_budget():
+    emails = [
+        {"id": "a", "subject": "curto", "body": "ok"},
+        {"id": "b", "subject": "longo", "body": " ".join(f"w{i}" for i in range(100))},
+    ]
+    shaper = ToolOutputShaper(budget_tokens=20)
+    lines = shaper.shape(emails, "GetEmails").split("\n")
+
+    first, second = (json.loads(line) for line in lines)
+    assert first == {"id": "a", "subject": "curto", "body": "ok"}
+    assert second["body"].startswith("w0 w1") and second["body"].endswith("…")
+    handle = second["mais"]
+    assert handle.startswith("h") and len(handle) > 6
+    assert shaper.last_report.tokens_after <= 20
+    assert shaper.last_report.tokens_dropped > 80
+
+    more = json.loads(shaper.read_more(f" '{handle}' "))
+    assert more["texto"].split()[0] == f"w{len(second['body'].split())}"
+    assert shaper.read_more("h99").startswith("Handle desconhecido")
+
+
+def test_items_that_do_not_fit_are_counted():
+    emails = [{"id": str(i), "subject": "assunto", "preview": "texto"} for i in range(10)]
+    shaper = ToolOutputShaper(budget_tokens=4)
+    lines = shaper.shape(emails, "GetEmails").split("\n")
+
+    assert json.loads(lines[-1]) == {"itens_omitidos": 8}
+    assert shaper.last_report.items_after == 2
+
+
+def test_dict_of_bodies_and_plain_strings():
+    shaper = ToolOutputShaper(budget_tokens=5)
+    assert json.loads(shaper.shape({"m1": "um dois"}, "GetEmailBodies")) == {"id": "m1", "body": "um dois"}
+
+    text = shaper.shape("uma resposta de erro bem longa demais", "X")
+    assert list(json.loads(text.split("\n")[1])) == ["mais"]
+
+
+def test_wrap_reports_each_call():
+    reports = []
+    shaper = ToolOutputShaper(budget_tokens=50)
+    wrapped = shaper.wrap(lambda status="unread": [{"id": status}], "GetEmails", on_report=reports.append)
+
+    assert wrapped(status="all") == '{"id":"all"}'
+    assert reports[0].tool_name == "GetEmails" and reports[0].tokens_dropped == 0
+
+
+def test_handles_belong_to_the_conversation_that_received_them():
+    shaper = ToolOutputShaper(budget_tokens=5, max_handles=2, max_owners=2)
+    text = shaper.shape("corpo de um e-mail privado bem longo " * 5, "GetEmailBodies", owner="alice")
+    handle = json.loads(text.split("\n")[1])["mais"]
+
+    assert shaper.read_more(handle, owner="bob").startswith("Handle desconhecido")
+    assert "texto" in json.loads(shaper.read_more(handle, owner="alice"))
+
+    # outras conversas não tiram os handles de alice, só o limite de donos
+    for n in range(3):
+        shaper.shape("texto comprido demais para caber " * 5, "X", owner="bob")
+    assert "texto" in json.loads(shaper.read_more(handle, owner="alice"))
+    shaper.shape("texto comprido demais para caber " * 5, "X", owner="carol")
+    shaper.shape("texto comprido demais para caber " * 5, "X", owner="dave")
+    assert shaper.read_more(handle, owner="alice").startswith("Handle desconhecido")
+
+
+def test_concurrent_calls_get_their_own_report_and_handles_are_bounded():
+    shaper = ToolOutputShaper(budget_tokens=5, max_handles=8)
+    reports = {}
+
+    def call(n):
+        wrapped = shaper.wrap(lambda: "palavra " * (10 * n), f"T{n}", on_report=lambda r: reports.setdefault(n, r))
+        wrapped()
+
+    threads = [threading.Thread(target=call, args=(n,)) for n in range(1, 33)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(report.tool_name == f"T{n}" for n, report in reports.items()) and len(reports) == 32
+    assert len(shaper._handles[""]) == 8
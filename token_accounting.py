@@ -0,0 +1,124 @@
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Optional
+
+DEFAULT_ENCODING = "cl100k_base"
+
+# prefixo do nome do modelo → encoding do tiktoken, só para os modelos cujo
+# tokenizer difere do DEFAULT_ENCODING. Os demais (GPT-4, GPT-3.5 e os modelos
+# abertos do Ollama / OpenRouter, que não têm encoding próprio no tiktoken)
+# ficam com cl100k_base: o tokenizer do Llama 3 é derivado dele e serve bem
+# para estimativas.
+_ENCODING_BY_PREFIX = [
+    ("gpt-4o", "o200k_base"),
+    ("gpt-4.1", "o200k_base"),
+    ("gpt-4.5", "o200k_base"),
+    ("o1", "o200k_base"),
+    ("o3", "o200k_base"),
+    ("o4", "o200k_base"),
+]
+
+# média de caracteres por token usada quando o tiktoken não está disponível
+_APPROX_CHARS_PER_TOKEN = 4
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="token-accounting")
+
+
+def normalize_model_name(model_name: Optional[str]) -> str:
+    """'openai/gpt-4o-mini' → 'gpt-4o-mini', 'llama3:8b' → 'llama3'."""
+    name = (model_name or "").strip().lower()
+    name = name.rsplit("/", 1)[-1]
+    return name.split(":", 1)[0]
+
+
+def resolve_encoding_name(model_name: Optional[str]) -> str:
+    """Nome do encoding do tiktoken mais adequado para ``model_name``."""
+    name = normalize_model_name(model_name)
+    for prefix, encoding in _ENCODING_BY_PREFIX:
+        if name.startswith(prefix):
+            return encoding
+    return DEFAULT_ENCODING
+
+
+class _ApproxEncoding:
+    """Substituto do tiktoken: estima pelo número de caracteres e palavras."""
+
+    name = "approx"
+
+    def encode(self, text: str) -> List[int]:
+        words = len(re.findall(r"\w+|[^\w\s]", text))
+        return [0] * max(words, -(-len(text) // _APPROX_CHARS_PER_TOKEN))
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str):
+    """Encoder do tiktoken, carregado uma vez por processo."""
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(encoding_name)
+    except Exception:
+        # sem tiktoken ou sem acesso para baixar o arquivo do encoding
+        return _ApproxEncoding()
+
+
+@lru_cache(maxsize=64)
+def encoding_for_model(model_name: Optional[str]):
+    return get_encoding(resolve_encoding_name(model_name))
+
+
+def count_tokens(text: str, model_name: Optional[str] = None) -> int:
+    """Conta os tokens de ``text`` com o encoding do modelo."""
+    if not text:
+        return 0
+    return len(encoding_for_model(model_name).encode(text))
+
+
+def truncate_to_tokens(
+    text: str, max_tokens: int, model_name: Optional[str] = None, mark: str = ""
+) -> str:
+    """Maior prefixo de ``text`` que cabe em ``max_tokens`` (seguido de ``mark`` se cortou)."""
+    if count_tokens(text, model_name) <= max_tokens:
+        return text
+    budget = max_tokens - count_tokens(mark, model_name)
+    # busca binária pelo tamanho do prefixo: serve para o tiktoken e para a estimativa
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid], model_name) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low].rstrip() + mark
+
+
+def count_tokens_async(text: str, model_name: Optional[str] = None) -> "Future[int]":
+    """Conta tokens numa thread de fundo, sem bloquear quem chamou."""
+    return _executor.submit(count_tokens, text, model_name)
+
+
+class StreamTokenCounter:
+    """Acumula os pedaços de uma resposta em streaming e conta tudo de uma vez.
+
+    ``add`` só guarda o texto, então não atrasa o ``yield`` de cada pedaço; a
+    contagem acontece em lote, o que também evita erros nas fronteiras entre
+    pedaços (um token pode vir dividido em dois chunks).
+    """
+
+    def __init__(self, model_name: Optional[str] = None):
+        self.model_name = model_name
+        self._chunks: List[str] = []
+
+    def add(self, text: str) -> None:
+        self._chunks.append(text)
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def total(self) -> int:
+        return count_tokens(self.text, self.model_name)
+
+    def total_async(self) -> "Future[int]":
+        return count_tokens_async(self.text, self.model_name)
@@ -1,11 +1,37 @@
+import logging
 import os
+import threading
+import time
 import msal
 from dotenv import load_dotenv
 
 # Carrega variáveis do .env
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# renova o token em segundo plano quando faltar esse tempo (segundos) para expirar
+REFRESH_MARGIN = 300
+# abaixo dessa folga o token em memória não é mais entregue
+EXPIRY_SKEW = 60
+
 class TokenManager:
+    """Fornece o token de acesso do Graph.
+
+    Use ``TokenManager.shared()``: uma instância por processo, com um único
+    ``PublicClientApplication`` (a descoberta da autoridade só acontece uma
+    vez) e o token guardado em memória com a validade. Um timer renova o
+    token antes de expirar; o arquivo de cache só é regravado quando muda.
+
+    Há duas travas: ``_lock`` protege só o token em memória (é segurada por
+    instantes) e ``_acquire_lock`` deixa uma única chamada de rede ao MSAL
+    por vez. Assim um endpoint de token lento não trava quem ainda tem um
+    token válido.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
     def __init__(self, cache_path="token_cache.json"):
         self.client_id = os.getenv("CLIENT_ID")
         self.tenant_id = os.getenv("TENANT_ID")
@@ -18,7 +44,8 @@ class TokenManager:
         self.token_cache = msal.SerializableTokenCache()
 
         if os.path.exists(self.cache_path):
-            self.token_cache.deserialize(open(self.cache_path, "r").read())
+            with open(self.cache_path, "r") as f:
+                self.token_cache.deserialize(f.read())
 
         self.app = msal.PublicClientApplication(
             client_id=self.client_id,
@@ -26,23 +53,104 @@ class TokenManager:
             token_cache=self.token_cache
         )
 
+        # token em memória
+        self._lock = threading.Lock()
+        # uma obtenção/renovação pela rede por vez (também evita dois logins interativos)
+        self._acquire_lock = threading.Lock()
+        self._access_token = None
+        self._expires_at = 0.0
+        self._refresh_timer = None
+
+    @classmethod
+    def shared(cls, cache_path="token_cache.json"):
+        """Instância compartilhada pelo processo (criada na primeira chamada)."""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls(cache_path)
+        return cls._shared
+
     def persist_cache(self):
         if self.token_cache.has_state_changed:
-            with open(self.cache_path, "w") as f:
+            # grava num arquivo temporário e troca, para nunca deixar um cache pela metade
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, "w") as f:
                 f.write(self.token_cache.serialize())
+            os.replace(tmp_path, self.cache_path)
+            self.token_cache.has_state_changed = False
+
+    def _cached_token(self):
+        with self._lock:
+            if self._access_token and time.time() < self._expires_at - EXPIRY_SKEW:
+                return self._access_token
+        return None
 
     def get_access_token(self):
-        accounts = self.app.get_accounts()
-        result = None
+        token = self._cached_token()
+        if token:
+            return token
+
+        with self._acquire_lock:
+            # outra thread pode ter obtido o token enquanto esta esperava
+            token = self._cached_token()
+            if token:
+                return token
+
+            accounts = self.app.get_accounts()
+            result = None
+
+            if accounts:
+                result = self.app.acquire_token_silent(self.scope, account=accounts[0])
 
-        if accounts:
-            result = self.app.acquire_token_silent(self.scope, account=accounts[0])
+            if not result:
+                result = self.app.acquire_token_interactive(scopes=self.scope)
 
-        if not result:
-            result = self.app.acquire_token_interactive(scopes=self.scope)
+            if "access_token" in result:
+                return self._store(result)
 
-        if "access_token" in result:
+            raise RuntimeError(f"Erro ao obter token: {result.get('error_description')}")
+
+    def _store(self, result):
+        with self._lock:
+            self._access_token = result["access_token"]
+            self._expires_at = time.time() + int(result.get("expires_in", 3600))
             self.persist_cache()
-            return result["access_token"]
+            self._schedule_refresh()
+            return self._access_token
+
+    def _schedule_refresh(self):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+        # o intervalo mínimo evita renovar em laço quando o token vem com validade curta
+        delay = max(self._expires_at - REFRESH_MARGIN - time.time(), EXPIRY_SKEW)
+        self._refresh_timer = threading.Timer(delay, self._refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _refresh(self):
+        """Renova o token em segundo plano usando o refresh token (nunca interativo)."""
+        with self._lock:
+            self._refresh_timer = None
+        # quem pede o token continua recebendo o atual enquanto a renovação roda
+        with self._acquire_lock:
+            accounts = self.app.get_accounts()
+            if not accounts:
+                return
+            try:
+                result = self.app.acquire_token_silent(
+                    self.scope, account=accounts[0], force_refresh=True
+                )
+            except Exception as exc:
+                logger.warning(f"⚠️ Falha ao renovar o token em segundo plano: {exc}")
+                return
+            if result and "access_token" in result:
+                self._store(result)
+            else:
+                # sem renovação: a próxima chamada obtém o token pelo caminho normal
+                logger.warning(f"⚠️ Token não renovado: {(result or {}).get('error_description')}")
 
-        raise RuntimeError(f"Erro ao obter token: {result.get('error_description')}")
+    def close(self):
+        with self._lock:
+            if self._refresh_timer is not None:
+                self._refresh_timer.cancel()
+                self._refresh_timer = None
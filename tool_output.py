@@ -0,0 +1,215 @@
+import json
+import secrets
+import threading
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+
+from token_accounting import count_tokens, truncate_to_tokens
+
+# campos de texto longo que podem ser cortados; o resto do item é sempre enviado
+TEXT_FIELDS = ("body", "preview")
+TRUNCATION_MARK = "…"
+# conteúdos cortados guardados para ReadMore, por conversa (os mais antigos saem primeiro)
+MAX_HANDLES = 256
+# conversas com handles guardados; as usadas há mais tempo saem inteiras
+MAX_OWNERS = 64
+
+
+class ToolOutputReport(NamedTuple):
+    tool_name: str
+    tokens_before: int
+    tokens_after: int
+    items_before: int
+    items_after: int
+    handles: int
+
+    @property
+    def tokens_dropped(self) -> int:
+        return max(self.tokens_before - self.tokens_after, 0)
+
+
+def _compact(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _fair_shares(costs: List[int], budget: int) -> List[int]:
+    """Divide ``budget`` entre os custos: quem precisa de menos que a parte igual
+    recebe só o que precisa e a sobra vai para os demais."""
+    shares = [0] * len(costs)
+    remaining = max(budget, 0)
+    left = len(costs)
+    for i in sorted(range(len(costs)), key=costs.__getitem__):
+        share = min(costs[i], remaining // left)
+        shares[i] = share
+        remaining -= share
+        left -= 1
+    return shares
+
+
+class ToolOutputShaper:
+    """Ajusta a saída das ferramentas a um orçamento de tokens por chamada.
+
+    Listas de dicts (e dicts ``{id: texto}``) viram uma linha JSON compacta
+    por item em vez do ``repr`` do Python. O orçamento é dividido entre os
+    campos de texto dos itens; cada texto mantém o começo, e o que foi
+    cortado fica guardado sob um handle (campo ``mais``) que o modelo passa
+    para a ferramenta ReadMore para ler a continuação.
+
+    Um objeto atende todas as sessões do processo: cada chamada monta o
+    próprio relatório (``shape_with_report``) e os handles são guardados por
+    dono (a conversa, ``owner``), com trava. Cada handle é um token aleatório
+    e só o dono que o recebeu consegue lê-lo; cada dono guarda até
+    ``max_handles`` handles e só os ``max_owners`` donos usados mais
+    recentemente são mantidos.
+    """
+
+    def __init__(
+        self,
+        budget_tokens: int,
+        model_name: Optional[str] = None,
+        *,
+        text_fields: Tuple[str, ...] = TEXT_FIELDS,
+        max_handles: int = MAX_HANDLES,
+        max_owners: int = MAX_OWNERS,
+    ):
+        self.budget_tokens = budget_tokens
+        self.model_name = model_name
+        self.text_fields = text_fields
+        self.max_handles = max_handles
+        self.max_owners = max_owners
+        # relatório da última chamada, de qualquer sessão; só para inspeção
+        self.last_report: Optional[ToolOutputReport] = None
+        self.tokens_dropped_total = 0
+        # dono -> (handle -> resto do texto)
+        self._handles: "OrderedDict[str, OrderedDict[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _tokens(self, text: str) -> int:
+        return count_tokens(text, self.model_name)
+
+    # ====== handles ======
+
+    def _store(self, rest: str, owner: str) -> str:
+        handle = f"h{secrets.token_urlsafe(6)}"
+        with self._lock:
+            handles = self._handles.get(owner)
+            if handles is None:
+                handles = self._handles[owner] = OrderedDict()
+            self._handles.move_to_end(owner)
+            handles[handle] = rest
+            while len(handles) > self.max_handles:
+                handles.popitem(last=False)
+            while len(self._handles) > self.max_owners:
+                self._handles.popitem(last=False)
+        return handle
+
+    def _cut(self, text: str, budget: int, owner: str) -> Tuple[str, Optional[str]]:
+        """(começo de ``text`` dentro de ``budget``, handle do resto ou None)."""
+        head = truncate_to_tokens(text, budget, self.model_name, mark=TRUNCATION_MARK)
+        if head == text:
+            return text, None
+        kept = head[: -len(TRUNCATION_MARK)]
+        return head, self._store(text[len(kept):].lstrip(), owner)
+
+    def read_more(self, handle: str, owner: str = "") -> str:
+        """Continuação de um conteúdo cortado, também limitada ao orçamento."""
+        handle = handle.strip().strip("'\"")
+        with self._lock:
+            rest = self._handles.get(owner, {}).get(handle)
+        if rest is None:
+            return f"Handle desconhecido ou expirado: {handle}"
+        text, more = self._cut(rest, self.budget_tokens, owner)
+        return _compact({"texto": text, "mais": more} if more else {"texto": text})
+
+    # ====== formatação ======
+
+    def _items(self, result: Any) -> Optional[List[dict]]:
+        if isinstance(result, list) and all(isinstance(item, dict) for item in result):
+            return [dict(item) for item in result]
+        if isinstance(result, dict) and result and all(isinstance(v, str) for v in result.values()):
+            return [{"id": key, self.text_fields[0]: value} for key, value in result.items()]
+        return None
+
+    def shape(self, result: Any, tool_name: str = "", owner: str = "") -> str:
+        return self.shape_with_report(result, tool_name, owner)[0]
+
+    def shape_with_report(self, result: Any, tool_name: str = "", owner: str = "") -> Tuple[str, ToolOutputReport]:
+        """Saída ajustada ao orçamento e o relatório desta chamada.
+
+        Os handles do que foi cortado ficam guardados para ``owner``. Listas
+        perdem itens do fim quando nem os cabeçalhos cabem: só os primeiros
+        ``report.items_after`` itens chegam ao modelo.
+        """
+        items = self._items(result)
+        if items is None:
+            text = result if isinstance(result, str) else _compact(result)
+            before = self._tokens(text)
+            shaped, more = self._cut(text, self.budget_tokens, owner)
+            if more:
+                shaped += "\n" + _compact({"mais": more})
+            return shaped, self._report(tool_name, before, self._tokens(shaped), 1, 1, int(more is not None))
+
+        before = sum(self._tokens(_compact(item)) for item in items)
+        # cabeçalhos (campos curtos) primeiro; itens que não cabem nem assim saem do fim
+        heads = [
+            {k: v for k, v in item.items() if k not in self.text_fields} for item in items
+        ]
+        budget = self.budget_tokens
+        kept = 0
+        for head in heads:
+            cost = self._tokens(_compact(head)) + 1
+            if cost > budget:
+                break
+            budget -= cost
+            kept += 1
+        items, heads = items[:kept], heads[:kept]
+
+        fields = [
+            (i, field)
+            for i, item in enumerate(items)
+            for field in self.text_fields
+            if isinstance(item.get(field), str) and item[field]
+        ]
+        costs = [self._tokens(items[i][field]) for i, field in fields]
+        handles = 0
+        for (i, field), share in zip(fields, _fair_shares(costs, budget)):
+            if share:
+                text, more = self._cut(items[i][field], share, owner)
+            else:
+                text, more = "", self._store(items[i][field], owner)
+            heads[i][field] = text
+            if more:
+                heads[i]["mais" if "mais" not in heads[i] else f"mais_{field}"] = more
+                handles += 1
+
+        lines = [_compact(head) for head in heads]
+        if kept < len(result):
+            lines.append(_compact({"itens_omitidos": len(result) - kept}))
+        shaped = "\n".join(lines)
+        return shaped, self._report(tool_name, before, self._tokens(shaped), len(result), kept, handles)
+
+    def _report(self, tool_name, before, after, items_before, items_after, handles) -> ToolOutputReport:
+        report = ToolOutputReport(tool_name, before, after, items_before, items_after, handles)
+        with self._lock:
+            self.last_report = report
+            self.tokens_dropped_total += report.tokens_dropped
+        return report
+
+    def wrap(
+        self,
+        fn: Callable,
+        tool_name: str,
+        on_report: Optional[Callable[[ToolOutputReport], None]] = None,
+    ) -> Callable:
+        """Versão de ``fn`` que devolve a saída já ajustada ao orçamento."""
+
+        @wraps(fn)
+        def shaped(*args, **kwargs) -> str:
+            # o relatório vem da própria chamada: outra sessão pode estar usando o mesmo objeto
+            output, report = self.shape_with_report(fn(*args, **kwargs), tool_name)
+            if on_report is not None:
+                on_report(report)
+            return output
+
+        return shaped